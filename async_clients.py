@@ -0,0 +1,70 @@
+import os
+import asyncio
+import httpx
+import rate_limiter
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST")
+OPENSEARCH_USER = os.getenv("OPENSEARCH_USER")
+OPENSEARCH_PASS = os.getenv("OPENSEARCH_PASS")
+
+# Caps on in-flight outbound calls shared by every conversation in the process
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "32"))
+OPENSEARCH_CONCURRENCY = int(os.getenv("OPENSEARCH_CONCURRENCY", "16"))
+OPENSEARCH_TIMEOUT = float(os.getenv("OPENSEARCH_TIMEOUT", "10"))
+
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+opensearch_client = httpx.AsyncClient(
+    base_url=OPENSEARCH_HOST or "",
+    auth=(OPENSEARCH_USER or "", OPENSEARCH_PASS or ""),
+    headers={"Content-Type": "application/json"},
+    limits=httpx.Limits(max_connections=OPENSEARCH_CONCURRENCY),
+    timeout=OPENSEARCH_TIMEOUT
+)
+
+openai_slots = asyncio.Semaphore(OPENAI_CONCURRENCY)
+opensearch_slots = asyncio.Semaphore(OPENSEARCH_CONCURRENCY)
+
+
+async def complete(messages, model="gpt-3.5-turbo", priority=rate_limiter.NORMAL):
+    estimated = rate_limiter.estimate_tokens(messages=messages)
+    await rate_limiter.limiter.acquire_async(priority, estimated)
+    async with openai_slots:
+        try:
+            response = await openai_client.chat.completions.create(model=model, messages=messages)
+        except Exception as e:
+            if rate_limiter.is_rate_limit(e):
+                rate_limiter.limiter.throttle()
+            raise
+    rate_limiter.limiter.settle(estimated, rate_limiter.usage_tokens(response))
+    return response
+
+
+async def embed(texts, model="text-embedding-ada-002", priority=rate_limiter.NORMAL):
+    await rate_limiter.limiter.acquire_async(priority, rate_limiter.estimate_tokens(texts=texts))
+    async with openai_slots:
+        try:
+            response = await openai_client.embeddings.create(model=model, input=texts)
+        except Exception as e:
+            if rate_limiter.is_rate_limit(e):
+                rate_limiter.limiter.throttle()
+            raise
+    return [item.embedding for item in response.data]
+
+
+async def warm():
+    # Opens the pooled connections; run it on the event loop that will use them
+    async with opensearch_slots:
+        res = await opensearch_client.request("HEAD", "/")
+    res.raise_for_status()
+    async with openai_slots:
+        await openai_client.models.list()
+    return f"opensearch status {res.status_code}, openai connected"
+
+
+async def search(index_name, query):
+    async with opensearch_slots:
+        return await opensearch_client.request("GET", f"/{index_name}/_search", json=query)
@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import catalog
+import records
+import catalog_snapshot
+
+# Validates the catalog sources and compiles them into one binary snapshot for
+# catalog.py to memory-map (see catalog_snapshot.py for the layout).
+#
+#   python build_catalog_snapshot.py                       # writes catalog.snapshot, next version
+#   python build_catalog_snapshot.py --output /srv/catalog.snapshot --version 42
+#   python build_catalog_snapshot.py --check               # validate only
+#
+# Replicas watching the output path switch to the new snapshot within
+# CATALOG_SNAPSHOT_RELOAD_INTERVAL seconds; the file is replaced atomically.
+
+SOURCES = {
+    "fibre-offers-ssa": "btl_offers.json",
+    "fibre-recommendation-ssa": "fibre_recommendation_matrix_ssa.json",
+    "mobile-recommendation-ssa": "mobile_recommendation_matrix_ssa.json",
+    "clarifications-ssa": "clarifications_ssa.json"
+}
+MATRIX_REQUIRED = ["offerId", "intent", "relationship_status", "home_size", "postal_code_prefix", "link"]
+OFFER_REQUIRED = ["offerId", "Plan Name", "Monthly price", "Contract policy"]
+
+
+def read_bulk(path, index_name, errors):
+    # Bulk files alternate an action line naming the index with the document
+    docs, expect_doc = [], False
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                doc = json.loads(line)
+            except ValueError as e:
+                errors.append(f"{path}:{number}: invalid JSON ({e})")
+                continue
+            if "index" in doc:
+                if doc["index"].get("_index") != index_name:
+                    errors.append(f"{path}:{number}: action targets {doc['index'].get('_index')!r}, "
+                                  f"expected {index_name!r}")
+                expect_doc = True
+                continue
+            if not expect_doc:
+                errors.append(f"{path}:{number}: document without an index action")
+            docs.append((number, doc))
+            expect_doc = False
+    return docs
+
+
+def check_unique(path, docs, key, errors):
+    seen = {}
+    for number, doc in docs:
+        value = key(doc)
+        if value in seen:
+            errors.append(f"{path}:{number}: duplicate {value!r} (first at line {seen[value]})")
+        seen.setdefault(value, number)
+
+
+def check_required(path, docs, fields, errors):
+    for number, doc in docs:
+        missing = [field for field in fields if doc.get(field) in (None, "")]
+        if missing:
+            errors.append(f"{path}:{number}: missing {', '.join(missing)}")
+
+
+def validate(base_dir):
+    errors = []
+    docs = {index: read_bulk(os.path.join(base_dir, path), index, errors) for index, path in SOURCES.items()}
+
+    offers = docs["fibre-offers-ssa"]
+    check_required(SOURCES["fibre-offers-ssa"], offers, OFFER_REQUIRED, errors)
+    check_unique(SOURCES["fibre-offers-ssa"], offers, lambda doc: doc.get("offerId"), errors)
+    for number, doc in offers:
+        if not isinstance(doc.get("Monthly price"), (int, float)):
+            errors.append(f"{SOURCES['fibre-offers-ssa']}:{number}: Monthly price is not a number")
+
+    for index in ["fibre-recommendation-ssa", "mobile-recommendation-ssa"]:
+        check_required(SOURCES[index], docs[index], MATRIX_REQUIRED, errors)
+        check_unique(SOURCES[index], docs[index], lambda doc: doc.get("offerId"), errors)
+
+    # Every fibre recommendation must render from an offer
+    offer_ids = {doc.get("offerId") for _, doc in offers}
+    for number, doc in docs["fibre-recommendation-ssa"]:
+        if doc.get("offerId") not in offer_ids:
+            errors.append(f"{SOURCES['fibre-recommendation-ssa']}:{number}: offer {doc.get('offerId')!r} "
+                          f"not in {SOURCES['fibre-offers-ssa']}")
+    if not any(catalog.is_fallback(doc) for _, doc in docs["fibre-recommendation-ssa"]
+               if all(key in doc for key in MATRIX_REQUIRED)):
+        errors.append(f"{SOURCES['fibre-recommendation-ssa']}: no fallback row (all fields 'any')")
+
+    clarifications = docs["clarifications-ssa"]
+    path = SOURCES["clarifications-ssa"]
+    check_unique(path, clarifications, clarification_key, errors)
+    # Questions are fetched by sequence until one is missing, so a gap hides the rest
+    sequences = {}
+    for number, doc in clarifications:
+        meta = doc.get("metadata", {})
+        if not doc.get("text") or not isinstance(meta.get("sequence"), int):
+            errors.append(f"{path}:{number}: needs text and an integer metadata.sequence")
+            continue
+        sequences.setdefault((meta.get("intent"), meta.get("sub_status")), []).append(meta["sequence"])
+    for (intent, sub_status), found in sequences.items():
+        if sorted(found) != list(range(1, len(found) + 1)):
+            errors.append(f"{path}: {intent}/{sub_status} sequences {sorted(found)} are not 1..{len(found)}")
+
+    return {index: [doc for _, doc in found] for index, found in docs.items()}, errors
+
+
+def clarification_key(doc):
+    meta = doc.get("metadata", {})
+    return f"{meta.get('intent')}|{meta.get('sub_status')}|{meta.get('sequence')}"
+
+
+def source_digest(base_dir):
+    digest = hashlib.sha256()
+    for path in SOURCES.values():
+        with open(os.path.join(base_dir, path), "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+def tables(docs):
+    offers = [records.Offer.from_source(doc) for doc in docs["fibre-offers-ssa"]]
+    fibre = [records.MatrixRow.from_source(doc) for doc in docs["fibre-recommendation-ssa"]]
+    mobile = [records.MatrixRow.from_source(doc) for doc in docs["mobile-recommendation-ssa"]]
+    by_id = {offer.offerId: offer for offer in offers}
+    # The rendered reply for each matrix row, as catalog.compile_catalog builds it
+    recommendations = [{"offerId": row.offerId, "text": catalog.render_recommendation(row, by_id[row.offerId])}
+                       for row in fibre]
+    clarifications = [
+        dict(doc["metadata"], text=doc["text"], key=clarification_key(doc))
+        for doc in docs["clarifications-ssa"]
+    ]
+    return {
+        "offers": (list(records.Offer.__slots__), offers, "offerId"),
+        "fibre_matrix": (list(records.MatrixRow.__slots__), fibre, "offerId"),
+        "mobile_matrix": (list(records.MatrixRow.__slots__), mobile, "offerId"),
+        "recommendations": (["offerId", "text"], recommendations, "offerId"),
+        "clarifications": (["key", "text", "intent", "sub_status", "sequence", "emotion"], clarifications, "key")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the catalog sources and build a binary snapshot")
+    parser.add_argument("--source-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--output", default=catalog_snapshot.CATALOG_SNAPSHOT)
+    parser.add_argument("--version", type=int, help="catalog version (default: the current snapshot's + 1)")
+    parser.add_argument("--check", action="store_true", help="validate the sources without writing")
+    args = parser.parse_args()
+
+    docs, errors = validate(args.source_dir)
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(f"{len(errors)} problems in the catalog sources; no snapshot written")
+    print("[DEBUG] Sources valid: " + ", ".join(f"{index}={len(found)}" for index, found in docs.items()))
+    if args.check:
+        return
+
+    version = args.version
+    if version is None:
+        try:
+            current = catalog_snapshot.open_snapshot(args.output)
+        except Exception as e:
+            print(f"[ERROR] Cannot read the current snapshot ({e}); numbering from 1")
+            current = None
+        version = current.version + 1 if current else 1
+    size = catalog_snapshot.write(args.output, tables(docs), version, source_digest(args.source_dir))
+    print(f"[DEBUG] Wrote catalog v{version} to {args.output} ({size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import argparse
+import requests
+from openai import OpenAI
+from dotenv import load_dotenv
+import intent_classifier
+
+# Offline calibration of the vector intent gate in chatbot-ssa.py.
+#
+#   python calibrate_intent.py                          # leave-one-out over ssa_examples.jsonl
+#   python calibrate_intent.py --labeled labeled.jsonl  # add held-out {"text", "intent"} lines
+#
+# Each example is embedded and searched against the live index; its own document
+# is dropped from the neighbours (leave-one-out) so the vote is scored as if the
+# text were new. The grid search keeps the (min_score, min_margin) pair that lets
+# the most turns skip the LLM while confident votes stay at the target precision.
+
+load_dotenv(dotenv_path=".env")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST")
+OPENSEARCH_USER = os.getenv("OPENSEARCH_USER")
+OPENSEARCH_PASS = os.getenv("OPENSEARCH_PASS")
+INDEX_NAME = "smartshopper-index"
+
+if not all([OPENAI_API_KEY, OPENSEARCH_HOST, OPENSEARCH_USER, OPENSEARCH_PASS]):
+    raise ValueError("Missing one or more environment variables in .env")
+
+client = OpenAI(api_key=OPENAI_API_KEY)
+SCORE_GRID = [round(0.5 + 0.02 * i, 2) for i in range(25)]
+MARGIN_GRID = [round(0.05 * i, 2) for i in range(21)]
+
+
+def load_examples(path, leave_one_out):
+    examples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            if "index" in doc:
+                continue
+            intent = doc.get("intent") or doc.get("metadata", {}).get("intent", "unknown")
+            examples.append({"text": doc["text"], "intent": intent, "leave_one_out": leave_one_out})
+    return examples
+
+
+def embed_batch(texts, batch_size=100):
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        response = client.embeddings.create(model="text-embedding-ada-002", input=texts[i:i + batch_size])
+        vectors.extend(item.embedding for item in response.data)
+    return vectors
+
+
+def neighbours(example, vector, k):
+    # One extra neighbour so the example's own document can be dropped
+    response = requests.get(
+        f"{OPENSEARCH_HOST}/{INDEX_NAME}/_search",
+        auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
+        headers={"Content-Type": "application/json"},
+        json=intent_classifier.intent_vector_query(vector, k + 1)
+    )
+    if response.status_code != 200:
+        print("[ERROR]", response.status_code, response.text)
+        return []
+    hits = response.json()["hits"]["hits"]
+    if example["leave_one_out"]:
+        for i, hit in enumerate(hits):
+            if hit["_source"]["text"] == example["text"]:
+                del hits[i]
+                break
+    return hits[:k]
+
+
+def evaluate(examples, hit_lists, min_score, min_margin):
+    confident = correct = 0
+    for example, hits in zip(examples, hit_lists):
+        vote = intent_classifier.vote_intent(hits, min_score, min_margin)
+        if vote["confident"]:
+            confident += 1
+            correct += vote["intent"] == example["intent"]
+    return confident, correct
+
+
+def calibrate(examples, hit_lists, target_precision):
+    best = None
+    for min_score in SCORE_GRID:
+        for min_margin in MARGIN_GRID:
+            confident, correct = evaluate(examples, hit_lists, min_score, min_margin)
+            if not confident or correct / confident < target_precision:
+                continue
+            # Prefer more coverage, then the stricter thresholds among ties
+            key = (confident, min_score, min_margin)
+            if best is None or key > best[0]:
+                best = (key, {"min_score": min_score, "min_margin": min_margin,
+                              "coverage": round(confident / len(examples), 4),
+                              "precision": round(correct / confident, 4)})
+    return best[1] if best else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the confidence gate for vector intent detection")
+    parser.add_argument("--examples", default="ssa_examples.jsonl", help="indexed examples (leave-one-out)")
+    parser.add_argument("--labeled", help="extra held-out JSON lines with text and intent")
+    parser.add_argument("--k", type=int, default=intent_classifier.DEFAULT_CALIBRATION["k"])
+    parser.add_argument("--target-precision", type=float, default=0.98)
+    parser.add_argument("--output", default=intent_classifier.INTENT_CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    examples = load_examples(args.examples, leave_one_out=True)
+    if args.labeled:
+        examples += load_examples(args.labeled, leave_one_out=False)
+    print(f"[DEBUG] Calibrating on {len(examples)} examples with k={args.k}")
+
+    vectors = embed_batch([example["text"] for example in examples])
+    hit_lists = [neighbours(example, vector, args.k) for example, vector in zip(examples, vectors)]
+
+    result = calibrate(examples, hit_lists, args.target_precision)
+    if result is None:
+        # Nothing reaches the target: keep thresholds no vote can meet so the LLM always confirms
+        print(f"[WARN] No thresholds reach {args.target_precision:.0%} precision; the gate stays closed.")
+        result = {"min_score": intent_classifier.DEFAULT_CALIBRATION["min_score"],
+                  "min_margin": intent_classifier.DEFAULT_CALIBRATION["min_margin"],
+                  "coverage": 0.0, "precision": None}
+    result.update({"k": args.k, "target_precision": args.target_precision, "examples": len(examples)})
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"[DEBUG] Wrote {args.output}: {result}")
+
+
+if __name__ == "__main__":
+    main()
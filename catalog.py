@@ -0,0 +1,405 @@
+import os
+import time
+import threading
+import requests
+import async_clients
+import records
+import catalog_snapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST")
+OPENSEARCH_USER = os.getenv("OPENSEARCH_USER")
+OPENSEARCH_PASS = os.getenv("OPENSEARCH_PASS")
+CLARIFICATION_INDEX = "clarifications-ssa"
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "300"))
+# Shared with the async client, so both pipelines give up on OpenSearch at the same point
+OPENSEARCH_TIMEOUT = async_clients.OPENSEARCH_TIMEOUT
+
+RECOMMENDATION_TEMPLATE = (
+    "We recommend the **{plan_name}**.\n"
+    "💰 Monthly Price: ${monthly_price}\n"
+    "📄 Contract: {contract}\n"
+    "🎁 Includes: {top_addons}\n"
+    "👉 Learn more: {link}"
+)
+
+# Pooled OpenSearch connection shared by chat turns and prefetch tasks
+session = requests.Session()
+session.auth = (OPENSEARCH_USER, OPENSEARCH_PASS)
+session.headers.update({"Content-Type": "application/json"})
+
+cache = {}
+cache_lock = threading.Lock()
+
+# Once serve_snapshot() has run and a compiled snapshot (build_catalog_snapshot.py)
+# is present, the catalog is read from its memory mapping instead of OpenSearch,
+# and a rebuilt snapshot is swapped in whole when the file changes.
+snapshot = None
+snapshot_views = None
+snapshot_failed_mtime = None
+snapshot_lock = threading.Lock()
+snapshot_watcher = None
+
+
+MISS = object()
+
+
+def cache_get(key):
+    now = time.time()
+    with cache_lock:
+        entry = cache.get(key)
+    if entry and entry[0] > now:
+        print(f"[CACHE] Hit: {key}")
+        return entry[1]
+    return MISS
+
+
+def cache_put(key, value, complete=bool):
+    # Only hits are cached: a failed or empty fetch is retried on the next turn
+    # instead of being served for the whole TTL
+    if complete(value):
+        with cache_lock:
+            cache[key] = (time.time() + CATALOG_TTL, value)
+    return value
+
+
+def views_for(snap):
+    fibre = catalog_snapshot.TableView(snap.table("fibre_matrix"), lambda row: records.MatrixRow(**row))
+    offers = catalog_snapshot.TableView(snap.table("offers"), lambda row: records.Offer(**row))
+    recommendations = catalog_snapshot.TableView(snap.table("recommendations"), lambda row: row["text"])
+    return {
+        "fibre-recommendation-ssa": fibre,
+        "fibre-offers-ssa": offers,
+        "mobile-recommendation-ssa": catalog_snapshot.TableView(snap.table("mobile_matrix"),
+                                                                lambda row: records.MatrixRow(**row)),
+        CLARIFICATION_INDEX: catalog_snapshot.TableView(snap.table("clarifications"), lambda row: row["text"]),
+        "compiled": {"matrix": fibre, "rows": fibre, "offers": offers, "recommendations": recommendations}
+    }
+
+
+def load_snapshot(path=catalog_snapshot.CATALOG_SNAPSHOT):
+    global snapshot, snapshot_views
+    snap = catalog_snapshot.open_snapshot(path)
+    if snap is None:
+        return None
+    views = views_for(snap)
+    with snapshot_lock:
+        # One reference swap: a turn sees either the old catalog or the new one
+        snapshot, snapshot_views = snap, views
+    return snap
+
+
+def reload_snapshot_if_changed(path=catalog_snapshot.CATALOG_SNAPSHOT):
+    global snapshot_failed_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    if mtime in (snapshot.mtime if snapshot else None, snapshot_failed_mtime):
+        return False
+    try:
+        load_snapshot(path)
+        return True
+    except Exception as e:
+        # Keep serving the last good catalog
+        snapshot_failed_mtime = mtime
+        print(f"[ERROR] Failed to load catalog snapshot {path}: {e}")
+        return False
+
+
+def watch_snapshot():
+    while True:
+        time.sleep(catalog_snapshot.CATALOG_SNAPSHOT_RELOAD_INTERVAL)
+        reload_snapshot_if_changed()
+
+
+def start_snapshot_watcher():
+    global snapshot_watcher
+    if catalog_snapshot.CATALOG_SNAPSHOT_RELOAD_INTERVAL <= 0:
+        return
+    with snapshot_lock:
+        if snapshot_watcher is None:
+            snapshot_watcher = threading.Thread(target=watch_snapshot, name="catalog-snapshot", daemon=True)
+            snapshot_watcher.start()
+
+
+def serve_snapshot():
+    # Called from the chatbot's startup, not at import: tools that import this module
+    # (the snapshot builder, evaluate.py, loadtest.py) neither map the file nor poll it
+    try:
+        load_snapshot()
+    except Exception as e:
+        print(f"[ERROR] Ignoring catalog snapshot {catalog_snapshot.CATALOG_SNAPSHOT}: {e}")
+    start_snapshot_watcher()
+
+
+def open_connections():
+    # Raises so the warm-up step records an unreachable or misconfigured OpenSearch
+    res = session.head(OPENSEARCH_HOST, timeout=5)
+    res.raise_for_status()
+    print(f"[DEBUG] OpenSearch connection warmed: {res.status_code}")
+    return f"status {res.status_code}"
+
+
+def clarification_query(intent, sub_status, step):
+    return {
+        "size": 1,
+        "query": {
+            "bool": {
+                "must": [
+                    {"term": {"metadata.intent": intent}},
+                    {"term": {"metadata.sub_status": sub_status}},
+                    {"term": {"metadata.sequence": step + 1}}
+                ]
+            }
+        }
+    }
+
+
+def clarification_text(status_code, data):
+    if status_code != 200:
+        print(f"[DEBUG] Clarification fetch failed: {status_code}")
+        return None
+
+    hits = data.get("hits", {}).get("hits", [])
+    if not hits:
+        print("[DEBUG] No clarification question found.")
+        return None
+
+    return hits[0]["_source"]["text"]
+
+
+def search(index_name, body):
+    return session.get(f"{OPENSEARCH_HOST}/{index_name}/_search", json=body, timeout=OPENSEARCH_TIMEOUT)
+
+
+# A lookup is served from the snapshot when one is mapped, else from the TTL cache,
+# else from one OpenSearch search; only that search differs between the pipelines.
+
+def clarification_lookup(intent, sub_status, step):
+    return {
+        "key": ("clarification", intent, sub_status, step),
+        "snapshot": lambda views: views[CLARIFICATION_INDEX].get(f"{intent}|{sub_status}|{step + 1}"),
+        "index": CLARIFICATION_INDEX,
+        "body": clarification_query(intent, sub_status, step),
+        "parse": lambda res: clarification_text(res.status_code, res.json() if res.status_code == 200 else {})
+    }
+
+
+def index_lookup(index_name, record=None):
+    def parse(res):
+        hits = res.json().get("hits", {}).get("hits", [])
+        return to_records(hits, record)
+
+    def failed(error):
+        # A failed index fetch reads as an empty catalog (and is not cached)
+        print(f"[ERROR] Failed to fetch {index_name} from OpenSearch: {error}")
+        return []
+
+    return {
+        "key": ("index", index_name),
+        "snapshot": lambda views: views.get(index_name, MISS),
+        "index": index_name,
+        "body": {"size": 1000},
+        "parse": parse,
+        "failed": failed
+    }
+
+
+def local_value(lookup):
+    views = snapshot_views
+    if views:
+        value = lookup["snapshot"](views)
+        if value is not MISS:
+            return value
+    return cache_get(lookup["key"])
+
+
+def fetch_failed(lookup, error):
+    if "failed" not in lookup:
+        raise error
+    return lookup["failed"](error)
+
+
+def fetch(lookup):
+    value = local_value(lookup)
+    if value is not MISS:
+        return value
+    try:
+        return cache_put(lookup["key"], lookup["parse"](search(lookup["index"], lookup["body"])))
+    except Exception as e:
+        return fetch_failed(lookup, e)
+
+
+async def fetch_async(lookup):
+    value = local_value(lookup)
+    if value is not MISS:
+        return value
+    try:
+        return cache_put(lookup["key"], lookup["parse"](await async_clients.search(lookup["index"], lookup["body"])))
+    except Exception as e:
+        return fetch_failed(lookup, e)
+
+
+def fetch_clarification_question(intent, sub_status, step):
+    return fetch(clarification_lookup(intent, sub_status, step))
+
+
+async def fetch_clarification_question_async(intent, sub_status, step):
+    return await fetch_async(clarification_lookup(intent, sub_status, step))
+
+
+def to_records(hits, record):
+    # Catalog indexes are kept as compact records; other indexes as their raw documents
+    return [record.from_source(hit["_source"]) if record else hit["_source"] for hit in hits]
+
+
+def fetch_index(index_name, record=None):
+    return fetch(index_lookup(index_name, record))
+
+
+async def fetch_index_async(index_name, record=None):
+    return await fetch_async(index_lookup(index_name, record))
+
+
+def fetch_fibre_matrix():
+    return fetch_index("fibre-recommendation-ssa", records.MatrixRow)
+
+
+def fetch_offer_details():
+    return fetch_index("fibre-offers-ssa", records.Offer)
+
+
+def normalize_offer(raw):
+    return raw if isinstance(raw, records.Offer) else records.Offer.from_source(raw)
+
+
+def render_recommendation(row, offer):
+    addons = offer.get("addons", [])
+    # A free plan is priced 0, which is still a price
+    price = offer.get("monthly_price")
+    return RECOMMENDATION_TEMPLATE.format(
+        plan_name=offer.get("plan_name") or "a suitable plan",
+        monthly_price="N/A" if price is None else price,
+        contract=offer.get("contract") or "N/A",
+        top_addons=", ".join(addons[:2]) if addons else "no additional perks",
+        link=row["link"]
+    )
+
+
+def compile_catalog(fibre_matrix, offer_details):
+    offers = {offer["offerId"]: normalize_offer(offer) for offer in offer_details}
+    rows = {row["offerId"]: row for row in fibre_matrix}
+    recommendations = {
+        offer_id: render_recommendation(row, offers.get(offer_id, {}))
+        for offer_id, row in rows.items()
+    }
+    print(f"[DEBUG] Compiled catalog: {len(offers)} offers, {len(rows)} matrix rows")
+    return {"matrix": fibre_matrix, "rows": rows, "offers": offers, "recommendations": recommendations}
+
+
+def compiled_complete(compiled):
+    # Compiled from a failed matrix or offer fetch, the catalog is a dict of empty tables
+    return bool(compiled["rows"]) and bool(compiled["offers"])
+
+
+def local_compiled_catalog():
+    views = snapshot_views
+    return views["compiled"] if views else cache_get(("compiled",))
+
+
+def fetch_compiled_catalog():
+    value = local_compiled_catalog()
+    if value is not MISS:
+        return value
+    return cache_put(("compiled",), compile_catalog(fetch_fibre_matrix(), fetch_offer_details()), compiled_complete)
+
+
+async def fetch_compiled_catalog_async():
+    value = local_compiled_catalog()
+    if value is not MISS:
+        return value
+    return cache_put(("compiled",), compile_catalog(await fetch_fibre_matrix_async(), await fetch_offer_details_async()),
+                     compiled_complete)
+
+
+async def fetch_fibre_matrix_async():
+    return await fetch_index_async("fibre-recommendation-ssa", records.MatrixRow)
+
+
+async def fetch_offer_details_async():
+    return await fetch_index_async("fibre-offers-ssa", records.Offer)
+
+
+def is_match(expected, actual):
+    return expected == "any" or actual == expected or (expected and actual and expected in actual)
+
+
+def matching_values(profile):
+    # Use fallback logic for relationship_status
+    rs = profile.get("fibre", {}).get("relationship_status") or profile.get("relationship_status")
+    # Normalize relationship_status for compatibility with matrix values
+    if rs == "new_line":
+        rs = "new"
+    hs = profile.get("fibre", {}).get("home_size")
+    pc = profile.get("fibre", {}).get("postal_code_prefix")
+    return {"relationship_status": rs, "home_size": hs, "postal_code_prefix": pc}
+
+
+def narrow_candidates(fibre_matrix, profile):
+    # Unknown fields act as wildcards, so the result always contains every row
+    # that can still match once the profile is complete.
+    values = matching_values(profile)
+    candidates = [
+        offer for offer in fibre_matrix
+        if offer["intent"] == "fibre"
+        and all(values[key] is None or is_match(offer[key], values[key]) for key in values)
+    ]
+    print(f"[DEBUG] Candidate offers for partial profile: {[offer['offerId'] for offer in candidates]}")
+    return candidates
+
+
+def match_offer(fibre_matrix, profile):
+    values = matching_values(profile)
+    rs, hs, pc = values["relationship_status"], values["home_size"], values["postal_code_prefix"]
+    fallback_offer = None
+    for offer in fibre_matrix:
+        print(f"[DEBUG] Checking offer {offer['offerId']}:")
+        print(f"  intent match: {offer['intent']} == fibre")
+        print(f"  rs match: {offer['relationship_status']} vs {rs} => {is_match(offer['relationship_status'], rs)}")
+        print(f"  hs match: {offer['home_size']} vs {hs} => {is_match(offer['home_size'], hs)}")
+        print(f"  pc match: {offer['postal_code_prefix']} vs {pc} => {is_match(offer['postal_code_prefix'], pc)}")
+        if (
+            offer["intent"] == "fibre"
+            and is_match(offer["relationship_status"], rs)
+            and is_match(offer["home_size"], hs)
+            and is_match(offer["postal_code_prefix"], pc)
+        ):
+            return offer
+        print(f"[DEBUG] Skipping {offer['offerId']} - mismatch: "
+              f"rs={offer['relationship_status']} vs {rs}, "
+              f"hs={offer['home_size']} vs {hs}, "
+              f"pc={offer['postal_code_prefix']} vs {pc}")
+        if offer["offerId"] == "b10":  # fallback
+            fallback_offer = offer
+    return fallback_offer
+
+
+def is_fallback(offer):
+    return all(offer[key] == "any" for key in ("relationship_status", "home_size", "postal_code_prefix"))
+
+
+def determined_offer(fibre_matrix, profile):
+    # The recommendation is settled only when every way of filling in the missing
+    # fields gives the same match: no specific row is left (the fallback plan), or
+    # the one that is left takes "any" for every field the profile still lacks.
+    candidates = narrow_candidates(fibre_matrix, profile)
+    specific = [offer for offer in candidates if not is_fallback(offer)]
+    if not specific:
+        return next((offer for offer in candidates if is_fallback(offer)), None)
+    missing = [key for key, value in matching_values(profile).items() if value is None]
+    if len(specific) == 1 and all(specific[0][key] == "any" for key in missing):
+        return specific[0]
+    return None
+
@@ -0,0 +1,246 @@
+import os
+import mmap
+import time
+import struct
+import threading
+from dotenv import load_dotenv
+
+# Versioned binary catalog snapshot, written by build_catalog_snapshot.py and
+# memory-mapped by catalog.py. Opening one reads a fixed header and a section
+# directory; records are decoded from the mapping only when they are read, so
+# a replica boots, and switches to a new snapshot, without parsing JSON or
+# querying OpenSearch.
+#
+# Layout (little-endian):
+#
+#   header     magic, format, catalog version, build time, source digest, section count
+#   directory  (name, offset, length) per section, sections 8-byte aligned
+#   values     every distinct value once: offsets (u32) then tagged entries
+#              (s=str, f=float, i=int, n=None, t=tuple of value ids)
+#   t:<table>  rows, fields, key field; field name ids; rows x fields value ids;
+#              row numbers sorted by key, for binary-search lookups
+
+load_dotenv()
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "catalog.snapshot"))
+CATALOG_SNAPSHOT_RELOAD_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_RELOAD_INTERVAL", "5"))
+
+MAGIC = b"SSASNAP\0"
+FORMAT = 1
+HEADER = struct.Struct("<8sHHIQ32sI")
+SECTION = struct.Struct("<24sQQ")
+TABLE_HEADER = struct.Struct("<III")
+NO_KEY = 0xFFFFFFFF
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class ValueTable:
+    def __init__(self):
+        self.ids = {}
+        self.entries = []
+
+    def add(self, value):
+        if isinstance(value, (list, tuple)):
+            key = ("t", tuple(self.add(v) for v in value))
+            encoded = b"t" + struct.pack(f"<{len(key[1])}I", *key[1])
+        elif value is None:
+            key, encoded = ("n",), b"n"
+        elif isinstance(value, bool) or isinstance(value, int):
+            key, encoded = ("i", int(value)), b"i" + struct.pack("<q", int(value))
+        elif isinstance(value, float):
+            key, encoded = ("f", value), b"f" + struct.pack("<d", value)
+        elif isinstance(value, str):
+            key, encoded = ("s", value), b"s" + value.encode("utf-8")
+        else:
+            raise SnapshotError(f"Cannot store {type(value).__name__} value {value!r}")
+        if key not in self.ids:
+            self.ids[key] = len(self.entries)
+            self.entries.append(encoded)
+        return self.ids[key]
+
+    def encode(self):
+        offsets, position = [], 0
+        for entry in self.entries:
+            offsets.append(position)
+            position += len(entry)
+        offsets.append(position)
+        return struct.pack(f"<I{len(offsets)}I", len(self.entries), *offsets) + b"".join(self.entries)
+
+
+def encode_table(values, fields, rows, key=None):
+    # rows are dicts; the key index holds row numbers in key order
+    field_ids = [values.add(field) for field in fields]
+    cells = [values.add(row.get(field)) for row in rows for field in fields]
+    order = sorted(range(len(rows)), key=lambda i: str(rows[i][key])) if key else []
+    return (TABLE_HEADER.pack(len(rows), len(fields), fields.index(key) if key else NO_KEY)
+            + struct.pack(f"<{len(field_ids)}I", *field_ids)
+            + struct.pack(f"<{len(cells)}I", *cells)
+            + struct.pack(f"<{len(order)}I", *order))
+
+
+def write(path, tables, catalog_version, digest):
+    """tables: {name: (fields, rows, key field or None)}. Written atomically."""
+    values = ValueTable()
+    sections = [("t:" + name, encode_table(values, fields, rows, key))
+                for name, (fields, rows, key) in tables.items()]
+    sections.insert(0, ("values", values.encode()))
+
+    position = HEADER.size + SECTION.size * len(sections)
+    directory, body = [], []
+    for name, data in sections:
+        padding = -position % 8
+        body.append(b"\0" * padding)
+        position += padding
+        directory.append(SECTION.pack(name.encode("ascii"), position, len(data)))
+        body.append(data)
+        position += len(data)
+
+    header = HEADER.pack(MAGIC, FORMAT, 0, catalog_version, int(time.time()), digest, len(sections))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header + b"".join(directory) + b"".join(body))
+    os.replace(tmp, path)
+    return position
+
+
+class Table:
+    """Rows of one table, decoded from the mapping as they are read."""
+
+    def __init__(self, snapshot, offset, length):
+        self.snapshot = snapshot
+        self.rows, field_count, key_field = TABLE_HEADER.unpack_from(snapshot.mm, offset)
+        start = offset + TABLE_HEADER.size
+        data = snapshot.view[start:offset + length]
+        self.fields = [snapshot.value(i) for i in data[:4 * field_count].cast("I")]
+        self.cells = data[4 * field_count:4 * field_count * (1 + self.rows)].cast("I")
+        self.order = data[4 * field_count * (1 + self.rows):].cast("I")
+        self.key_field = None if key_field == NO_KEY else key_field
+
+    def __len__(self):
+        return self.rows
+
+    def row(self, i):
+        width = len(self.fields)
+        cells = self.cells[i * width:(i + 1) * width]
+        return {field: self.snapshot.value(cell) for field, cell in zip(self.fields, cells)}
+
+    def find(self, key):
+        # Binary search over the precomputed key order
+        width, lo, hi = len(self.fields), 0, len(self.order)
+        key = str(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = self.order[mid]
+            found = str(self.snapshot.value(self.cells[row * width + self.key_field]))
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return row
+        return None
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime_ns
+            # The mapping outlives the file handle, and a replaced file, until the snapshot is dropped
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        magic, fmt, _, self.version, self.built_at, digest, count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise SnapshotError(f"{path} is not a format {FORMAT} catalog snapshot")
+        self.digest = digest.hex()
+        self.sections = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(self.mm, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+
+        offset, _ = self.sections["values"]
+        value_count, = struct.unpack_from("<I", self.mm, offset)
+        self.offsets = self.view[offset + 4:offset + 8 + 4 * value_count].cast("I")
+        self.blob = offset + 8 + 4 * value_count
+        self.tables = {name[2:]: Table(self, *where) for name, where in self.sections.items()
+                       if name.startswith("t:")}
+
+    def value(self, i):
+        start, end = self.blob + self.offsets[i], self.blob + self.offsets[i + 1]
+        tag, data = self.mm[start:start + 1], self.view[start + 1:end]
+        if tag == b"s":
+            return str(data, "utf-8")
+        if tag == b"f":
+            return struct.unpack("<d", data)[0]
+        if tag == b"i":
+            return struct.unpack("<q", data)[0]
+        if tag == b"t":
+            return tuple(self.value(v) for v in data.cast("I"))
+        return None
+
+    def table(self, name):
+        return self.tables.get(name)
+
+    def describe(self):
+        return (f"catalog v{self.version} built {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.built_at))}, "
+                + ", ".join(f"{name}={len(table)}" for name, table in self.tables.items()))
+
+
+class TableView:
+    """A table's rows as catalog records: view[i] and iteration by position, view["b1"]
+    and view.get("b1") by key. Each row is decoded once, the first time it is read."""
+
+    def __init__(self, table, make):
+        self.table = table
+        self.make = make
+        self.memo = [None] * len(table)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.at(n) for n in range(len(self))[i]]
+        if isinstance(i, int):
+            # Negative positions count from the end, as on a list
+            if not -len(self) <= i < len(self):
+                raise IndexError("table index out of range")
+            return self.at(i % len(self))
+        row = self.table.find(i)
+        if row is None:
+            raise KeyError(i)
+        return self.at(row)
+
+    def at(self, i):
+        record = self.memo[i]
+        if record is None:
+            record = self.make(self.table.row(i))
+            with self.lock:
+                self.memo[i] = record
+        return record
+
+    def __iter__(self):
+        return (self.at(i) for i in range(len(self)))
+
+    def get(self, key, default=None):
+        i = self.table.find(key)
+        return default if i is None else self.at(i)
+
+    def __contains__(self, key):
+        return self.table.find(key) is not None
+
+    def __repr__(self):
+        return f"TableView({len(self)} rows)"
+
+
+def open_snapshot(path=CATALOG_SNAPSHOT):
+    if not os.path.exists(path):
+        return None
+    started = time.perf_counter()
+    snapshot = Snapshot(path)
+    print(f"[CATALOG] Mapped {path} ({snapshot.describe()}) in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return snapshot
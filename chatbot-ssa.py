@@ -1,140 +1,224 @@
 import gradio as gr
-from guardrails import is_off_topic, is_salutation
+from guardrails import is_off_topic, is_salutation, is_off_topic_async, is_salutation_async
+import async_clients
+import catalog
+import intent_classifier
+import prefetch
+import prompt_registry
+import rate_limiter
+import safe_io
+import handoff_store
+import records
+import rolling_summary
+import session_locks
+import session_store
+import single_flight
+import warmup
 import os
-import requests
 import datetime
 import json
+import copy
+import asyncio
+import inspect
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST")
-OPENSEARCH_USER = os.getenv("OPENSEARCH_USER")
-OPENSEARCH_PASS = os.getenv("OPENSEARCH_PASS")
 INDEX_NAME = "smartshopper-index"
+# Gradio queue settings: concurrent chat turns per replica and queued requests before rejecting
+SSA_CONCURRENCY = int(os.getenv("SSA_CONCURRENCY", "8"))
+SSA_QUEUE_SIZE = int(os.getenv("SSA_QUEUE_SIZE", "256"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+HANDOFF_SUMMARY_WORKERS = int(os.getenv("HANDOFF_SUMMARY_WORKERS", "2"))
+
+client = rate_limiter.wrap(OpenAI(api_key=OPENAI_API_KEY))
+ERROR_REPLY = "Sorry, something went wrong while processing your request."
+
+# Writes a turn makes outside the session (interaction log, handoff summary,
+# rolling summary) are collected while the turn runs and applied only once its
+# state is checked in, so a turn replayed after a version conflict leaves no
+# duplicate or orphaned records.
+turn_effects = contextvars.ContextVar("turn_effects", default=None)
+
+def defer(fn, *args):
+    effects = turn_effects.get()
+    if effects is None:
+        return fn(*args)
+    effects.append((fn, args))
+
+def apply_effects(effects):
+    for fn, args in effects:
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[ERROR] {fn.__name__} failed after check-in: {e}")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+async def apply_effects_async(effects):
+    for fn, args in effects:
+        try:
+            result = fn(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"[ERROR] {fn.__name__} failed after check-in: {e}")
 
-def log_interaction(user_input, assistant_reply, profile):
+def log_interaction(user_input, assistant_reply, profile, session_id=None):
     log_entry = {
         "timestamp": datetime.datetime.now().isoformat(),
+        "session_id": session_id,
         "user_input": user_input,
         "assistant_reply": assistant_reply["content"],
-        "profile": profile.copy()
+        "profile": copy.deepcopy(profile)
     }
-    with open("interaction_log_ssa.json", "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    defer(safe_io.append_jsonl, "interaction_log_ssa.json", log_entry)
 
 
-def clarify_intent_with_llm(message, initial_intent):
-    prompt = f"""
-You are an AI assistant helping customers choose between Singtel mobile and fibre plans.
+def clarify_intent_messages(message, initial_intent):
+    return [
+        {"role": "system", "content": prompt_registry.render("clarify_intent_system")},
+        {"role": "user", "content": prompt_registry.render("clarify_intent", message=message,
+                                                           initial_intent=initial_intent)}
+    ]
 
-The user said: "{message}"
-The system thinks the intent might be "{initial_intent}".
+def parse_clarified_intent(response):
+    raw = response.choices[0].message.content.strip().lower()
+    print(f"[DEBUG] Raw LLM response for clarification: {raw}")
+    if raw in ["fibre", "mobile"]:
+        return raw
+    return "unknown"
 
-Please confirm which type of plan the user is referring to based on their input. If it is unclear, respond with "unknown".
-Respond with only one word: "fibre", "mobile", or "unknown".
-"""
+def clarify_intent_with_llm(message, initial_intent):
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Only respond with: fibre, mobile, or unknown."},
-                {"role": "user", "content": prompt.strip()}
-            ]
+        response = single_flight.do(
+            ("clarify_intent", embedding_key(message), initial_intent),
+            lambda: client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=clarify_intent_messages(message, initial_intent)
+            )
         )
-        raw = response.choices[0].message.content.strip().lower()
-        print(f"[DEBUG] Raw LLM response for clarification: {raw}")
-        if raw in ["fibre", "mobile"]:
-            return raw
+        return parse_clarified_intent(response)
+    except Exception as e:
+        print(f"[ERROR] clarify_intent_with_llm failed: {e}")
         return "unknown"
+
+async def clarify_intent_with_llm_async(message, initial_intent):
+    try:
+        response = await single_flight.do_async(
+            ("clarify_intent", embedding_key(message), initial_intent),
+            lambda: async_clients.complete(clarify_intent_messages(message, initial_intent))
+        )
+        return parse_clarified_intent(response)
     except Exception as e:
         print(f"[ERROR] clarify_intent_with_llm failed: {e}")
         return "unknown"
 
-def update_profile_fields(message, existing_profile):
-    import json
-    system_prompt = (
-        "Extract these fields from the user's message:\n"
-        "- plan_type: fibre or mobile\n"
-        "- current_provider: singtel or other (e.g., Starhub, M1, Circles are other)\n"
-        "- relationship_status: new_line or recontract\n"
-        "- home_size: e.g., 3-room, 4-room, 5-room\n"
-        "- postal_code_prefix: a 6-digit postal code\n\n"
-        "Return a JSON object with only the fields detected in this message. "
-        "Ignore anything unrelated. Do not guess."
-    )
+# Field descriptions for profile extraction. Only the fields still missing from
+# the profile are sent each turn; the system prompt stays the same.
+PROFILE_FIELDS = {
+    "plan_type": "fibre or mobile",
+    "current_provider": "singtel or other (e.g., Starhub, M1, Circles are other)",
+    "relationship_status": "new_line or recontract",
+    "home_size": "e.g., 3-room, 4-room, 5-room",
+    "postal_code_prefix": "a 6-digit postal code"
+}
+FIBRE_FIELDS = ["relationship_status", "postal_code_prefix", "home_size"]
+FIBRE_ONLY_FIELDS = ["home_size", "postal_code_prefix"]
+
+def get_profile_value(profile, field):
+    return profile.get(field) or profile.get("fibre", {}).get(field)
+
+def missing_profile_fields(profile):
+    fields = list(PROFILE_FIELDS)
+    if profile.get("plan_type") == "mobile":
+        fields = [f for f in fields if f not in FIBRE_ONLY_FIELDS]
+    return [f for f in fields if not get_profile_value(profile, f)]
+
+def profile_extraction_messages(message, missing):
+    requested = "\n".join(f"- {field}: {PROFILE_FIELDS[field]}" for field in missing)
+    return [
+        {"role": "system", "content": prompt_registry.render("ssa_profile_extraction")},
+        {"role": "user", "content": prompt_registry.render("ssa_profile_extraction_user", fields=requested,
+                                                           message=message)}
+    ]
+
+def parse_extracted_fields(response, missing):
+    usage = response.usage
+    if usage:
+        print(f"[TOKENS] Profile extraction: prompt={usage.prompt_tokens}, "
+              f"completion={usage.completion_tokens}, fields={missing}")
+    extracted = json.loads(response.choices[0].message.content)
+    # Keep only newly detected values so known fields are never overwritten
+    extracted = {k: v for k, v in extracted.items() if k in missing and v}
+    print(f"[DEBUG] Extracted profile fields: {extracted}")
+    return extracted
+
+def profile_extraction_failed(message, existing_profile, error):
+    print(f"[DEBUG] Failed to parse profile: {error}")
+    reply = {
+        "role": "assistant",
+        "content": ERROR_REPLY
+    }
+    log_interaction(message, reply, existing_profile)
+    return {}
 
-    prompt = f"User said: \"{message}\"\n\nExisting profile: {json.dumps(existing_profile)}"
+def update_profile_fields(message, existing_profile):
+    missing = missing_profile_fields(existing_profile)
+    if not missing:
+        print("[DEBUG] Profile complete. Skipping profile extraction.")
+        print("[TOKENS] Profile extraction: prompt=0, completion=0")
+        return {}
 
     try:
         response = client.chat.completions.create(
+            priority=rate_limiter.CRITICAL,
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
+            messages=profile_extraction_messages(message, missing)
         )
-        extracted = json.loads(response.choices[0].message.content)
-        print(f"[DEBUG] Extracted profile fields: {extracted}")
-        return extracted
+        return parse_extracted_fields(response, missing)
     except Exception as e:
-        print(f"[DEBUG] Failed to parse profile: {e}")
-        reply = {
-            "role": "assistant",
-            "content": "Sorry, something went wrong while processing your request."
-        }
-        log_interaction(message, reply, context["profile"])
-        return {}
-
-def fetch_clarification_question(intent, sub_status, step):
-    query = {
-        "size": 1,
-        "query": {
-            "bool": {
-                "must": [
-                    {"term": {"metadata.intent": intent}},
-                    {"term": {"metadata.sub_status": sub_status}},
-                    {"term": {"metadata.sequence": step + 1}}
-                ]
-            }
-        }
-    }
+        return profile_extraction_failed(message, existing_profile, e)
 
-    res = requests.get(
-        f"{OPENSEARCH_HOST}/clarifications-ssa/_search",
-        auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
-        headers={"Content-Type": "application/json"},
-        json=query
-    )
-
-    if res.status_code != 200:
-        print(f"[DEBUG] Clarification fetch failed: {res.status_code}")
-        return None
-
-    hits = res.json().get("hits", {}).get("hits", [])
-    if not hits:
-        print("[DEBUG] No clarification question found.")
-        return None
+async def update_profile_fields_async(message, existing_profile):
+    missing = missing_profile_fields(existing_profile)
+    if not missing:
+        print("[DEBUG] Profile complete. Skipping profile extraction.")
+        print("[TOKENS] Profile extraction: prompt=0, completion=0")
+        return {}
 
-    return hits[0]["_source"]["text"]
+    try:
+        response = await async_clients.complete(profile_extraction_messages(message, missing),
+                                                priority=rate_limiter.CRITICAL)
+        return parse_extracted_fields(response, missing)
+    except Exception as e:
+        return profile_extraction_failed(message, existing_profile, e)
 
+def merge_profile_fields(profile, updated):
+    # Nest fibre-related profile fields under "fibre" key if plan_type is "fibre"
+    if updated.get("plan_type") == "fibre" or profile.get("plan_type") == "fibre":
+        profile["plan_type"] = "fibre"
+        if "fibre" not in profile:
+            profile["fibre"] = {}
+        for key, value in updated.items():
+            if key in FIBRE_FIELDS:
+                profile["fibre"][key] = value
+            elif key != "plan_type":
+                profile[key] = value
+    else:
+        profile.update(updated)
 
 def detect_emotion(text):
     response = client.chat.completions.create(
+        priority=rate_limiter.DEFERRABLE,
         model="gpt-3.5-turbo",
         messages=[
-            {
-                "role": "system",
-                "content": "Classify the user's emotional tone as one of: neutral, frustration, or positive. "
-                           "Treat complaints about price, speed, or dissatisfaction as frustration."
-            },
-            {
-                "role": "user",
-                "content": f'What is the emotional tone of: "{text}"?'
-            }
+            {"role": "system", "content": prompt_registry.render("emotion_system")},
+            {"role": "user", "content": prompt_registry.render("emotion", text=text)}
         ]
     )
     emotion = response.choices[0].message.content.strip().lower()
@@ -143,283 +227,448 @@ def detect_emotion(text):
 
 
 
+# Working copy of each session's state; the session store decides whether it
+# persists here between turns or is checked in to shared storage
 user_context = {}
+def forget_session(user_id):
+    # The store expired this session: drop the per-process state kept beside it
+    prefetch.cancel(user_id)
+    rolling_summary.reset(user_id)
+
+sessions = session_store.open_store(on_evict=forget_session)
+
+# Embeddings of the canonical intent examples (loaded at warm-up) and recent messages.
+# Misses, intent searches and clarifications are single-flight: shoppers sending the
+# same message at the same time share one outbound call.
+# Least recently used entries are evicted first, so the warmed intent examples stay
+# cached for as long as shoppers keep hitting them.
+embedding_cache = OrderedDict()
+embedding_cache_lock = threading.Lock()
+
+def embedding_key(text):
+    return " ".join(text.lower().split())
+
+def cached_embedding(text):
+    key = embedding_key(text)
+    with embedding_cache_lock:
+        vector = embedding_cache.get(key)
+        if vector is not None:
+            embedding_cache.move_to_end(key)
+        return vector
+
+def remember_embedding(text, vector):
+    key = embedding_key(text)
+    with embedding_cache_lock:
+        embedding_cache[key] = vector
+        embedding_cache.move_to_end(key)
+        while len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+            embedding_cache.popitem(last=False)
 
 def embed_text(text):
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=[text]
-    )
-    return response.data[0].embedding
-
-def detect_primary_intent_vector(message, threshold=0.5):
-    vector = embed_text(message)
-    query = {
-        "size": 1,
-        "query": {
-            "knn": {
-                "embedding": {
-                    "vector": vector,
-                    "k": 1
-                }
-            }
-        }
-    }
-    print(f"[DEBUG] Sending vector search for intent: {message}")
-    res = requests.get(
-        f"{OPENSEARCH_HOST}/{INDEX_NAME}/_search",
-        auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
-        headers={"Content-Type": "application/json"},
-        json=query
-    )
-    print(f"[DEBUG] OpenSearch response status: {res.status_code}")
-    if res.status_code != 200:
-        print(f"[ERROR] OpenSearch response: {res.status_code}")
-        return "unknown"
-    hits = res.json().get("hits", {}).get("hits", [])
+    vector = cached_embedding(text)
+    if vector is None:
+        response = single_flight.do(("embed", embedding_key(text)), lambda: client.embeddings.create(
+            model="text-embedding-ada-002",
+            input=[text]
+        ))
+        vector = response.data[0].embedding
+        remember_embedding(text, vector)
+    return vector
+
+async def embed_text_async(text):
+    vector = cached_embedding(text)
+    if vector is None:
+        vector = (await single_flight.do_async(("embed", embedding_key(text)),
+                                               lambda: async_clients.embed([text])))[0]
+        remember_embedding(text, vector)
+    return vector
+
+def warm_intent_examples(path="ssa_examples.jsonl"):
+    # One batched call embeds every canonical example and opens the OpenAI connection
+    with open(path) as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    response = client.embeddings.create(model="text-embedding-ada-002", input=texts)
+    for text, item in zip(texts, response.data):
+        remember_embedding(text, item.embedding)
+    return f"{len(texts)} examples embedded"
+
+def intent_from_search(status_code, data, threshold=None):
+    print(f"[DEBUG] OpenSearch response status: {status_code}")
+    if status_code != 200:
+        print(f"[ERROR] OpenSearch response: {status_code}")
+        return intent_classifier.vote_intent([])
+
+    hits = data.get("hits", {}).get("hits", [])
     if not hits:
         print("[DEBUG] No matches found.")
-        return "unknown"
+        return intent_classifier.vote_intent([])
 
     print(f"[DEBUG] Vector match: {hits[0]['_source']['text']} | Score: {hits[0]['_score']}")
-    if hits[0]["_score"] < threshold:
-        print("[DEBUG] Match score too low.")
-        return "unknown"
-    return hits[0]["_source"]["metadata"]["intent"]
+    vote = intent_classifier.vote_intent(hits, min_score=threshold)
+    print(f"[DEBUG] Vector vote: {vote}")
+    return vote
 
-def chat(message, history):
-    print(f"[DEBUG] Received message: {message}")
-    user_id = "default_user"
+def detect_primary_intent_vector(message, threshold=None):
+    vector = embed_text(message)
+    print(f"[DEBUG] Sending vector search for intent: {message}")
+    res = single_flight.do(("intent_search", embedding_key(message)), lambda: catalog.session.get(
+        f"{OPENSEARCH_HOST}/{INDEX_NAME}/_search", json=intent_classifier.intent_vector_query(vector),
+        timeout=catalog.OPENSEARCH_TIMEOUT
+    ))
+    return intent_from_search(res.status_code, res.json() if res.status_code == 200 else {}, threshold)
+
+async def detect_primary_intent_vector_async(message, threshold=None):
+    vector = await embed_text_async(message)
+    print(f"[DEBUG] Sending vector search for intent: {message}")
+    res = await single_flight.do_async(("intent_search", embedding_key(message)),
+                                       lambda: async_clients.search(INDEX_NAME,
+                                                                    intent_classifier.intent_vector_query(vector)))
+    return intent_from_search(res.status_code, res.json() if res.status_code == 200 else {}, threshold)
+
+def build_recommendation(context, compiled, candidates=None):
+    profile = context.get("profile", {})
+    # [DEBUG] Print profile used for matching
+    print(f"[DEBUG] Profile used for matching: {profile}")
+
+    if context.get("determined_offer"):
+        matched_offer = compiled["rows"].get(context["determined_offer"])
+    else:
+        # Candidates narrowed while the user was typing are a superset of every
+        # row the completed profile can match, so matching only needs those.
+        matched_offer = catalog.match_offer(candidates or compiled["matrix"], profile)
+
+    if not matched_offer:
+        return None
+
+    print(f"[DEBUG] Matched offer ID: {matched_offer['offerId']}")
+    context["matched_offer"] = matched_offer["offerId"]
+    print(f"[DEBUG] Final matched plan details: {compiled['offers'].get(matched_offer['offerId'])}")
+    return {"role": "assistant", "content": compiled["recommendations"][matched_offer["offerId"]]}
+
+def handoff_summary_messages(context, user_answers, reply, conversation=None):
+    if conversation is not None:
+        # Rolling mode: the running summary plus the last answer keeps the prompt size bounded
+        history_section = (
+            f"Conversation so far: {conversation}\n\n"
+            f"Latest answer: {rolling_summary.bounded(user_answers[-1], rolling_summary.MAX_EXCHANGE_CHARS)}"
+        )
+    else:
+        qna_pairs = "\n".join([
+            f"{i+1}. {q}" for i, q in enumerate(user_answers)
+        ])
+        history_section = f"Q&A:\n{qna_pairs}"
+
+    summary_prompt = prompt_registry.render("handoff_summary", profile=json.dumps(context["profile"]),
+                                            history=history_section, recommendation=reply["content"])
+    return [
+        {"role": "system", "content": prompt_registry.render("handoff_summary_system")},
+        {"role": "user", "content": summary_prompt}
+    ]
+
+def handoff_entry(user_id, context, user_answers, reply):
+    # Copied now: the session record is handed back to the store before the summary is written
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "session_id": user_id,
+        "offer_id": context.get("matched_offer"),
+        "user_profile": copy.deepcopy(context["profile"]),
+        "answers": list(user_answers),
+        "final_recommendation": reply["content"]
+    }
+
+def write_handoff_summary(entry, messages):
+    try:
+        summary_response = client.chat.completions.create(
+            priority=rate_limiter.DEFERRABLE,
+            model="gpt-3.5-turbo",
+            messages=messages
+        )
+        handoff_store.save(dict(entry, summary=summary_response.choices[0].message.content.strip()))
+    except Exception as e:
+        print(f"[ERROR] Failed to write handoff summary: {e}")
+
+# The shopper has their recommendation by the time the summary is written, so it
+# runs on its own threads instead of holding up the reply
+handoff_executor = ThreadPoolExecutor(max_workers=HANDOFF_SUMMARY_WORKERS, thread_name_prefix="handoff")
+
+def write_handoff_summary_later(entry, messages):
+    handoff_executor.submit(write_handoff_summary, entry, messages)
+
+def prefetch_next_turn(user_id, context):
+    # Warm everything the next turn needs while the shopper is typing
+    profile = copy.deepcopy(context.get("profile", {}))
+    prefetch.warm("question", catalog.fetch_clarification_question, context["primary"], "new_line", context["step"])
+    prefetch.warm("offers", catalog.fetch_compiled_catalog)
+    prefetch.schedule(user_id, "candidates",
+                      lambda: catalog.narrow_candidates(catalog.fetch_fibre_matrix(), profile))
+
+def get_user_context(user_id):
     if user_id not in user_context:
         print("[DEBUG] Initializing new user context")
-        user_context[user_id] = {
-            "primary": None,
-            "step": 0
-        }
-        open("interaction_log_ssa.json", "w").close()
-        print("[DEBUG] Log reset on context reinitialization.")
+        user_context[user_id] = records.SessionContext(
+            primary=None,
+            step=0,
+            # Fingerprints of questions already put to the shopper and their answers,
+            # kept as the conversation goes instead of rescanning the Gradio history
+            asked=set(),
+            answers=[]
+        )
+        prefetch.cancel(user_id)
+        rolling_summary.reset(user_id)
+    return user_context[user_id]
+
+def session_id_for(request):
+    if request is not None and request.session_hash:
+        return request.session_hash
+    return "default_user"
+
+def question_fingerprint(text):
+    return text.strip().lower().rstrip("?")
+
+def record_reply(user_id, message, reply):
+    # Every reply is a question the shopper has been asked once they answer it
     context = user_context[user_id]
+    context["asked"].add(question_fingerprint(reply["content"]))
+    # Only the recommendation and handoff prompts read the summary; once they have
+    # been sent, folding in further exchanges is an LLM call nothing uses
+    if rolling_summary.ROLLING_SUMMARY and "matched_offer" not in context:
+        defer(rolling_summary.update, user_id, message, reply["content"])
+
+def conflict_exhausted(user_id, message):
+    # Nothing from the turn was saved or written; say so rather than answer from unsaved state
+    print(f"[ERROR] Session {user_id} still conflicted after {session_store.SESSION_RETRIES} attempts; turn dropped")
+    reply = {"role": "assistant", "content": ERROR_REPLY}
+    safe_io.append_jsonl("interaction_log_ssa.json", {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "session_id": user_id,
+        "user_input": message,
+        "assistant_reply": reply["content"],
+        "error": "session_conflict"
+    })
+    return reply
+
+def chat(message, history, request: gr.Request = None):
+    user_id = session_id_for(request)
+    with session_locks.lock_for(user_id):
+        # Another process may have served this session since we checked it out; replay on
+        # fresh state, discarding the effects of the attempt that lost
+        for attempt in range(session_store.SESSION_RETRIES):
+            effects = []
+            token = turn_effects.set(effects)
+            try:
+                version = sessions.checkout(user_context, user_id)
+                reply = handle_message(user_id, message, history)
+                record_reply(user_id, message, reply)
+            finally:
+                turn_effects.reset(token)
+            if sessions.checkin(user_context, user_id, version):
+                apply_effects(effects)
+                return reply
+        return conflict_exhausted(user_id, message)
+
+async def chat_async(message, history, request: gr.Request = None):
+    user_id = session_id_for(request)
+    async with session_locks.async_lock_for(user_id):
+        for attempt in range(session_store.SESSION_RETRIES):
+            effects = []
+            token = turn_effects.set(effects)
+            try:
+                version = await asyncio.to_thread(sessions.checkout, user_context, user_id)
+                reply = await handle_message_async(user_id, message, history)
+                record_reply(user_id, message, reply)
+            finally:
+                turn_effects.reset(token)
+            if await asyncio.to_thread(sessions.checkin, user_context, user_id, version):
+                await apply_effects_async(effects)
+                return reply
+        return conflict_exhausted(user_id, message)
+
+GREETING_REPLY = "Hi there! I’m here to help you find the best Singtel broadband or mobile plan. What are you looking for today?"
+OFF_TOPIC_REPLY = "I'm here to assist with Singtel broadband and mobile plans. Let me know how I can help!"
+ASK_PLAN_TYPE_REPLY = "Are you looking for a broadband (fibre) plan or a mobile plan?"
+THANKS_REPLY = "Thanks! Based on your responses, I’ll help find the most suitable Singtel plan for you."
+
+def turn_steps(user_id, message):
+    # The decisions of one turn, written once for both pipelines. Every outbound call
+    # is yielded as (operation, *args); run_turn / run_turn_async perform it with the
+    # sync or async client and send the result back (or throw its error in).
+    print(f"[DEBUG] Received message: {message}")
+    context = get_user_context(user_id)
+    context["answers"].append(message)
 
     # Salutation check
-    if is_salutation(message):
-        reply = {
-            "role": "assistant",
-            "content": "Hi there! I’m here to help you find the best Singtel broadband or mobile plan. What are you looking for today?"
-        }
-        log_interaction(message, reply, {})
+    if (yield ("salutation", message)):
+        reply = {"role": "assistant", "content": GREETING_REPLY}
+        log_interaction(message, reply, {}, user_id)
         return reply
 
     # Detect or confirm primary intent
     if context["primary"] is None:
-        intent = detect_primary_intent_vector(message)
-        intent = clarify_intent_with_llm(message, intent)
+        vote = yield ("intent_vote", message)
+        # A confident k-NN vote settles the intent without the LLM clarification call
+        intent = vote["intent"] if vote["confident"] else (yield ("clarify_intent", message, vote["intent"]))
+        intent_classifier.record_gate(vote["confident"])
         print(f"[DEBUG] Detected intent: {intent}")
         if intent in ["fibre", "mobile"]:
             context["primary"] = intent
         else:
-            if is_off_topic(message):
+            if (yield ("off_topic", message)):
                 print("[DEBUG] Detected off-topic input.")
-                reply = {
-                    "role": "assistant",
-                    "content": "I'm here to assist with Singtel broadband and mobile plans. Let me know how I can help!"
-                }
-                log_interaction(message, reply, {})
+                reply = {"role": "assistant", "content": OFF_TOPIC_REPLY}
+                log_interaction(message, reply, {}, user_id)
                 return reply
-            reply = {
-                "role": "assistant",
-                "content": "Are you looking for a broadband (fibre) plan or a mobile plan?"
-            }
-            log_interaction(message, reply, {})
+            reply = {"role": "assistant", "content": ASK_PLAN_TYPE_REPLY}
+            log_interaction(message, reply, {}, user_id)
             return reply
 
     # Update profile after every answer
     if "profile" not in context:
         context["profile"] = {}
 
+    # Seed plan_type from the confirmed intent so it is never re-extracted
+    if context["primary"] and not context["profile"].get("plan_type"):
+        context["profile"]["plan_type"] = context["primary"]
+
     print(f"[PROFILE TRACKER] Profile before update: {context['profile']}")
-    updated = update_profile_fields(message, context["profile"])
-    # Nest fibre-related profile fields under "fibre" key if plan_type is "fibre"
-    if updated.get("plan_type") == "fibre":
-        context["profile"]["plan_type"] = "fibre"
-        if "fibre" not in context["profile"]:
-            context["profile"]["fibre"] = {}
-        for key in ["relationship_status", "postal_code_prefix", "home_size"]:
-            if key in updated:
-                context["profile"]["fibre"][key] = updated[key]
-    elif context["profile"].get("plan_type") == "fibre":
-        if "fibre" not in context["profile"]:
-            context["profile"]["fibre"] = {}
-        for key in ["relationship_status", "postal_code_prefix", "home_size"]:
-            if key in updated:
-                context["profile"]["fibre"][key] = updated[key]
-    else:
-        context["profile"].update(updated)
+    updated = yield ("extract_profile", message, context["profile"])
+    merge_profile_fields(context["profile"], updated)
     print(f"[PROFILE TRACKER] Profile after update: {context['profile']}")
 
+    # Skip the remaining questions once the profile pins down a single offer
+    determined = None
+    if context["primary"] == "fibre":
+        determined = catalog.determined_offer((yield ("fibre_matrix",)), context["profile"])
+        if determined:
+            print(f"[DEBUG] Recommendation determined early: {determined['offerId']}")
+            context["determined_offer"] = determined["offerId"]
+
     # Fetch clarification question from vector DB
     step = context["step"]
-    asked_questions = set()
-    for i in range(len(history) - 1):
-        if history[i]["role"] == "assistant" and history[i+1]["role"] == "user":
-            asked_questions.add(history[i]["content"].strip().lower().rstrip("?"))
+    asked_questions = context["asked"]
 
-    while True:
-        question = fetch_clarification_question(context["primary"], "new_line", step)
+    while not determined:
+        question = yield ("question", context["primary"], "new_line", step)
         if not question:
             break
-        if question.strip().lower().rstrip("?") not in asked_questions:
+        if question_fingerprint(question) not in asked_questions:
             context["step"] += 1
             reply = {"role": "assistant", "content": question}
-            log_interaction(message, reply, context.get("profile", {}))
+            log_interaction(message, reply, context.get("profile", {}), user_id)
+            prefetch_next_turn(user_id, context)
             return reply
         step += 1
 
-    reply = {"role": "assistant", "content": "Thanks! Based on your responses, I’ll help find the most suitable Singtel plan for you."}
-    log_interaction(message, reply, context.get("profile", {}))
+    reply = {"role": "assistant", "content": THANKS_REPLY}
+    log_interaction(message, reply, context.get("profile", {}), user_id)
 
     # Recommendation logic
     try:
-        # Fetch fibre recommendation matrix from OpenSearch
-        try:
-            res = requests.get(
-                f"{OPENSEARCH_HOST}/fibre-recommendation-ssa/_search",
-                auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
-                headers={"Content-Type": "application/json"},
-                json={"size": 1000}
-            )
-            hits = res.json().get("hits", {}).get("hits", [])
-            fibre_matrix = [hit["_source"] for hit in hits]
-        except Exception as e:
-            print(f"[ERROR] Failed to fetch fibre recommendation matrix from OpenSearch: {e}")
-            fibre_matrix = []
-
-        # [DEBUG] Print all loaded offers from OpenSearch
-        print("[DEBUG] Offers loaded from OpenSearch:")
-        for offer in fibre_matrix:
-            print(f" - {offer.get('offerId')}, intent={offer.get('intent')}, rs={offer.get('relationship_status')}, hs={offer.get('home_size')}, pc={offer.get('postal_code_prefix')}")
-
-        # Fetch offer details from OpenSearch
-        try:
-            res = requests.get(
-                f"{OPENSEARCH_HOST}/fibre-offers-ssa/_search",
-                auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
-                headers={"Content-Type": "application/json"},
-                json={"size": 1000}
-            )
-            hits = res.json().get("hits", {}).get("hits", [])
-            offer_details = [hit["_source"] for hit in hits]
-        except Exception as e:
-            print(f"[ERROR] Failed to fetch offer details from OpenSearch: {e}")
-            offer_details = []
-
-        profile = context.get("profile", {})
-        # [DEBUG] Print profile used for matching
-        print(f"[DEBUG] Profile used for matching: {profile}")
-        matched_offer = None
-        fallback_offer = None
-
-        def is_match(expected, actual):
-            return expected == "any" or actual == expected or (expected and actual and expected in actual)
-
-        for offer in fibre_matrix:
-            # Use fallback logic for relationship_status
-            rs = profile.get("fibre", {}).get("relationship_status") or profile.get("relationship_status")
-            # Normalize relationship_status for compatibility with matrix values
-            if rs == "new_line":
-                rs = "new"
-            elif rs == "recontract":
-                rs = "recontract"
-            hs = profile.get("fibre", {}).get("home_size")
-            pc = profile.get("fibre", {}).get("postal_code_prefix")
-            print(f"[DEBUG] Checking offer {offer['offerId']}:")
-            print(f"  intent match: {offer['intent']} == fibre")
-            print(f"  rs match: {offer['relationship_status']} vs {rs} => {is_match(offer['relationship_status'], rs)}")
-            print(f"  hs match: {offer['home_size']} vs {hs} => {is_match(offer['home_size'], hs)}")
-            print(f"  pc match: {offer['postal_code_prefix']} vs {pc} => {is_match(offer['postal_code_prefix'], pc)}")
-            if (
-                offer["intent"] == "fibre"
-                and is_match(offer["relationship_status"], rs)
-                and is_match(offer["home_size"], hs)
-                and is_match(offer["postal_code_prefix"], pc)
-            ):
-                matched_offer = offer
-                break
-            else:
-                print(f"[DEBUG] Skipping {offer['offerId']} - mismatch: "
-                      f"rs={offer['relationship_status']} vs {rs}, "
-                      f"hs={offer['home_size']} vs {hs}, "
-                      f"pc={offer['postal_code_prefix']} vs {pc}")
-            if offer["offerId"] == "b10":  # fallback
-                fallback_offer = offer
-
-        if not matched_offer and fallback_offer:
-            matched_offer = fallback_offer
-
-        if matched_offer:
-            print(f"[DEBUG] Matched offer ID: {matched_offer['offerId']}")
-            print(f"[DEBUG] Offer details lookup from OpenSearch:")
-            for item in offer_details:
-                print(f" - {item.get('offerId')} ({item.get('plan_name')})")
-
-            plan_info = next((item for item in offer_details if item["offerId"] == matched_offer["offerId"]), {})
-            print(f"[DEBUG] Final matched plan details: {plan_info}")
-            addons = plan_info.get("addons", [])
-            top_addons = ", ".join(addons[:2]) if addons else "no additional perks"
-
-            recommendation = (
-                f"We recommend the **{plan_info.get('Plan Name', 'a suitable plan')}**.\n"
-                f"💰 Monthly Price: ${plan_info.get('Monthly price', 'N/A')}\n"
-                f"📄 Contract: {plan_info.get('Contract policy', 'N/A')}\n"
-                f"🎁 Includes: {top_addons}\n"
-                f"👉 Learn more: {matched_offer['link']}"
-            )
-            reply = {"role": "assistant", "content": recommendation}
+        # Recommendation matrix and offers compiled from OpenSearch (cached, usually prefetched)
+        compiled = yield ("compiled_catalog",)
+        candidates = yield ("candidates", user_id)
+        reply = build_recommendation(context, compiled, candidates) or reply
     except Exception as e:
         print(f"[ERROR] Failed to generate recommendation: {e}")
-        reply = {"role": "assistant", "content": "Thanks! Based on your responses, I’ll help find the most suitable Singtel plan for you."}
+        reply = {"role": "assistant", "content": THANKS_REPLY}
+    # Nothing is prefetched for a conversation that has had its recommendation
+    prefetch.cancel(user_id)
 
-    # Save conversation summary for agent handoff
+    # Save conversation summary for agent handoff once the turn is checked in
     try:
-        # Extract all user responses in order
-        user_answers = [msg["content"] for msg in history if msg["role"] == "user"]
+        # All user responses in order, collected turn by turn
+        user_answers = list(context["answers"])
+        conversation = (yield ("conversation", user_id)) if rolling_summary.ROLLING_SUMMARY else None
+        yield ("handoff", handoff_entry(user_id, context, user_answers, reply),
+               handoff_summary_messages(context, user_answers, reply, conversation))
+    except Exception as e:
+        print(f"[ERROR] Failed to prepare handoff summary: {e}")
 
-        qna_pairs = "\n".join([
-            f"{i+1}. {q}" for i, q in enumerate(user_answers)
-        ])
+    return reply
 
-        summary_prompt = (
-            f"Summarize this customer conversation in a way that a live sales agent can take over smoothly.\n\n"
-            f"User Profile: {json.dumps(context['profile'])}\n\n"
-            f"Q&A:\n{qna_pairs}\n\n"
-            f"Final Recommendation: {reply['content']}"
-        )
+SYNC_CALLS = {
+    "salutation": is_salutation,
+    "intent_vote": detect_primary_intent_vector,
+    "clarify_intent": clarify_intent_with_llm,
+    "off_topic": is_off_topic,
+    "extract_profile": update_profile_fields,
+    "fibre_matrix": catalog.fetch_fibre_matrix,
+    "question": catalog.fetch_clarification_question,
+    "compiled_catalog": catalog.fetch_compiled_catalog,
+    "candidates": lambda user_id: prefetch.result(user_id, "candidates"),
+    "conversation": lambda user_id: rolling_summary.current(user_id),
+    "handoff": lambda entry, messages: defer(write_handoff_summary_later, entry, messages)
+}
+
+async def defer_async(fn, *args):
+    defer(fn, *args)
+
+ASYNC_CALLS = {
+    "salutation": is_salutation_async,
+    "intent_vote": detect_primary_intent_vector_async,
+    "clarify_intent": clarify_intent_with_llm_async,
+    "off_topic": is_off_topic_async,
+    "extract_profile": update_profile_fields_async,
+    "fibre_matrix": catalog.fetch_fibre_matrix_async,
+    "question": catalog.fetch_clarification_question_async,
+    "compiled_catalog": catalog.fetch_compiled_catalog_async,
+    "candidates": lambda user_id: asyncio.to_thread(prefetch.result, user_id, "candidates"),
+    "conversation": lambda user_id: asyncio.to_thread(rolling_summary.current, user_id),
+    "handoff": lambda entry, messages: defer_async(write_handoff_summary_later, entry, messages)
+}
+
+def run_turn(steps):
+    result, error = None, None
+    while True:
+        try:
+            call = steps.throw(error) if error else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = SYNC_CALLS[call[0]](*call[1:]), None
+        except Exception as e:
+            result, error = None, e
 
-        summary_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant creating handover summaries for customer support."},
-                {"role": "user", "content": summary_prompt}
-            ]
-        )
-        conversation_summary = summary_response.choices[0].message.content.strip()
-
-        summary_entry = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "user_profile": context["profile"],
-            "answers": user_answers,
-            "final_recommendation": reply["content"],
-            "summary": conversation_summary
-        }
-        with open("handoff_summary_ssa.json", "w") as f:
-            json.dump(summary_entry, f, indent=2)
-    except Exception as e:
-        print(f"[ERROR] Failed to write handoff summary: {e}")
+async def run_turn_async(steps):
+    result, error = None, None
+    while True:
+        try:
+            call = steps.throw(error) if error else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = await ASYNC_CALLS[call[0]](*call[1:]), None
+        except Exception as e:
+            result, error = None, e
 
-    return reply
+def handle_message(user_id, message, history):
+    return run_turn(turn_steps(user_id, message))
+
+async def handle_message_async(user_id, message, history):
+    return await run_turn_async(turn_steps(user_id, message))
 
 # Gradio UI
-gr.ChatInterface(
-    fn=chat,
-    title="Singtel Smart Shopper Assistant - SSA",
-    type="messages"
-).launch()
+# SSA_ASYNC=1 serves the async pipeline so a single worker can interleave many conversations
+def build_ui():
+    return gr.ChatInterface(
+        fn=chat_async if os.getenv("SSA_ASYNC") == "1" else chat,
+        title="Singtel Smart Shopper Assistant - SSA",
+        type="messages"
+    ).queue(
+        default_concurrency_limit=SSA_CONCURRENCY,
+        max_size=SSA_QUEUE_SIZE
+    )
+
+if __name__ == "__main__":
+    # Warm up before taking traffic; /ready flips to 200 once the UI is listening
+    warmup.serve_readiness()
+    prompt_registry.serve()
+    catalog.serve_snapshot()
+    warmup.run({"intent_examples": warm_intent_examples})
+    demo = build_ui()
+    if os.getenv("SSA_ASYNC") == "1":
+        # The async clients' connections belong to the event loop Gradio serves on,
+        # so they are opened there while launch() starts the app
+        demo.extra_startup_events.append(lambda: warmup.run_step_async("async_clients", async_clients.warm))
+    demo.launch(max_threads=max(40, SSA_CONCURRENCY), prevent_thread_lock=True)
+    warmup.mark_ready()
+    demo.block_thread()
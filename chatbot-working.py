@@ -1,5 +1,7 @@
 import gradio as gr
 from guardrails import is_off_topic, is_salutation
+import emotion_classifier
+import prompt_registry
 import os
 import requests
 import datetime
@@ -121,7 +123,7 @@ def fetch_clarification_question(intent, sub_status, step):
     return hits[0]["_source"]["text"]
 
 
-def detect_emotion(text):
+def llm_emotion(text):
     response = client.chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[
@@ -140,6 +142,10 @@ def detect_emotion(text):
     print(f"[DEBUG] Emotion detected: {emotion}")
     return emotion
 
+def detect_emotion(text):
+    # Lexicon first; the LLM is only asked when the local score is not confident
+    return emotion_classifier.detect(text, llm_emotion)
+
 
 CLARIFICATION_QUESTIONS = {
     "fibre": {
@@ -383,8 +389,7 @@ def chat(message, history):
     )
 
     try:
-        with open("prompts.json", "r") as f:
-            system_prompt = json.load(f)["system_prompt"]
+        system_prompt = prompt_registry.render("system_prompt")
 
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
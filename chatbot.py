@@ -1,9 +1,16 @@
 import gradio as gr
 from guardrails import is_off_topic, is_salutation
+import emotion_classifier
+import safe_io
+import handoff_store
+import rolling_summary
+import prompt_registry
+import rate_limiter
 import os
 import requests
 import datetime
 import json
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -14,35 +21,28 @@ OPENSEARCH_USER = os.getenv("OPENSEARCH_USER")
 OPENSEARCH_PASS = os.getenv("OPENSEARCH_PASS")
 INDEX_NAME = "smartshopper-index"
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = rate_limiter.wrap(OpenAI(api_key=OPENAI_API_KEY))
 
-def log_interaction(user_input, assistant_reply, profile):
+def log_interaction(user_id, user_input, assistant_reply, profile, summarise=True):
     log_entry = {
         "timestamp": datetime.datetime.now().isoformat(),
         "user_input": user_input,
         "assistant_reply": assistant_reply["content"],
         "profile": profile.copy()
     }
-    with open("interaction_log.jsonl", "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    safe_io.append_jsonl("interaction_log.jsonl", log_entry)
+    if summarise and rolling_summary.ROLLING_SUMMARY:
+        rolling_summary.update(user_id, user_input, assistant_reply["content"])
 
 
 def clarify_intent_with_llm(message, initial_intent):
-    prompt = f"""
-You are an AI assistant helping customers choose between Singtel mobile and fibre plans.
-
-The user said: "{message}"
-The system thinks the intent might be "{initial_intent}".
-
-Please confirm which type of plan the user is referring to based on their input. If it is unclear, respond with "unknown".
-Respond with only one word: "fibre", "mobile", or "unknown".
-"""
+    prompt = prompt_registry.render("clarify_intent", message=message, initial_intent=initial_intent)
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
-                {"role": "system", "content": "Only respond with: fibre, mobile, or unknown."},
-                {"role": "user", "content": prompt.strip()}
+                {"role": "system", "content": prompt_registry.render("clarify_intent_system")},
+                {"role": "user", "content": prompt}
             ]
         )
         raw = response.choices[0].message.content.strip().lower()
@@ -54,39 +54,39 @@ Respond with only one word: "fibre", "mobile", or "unknown".
         print(f"[ERROR] clarify_intent_with_llm failed: {e}")
         return "unknown"
 
-def update_profile_fields(message, existing_profile):
-    import json
-    system_prompt = (
-        "Extract these fields from the user's message:\n"
-        "- plan_type: fibre or mobile\n"
-        "- current_provider: singtel or other (e.g., Starhub, M1, Circles are other)\n"
-        "- relationship_status: new_line or recontract\n\n"
-        "Return a JSON object with only the fields detected in this message. "
-        "Ignore anything unrelated. Do not guess."
-    )
-
-    prompt = f"User said: \"{message}\"\n\nExisting profile: {json.dumps(existing_profile)}"
+# Field descriptions for profile extraction. As in chatbot-ssa.py, only the fields
+# still missing from the profile are sent, and the known profile is not.
+PROFILE_FIELDS = {
+    "plan_type": "fibre or mobile",
+    "current_provider": "singtel or other (e.g., Starhub, M1, Circles are other)",
+    "relationship_status": "new_line or recontract"
+}
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
-    )
+def update_profile_fields(message, existing_profile):
+    missing = [field for field in PROFILE_FIELDS if not existing_profile.get(field)]
+    if not missing:
+        print("[DEBUG] Profile complete. Skipping profile extraction.")
+        return {}
 
+    requested = "\n".join(f"- {field}: {PROFILE_FIELDS[field]}" for field in missing)
     try:
+        response = client.chat.completions.create(
+            priority=rate_limiter.CRITICAL,
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": prompt_registry.render("ssa_profile_extraction")},
+                {"role": "user", "content": prompt_registry.render("ssa_profile_extraction_user", fields=requested,
+                                                                   message=message)}
+            ]
+        )
         extracted = json.loads(response.choices[0].message.content)
-        print(f"[DEBUG] Extracted profile fields: {extracted}")
-        return extracted
     except Exception as e:
         print(f"[DEBUG] Failed to parse profile: {e}")
-        reply = {
-            "role": "assistant",
-            "content": "Sorry, something went wrong while processing your request."
-        }
-        log_interaction(message, reply, context["profile"])
-        return reply
+        return {}
+    # Keep only newly detected values so known fields are never overwritten
+    extracted = {k: v for k, v in extracted.items() if k in missing and v}
+    print(f"[DEBUG] Extracted profile fields: {extracted}")
+    return extracted
 
 def fetch_clarification_question(intent, sub_status, step):
     query = {
@@ -121,29 +121,65 @@ def fetch_clarification_question(intent, sub_status, step):
     return hits[0]["_source"]["text"]
 
 
-def detect_emotion(text):
+def llm_emotion(text, priority=rate_limiter.CRITICAL):
+    # Critical when the reply is phrased from it; background audits pass DEFERRABLE
     response = client.chat.completions.create(
+        priority=priority,
         model="gpt-3.5-turbo",
         messages=[
-            {
-                "role": "system",
-                "content": "Classify the user's emotional tone as one of: neutral, frustration, or positive. "
-                           "Treat complaints about price, speed, or dissatisfaction as frustration."
-            },
-            {
-                "role": "user",
-                "content": f'What is the emotional tone of: "{text}"?'
-            }
+            {"role": "system", "content": prompt_registry.render("emotion_system")},
+            {"role": "user", "content": prompt_registry.render("emotion", text=text)}
         ]
     )
     emotion = response.choices[0].message.content.strip().lower()
     print(f"[DEBUG] Emotion detected: {emotion}")
     return emotion
 
+def detect_emotion(text):
+    # Lexicon first; the LLM is only asked when the local score is not confident
+    return emotion_classifier.detect(text, llm_emotion,
+                                     audit_emotion=lambda t: llm_emotion(t, rate_limiter.DEFERRABLE))
+
 
 
 user_context = {}
 
+# Handoff summaries are written after the reply has gone out, off the chat thread
+handoff_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HANDOFF_SUMMARY_WORKERS", "2")),
+                                      thread_name_prefix="handoff")
+
+def write_handoff_summary(user_id, profile, user_answers, qna_pairs, recommendation):
+    try:
+        # Generate GPT-based summary of the interaction
+        summary_prompt = prompt_registry.render("handoff_summary", profile=json.dumps(profile),
+                                                history=f"Q&A:\n{qna_pairs}", recommendation=recommendation)
+
+        try:
+            summary_response = client.chat.completions.create(
+                priority=rate_limiter.DEFERRABLE,
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": prompt_registry.render("handoff_summary_system")},
+                    {"role": "user", "content": summary_prompt}
+                ]
+            )
+            conversation_summary = summary_response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"[ERROR] Failed to generate conversation summary: {e}")
+            conversation_summary = "Summary unavailable due to error."
+
+        summary_entry = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "session_id": user_id,
+            "user_profile": profile,
+            "answers": user_answers,
+            "final_recommendation": recommendation,
+            "summary": conversation_summary
+        }
+        handoff_store.save(summary_entry)
+    except Exception as e:
+        print(f"[ERROR] Failed to write handoff summary: {e}")
+
 def embed_text(text):
     response = client.embeddings.create(
         model="text-embedding-ada-002",
@@ -213,7 +249,7 @@ def chat(message, history):
             "role": "assistant",
             "content": "Hi there! I’m here to help you find the best Singtel broadband or mobile plan. What are you looking for today?"
         }
-        log_interaction(message, reply, context['profile'])
+        log_interaction(user_id, message, reply, context['profile'])
         return reply
 
     # Guardrail check
@@ -241,7 +277,7 @@ def chat(message, history):
                 "role": "assistant",
                 "content": "Are you looking for a broadband (fibre) plan or a mobile plan?"
             }
-            log_interaction(message, reply, context["profile"])
+            log_interaction(user_id, message, reply, context["profile"])
             return reply
 
         if "current_provider" in missing and not context["telco_clarified"]:
@@ -249,7 +285,7 @@ def chat(message, history):
                 "role": "assistant",
                 "content": "Are you currently with Singtel or switching from another provider?"
             }
-            log_interaction(message, reply, context["profile"])
+            log_interaction(user_id, message, reply, context["profile"])
             return reply
 
         if "relationship_status" in missing and not context["sub_status"]:
@@ -257,7 +293,7 @@ def chat(message, history):
                 "role": "assistant",
                 "content": "Are you signing up for a new line or recontracting an existing plan?"
             }
-            log_interaction(message, reply, context["profile"])
+            log_interaction(user_id, message, reply, context["profile"])
             return reply
 
         print(f"[DEBUG] Updated profile: {context['profile']}")
@@ -278,7 +314,7 @@ def chat(message, history):
                     "role": "assistant",
                     "content": "Got it. Are you referring to a broadband (fibre) plan or a mobile plan?"
                 }
-                log_interaction(message, reply, context['profile'])
+                log_interaction(user_id, message, reply, context['profile'])
                 return reply
 
             if primary == "unknown":
@@ -288,7 +324,7 @@ def chat(message, history):
                         "role": "assistant",
                         "content": "Apologies, I'm here specifically to help you explore Singtel broadband and mobile plans. Let me know how I can assist with that!"
                     }
-                    log_interaction(message, reply, context['profile'])
+                    log_interaction(user_id, message, reply, context['profile'])
                     return reply
 
             context["primary"] = primary
@@ -307,7 +343,7 @@ def chat(message, history):
             "role": "assistant",
             "content": f"{tone} Are you currently with Singtel or switching from another provider?"
         }
-        log_interaction(message, reply, context['profile'])
+        log_interaction(user_id, message, reply, context['profile'])
         # NOTE: Do not return here; proceed to clarification questions block below
 
     # Clarify if user is recontracting or new
@@ -317,7 +353,7 @@ def chat(message, history):
             "role": "assistant",
             "content": "Are you signing up for a new line or recontracting an existing plan?"
         }
-        log_interaction(message, reply, context["profile"])
+        log_interaction(user_id, message, reply, context["profile"])
         return reply
 
     # Proceed with clarification questions
@@ -338,7 +374,7 @@ def chat(message, history):
         if question.strip().lower().rstrip("?") not in asked_questions:
             context["step"] = step + 1
             reply = {"role": "assistant", "content": question}
-            log_interaction(message, reply, context["profile"])
+            log_interaction(user_id, message, reply, context["profile"])
             return reply
         step += 1
     else:
@@ -347,20 +383,24 @@ def chat(message, history):
     # All questions answered → final recommendation
     num_questions = context["step"]
     user_answers = [msg["content"] for msg in history if msg["role"] == "user"][-num_questions:]
-    qna_pairs = "\n\n".join([
-        f"A{i+1}: {user_answers[i]}" for i in range(len(user_answers))
-    ])
-    prompt = (
-        f"A customer answered the following about their {sub_status.replace('_',' ')} {primary} plan needs:\n\n"
-        f"{qna_pairs}\n\n"
-        f"Recommend the most suitable Singtel plan with a short reason."
-    )
+    conversation = rolling_summary.current(user_id) if rolling_summary.ROLLING_SUMMARY else None
+    if conversation is not None:
+        # Rolling mode keeps the final prompts the same size however long the chat was
+        qna_pairs = (
+            f"Summary: {conversation}\n\n"
+            f"Latest answer: {rolling_summary.bounded(message, rolling_summary.MAX_EXCHANGE_CHARS)}"
+        )
+    else:
+        qna_pairs = "\n\n".join([
+            f"A{i+1}: {user_answers[i]}" for i in range(len(user_answers))
+        ])
+    prompt = prompt_registry.render("recommendation", sub_status=sub_status.replace("_", " "), primary=primary,
+                                    answers=qna_pairs)
 
     try:
-        with open("prompts.json", "r") as f:
-            system_prompt = json.load(f)["system_prompt"]
-
+        system_prompt = prompt_registry.render("system_prompt")
         response = client.chat.completions.create(
+            priority=rate_limiter.CRITICAL,
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -376,46 +416,18 @@ def chat(message, history):
     print("[DEBUG] Resetting user context")
     user_context[user_id] = {"primary": None, "sub_status": None, "step": 0, "telco_clarified": False}
     reply = {"role": "assistant", "content": reply}
-    log_interaction(message, reply, context['profile'])
-
-    # Save conversation summary for agent handoff
-    try:
-        # Generate GPT-based summary of the interaction
-        summary_prompt = (
-            f"Summarize this customer conversation in a way that a live sales agent can take over smoothly.\n\n"
-            f"User Profile: {json.dumps(context['profile'])}\n\n"
-            f"Q&A:\n{qna_pairs}\n\n"
-            f"Final Recommendation: {reply['content']}"
-        )
+    # The conversation is over: no point folding the recommendation into its summary
+    log_interaction(user_id, message, reply, context['profile'], summarise=False)
+    rolling_summary.reset(user_id)
 
-        try:
-            summary_response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant creating handover summaries for customer support."},
-                    {"role": "user", "content": summary_prompt}
-                ]
-            )
-            conversation_summary = summary_response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"[ERROR] Failed to generate conversation summary: {e}")
-            conversation_summary = "Summary unavailable due to error."
-
-        summary_entry = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "user_profile": context["profile"],
-            "answers": user_answers,
-            "final_recommendation": reply["content"],
-            "summary": conversation_summary
-        }
-        with open("handoff_summary.json", "w") as f:
-            json.dump(summary_entry, f, indent=2)
-    except Exception as e:
-        print(f"[ERROR] Failed to write handoff summary: {e}")
+    # Save conversation summary for agent handoff once the shopper has their reply
+    handoff_executor.submit(write_handoff_summary, user_id, context["profile"], user_answers, qna_pairs,
+                            reply["content"])
 
     return reply
 
 # Gradio UI
+prompt_registry.serve()
 gr.ChatInterface(
     fn=chat,
     title="Singtel Smart Shopper Assistant - POC",
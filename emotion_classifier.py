@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import json
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Local emotion tagging for the opening phrase of the provider question. Telco
+# lexicons plus the emotion-labeled examples in ssa_examples.jsonl score a
+# message in microseconds; only low-confidence messages go to the LLM. A small
+# sample of confident messages is also sent to the LLM in the background so the
+# agreement rate between the two stays visible.
+#
+#   python emotion_classifier.py "my fibre keeps dropping"
+#   python emotion_classifier.py --agreement interaction_log.jsonl   # compares with the LLM
+
+load_dotenv()
+EMOTION_MIN_CONFIDENCE = float(os.getenv("EMOTION_MIN_CONFIDENCE", "0.6"))
+EMOTION_AUDIT_RATE = float(os.getenv("EMOTION_AUDIT_RATE", "0.05"))
+EMOTION_EXAMPLES = os.getenv("EMOTION_EXAMPLES", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "ssa_examples.jsonl"))
+LABELS = ["neutral", "frustration", "positive"]
+# No lexicon cue is not evidence of a neutral message (price and speed complaints
+# often use words the lexicon lacks), so it stays below EMOTION_MIN_CONFIDENCE and
+# the LLM decides
+NEUTRAL_CONFIDENCE = 0.3
+STRONG_SCORE = 2.0
+NEGATORS = {"not", "no", "never", "isn't", "isnt", "wasn't", "don't", "dont", "doesn't", "doesnt", "hardly"}
+STOPWORDS = {"i", "my", "me", "a", "an", "the", "is", "are", "am", "to", "for", "of", "and", "it", "with", "on",
+             "in", "too", "so", "very", "really", "want", "need", "plan", "plans", "broadband", "fibre", "mobile"}
+
+LEXICON = {
+    "frustration": {
+        "expensive": 1.5, "pricey": 1.5, "overcharged": 2, "overcharging": 2, "bill shock": 2, "rip off": 2,
+        "ripoff": 2, "slow": 1.5, "lag": 1.5, "laggy": 1.5, "lagging": 1.5, "dropping": 1.5, "drops": 1,
+        "disconnect": 1.5, "disconnects": 1.5, "disconnected": 1.5, "keeps dropping": 2, "no signal": 2,
+        "down again": 2, "outage": 1.5, "unstable": 1.5, "terrible": 2, "horrible": 2, "awful": 2, "worst": 2,
+        "poor": 1.5, "useless": 2, "frustrated": 2, "frustrating": 2, "annoyed": 2, "annoying": 2, "angry": 2,
+        "upset": 2, "fed up": 2, "sick of": 2, "tired of": 2, "hate": 2, "ridiculous": 2, "complain": 1.5,
+        "complaint": 1.5, "unhappy": 2, "disappointed": 2, "cancel": 1, "terminate": 1, "problem": 1,
+        "problems": 1, "issue": 1, "issues": 1, "cheaper": 1, "can't afford": 2, "waste": 1.5,
+        "bad": 1.5, "sucks": 2, "too high": 2, "so high": 1.5, "too much": 1.5
+    },
+    "positive": {
+        "great": 1.5, "love": 2, "loving": 2, "happy": 2, "glad": 1.5, "thanks": 1, "thank you": 1.5,
+        "awesome": 2, "excellent": 2, "amazing": 2, "fantastic": 2, "perfect": 2, "good": 1, "nice": 1,
+        "satisfied": 2, "excited": 2, "keen": 1, "pleased": 2, "enjoy": 1.5, "wonderful": 2, "cool": 1
+    }
+}
+
+TOKEN = re.compile(r"[a-z0-9']+")
+
+stats = {"local": 0, "llm": 0, "audited": 0, "agreed": 0}
+stats_lock = threading.Lock()
+auditor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="emotion-audit")
+
+
+def load_examples(path, lexicon):
+    # Content words of labeled examples count towards their label, weaker than curated entries
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                doc = json.loads(line)
+                label = doc.get("metadata", {}).get("emotion")
+                if label not in lexicon:
+                    continue
+                for token in TOKEN.findall(doc["text"].lower()):
+                    if token not in STOPWORDS:
+                        lexicon[label].setdefault(token, 0.5)
+    except FileNotFoundError:
+        print(f"[DEBUG] No emotion examples at {path}; using the built-in lexicon only.")
+    return lexicon
+
+
+def compile_lexicon(lexicon):
+    # (label, weight) per unigram and per bigram so a message is scored in one pass
+    unigrams, bigrams = {}, {}
+    for label, entries in lexicon.items():
+        for phrase, weight in entries.items():
+            words = tuple(TOKEN.findall(phrase))
+            table = unigrams if len(words) == 1 else bigrams
+            table[words if len(words) > 1 else words[0]] = (label, weight)
+    return unigrams, bigrams
+
+
+unigrams, bigrams = compile_lexicon(load_examples(EMOTION_EXAMPLES, {k: dict(v) for k, v in LEXICON.items()}))
+
+
+def score(text):
+    tokens = TOKEN.findall(text.lower())
+    scores = {"frustration": 0.0, "positive": 0.0}
+    i = 0
+    while i < len(tokens):
+        match = bigrams.get(tuple(tokens[i:i + 2]))
+        width = 2
+        if match is None:
+            match, width = unigrams.get(tokens[i]), 1
+        if match:
+            label, weight = match
+            # "not happy" reads as frustration; "not bad" is left neutral
+            if any(t in NEGATORS for t in tokens[max(0, i - 3):i]):
+                label = "frustration" if label == "positive" else None
+            if label:
+                scores[label] += weight
+        i += width
+    return scores
+
+
+def classify(text):
+    scores = score(text)
+    top_label = max(scores, key=scores.get)
+    top, other = scores[top_label], min(scores.values())
+    if top == 0:
+        return "neutral", NEUTRAL_CONFIDENCE
+    confidence = (top - other) / top * min(1.0, top / STRONG_SCORE)
+    return top_label, round(confidence, 3)
+
+
+def normalize_label(raw):
+    raw = (raw or "").strip().lower()
+    for label in LABELS:
+        if label in raw:
+            return label
+    return "neutral"
+
+
+def record(kind, agreed=None):
+    with stats_lock:
+        stats[kind] += 1
+        if agreed is not None:
+            stats["agreed"] += int(agreed)
+
+
+def audit(text, label, llm_emotion):
+    try:
+        agreed = normalize_label(llm_emotion(text)) == label
+    except Exception as e:
+        print(f"[ERROR] Emotion audit failed: {e}")
+        return
+    record("audited", agreed)
+    with stats_lock:
+        snapshot = dict(stats)
+    print(f"[EMOTION] Local vs LLM agreement {snapshot['agreed']}/{snapshot['audited']}; "
+          f"local={snapshot['local']} llm={snapshot['llm']}")
+
+
+def detect(text, llm_emotion=None, audit_emotion=None):
+    # audit_emotion, if given, is used for the background audits instead of llm_emotion
+    label, confidence = classify(text)
+    if confidence >= EMOTION_MIN_CONFIDENCE or llm_emotion is None:
+        record("local")
+        print(f"[DEBUG] Emotion (local): {label} ({confidence})")
+        if llm_emotion is not None and random.random() < EMOTION_AUDIT_RATE:
+            auditor.submit(audit, text, label, audit_emotion or llm_emotion)
+        return label
+
+    record("llm")
+    try:
+        label = normalize_label(llm_emotion(text))
+    except Exception as e:
+        print(f"[ERROR] LLM emotion fallback failed: {e}")
+    print(f"[DEBUG] Emotion (llm fallback, local confidence {confidence}): {label}")
+    return label
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local emotion classifier")
+    parser.add_argument("text", nargs="?", help="message to classify")
+    parser.add_argument("--agreement", help="JSON lines with user_input (or text) to compare against the LLM")
+    parser.add_argument("--limit", type=int, default=200)
+    args = parser.parse_args()
+
+    if not args.agreement:
+        label, confidence = classify(args.text or sys.stdin.read())
+        print(json.dumps({"emotion": label, "confidence": confidence}))
+        return
+
+    from openai import OpenAI
+    import prompt_registry
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    def llm_emotion(text):
+        response = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": prompt_registry.render("emotion_system")},
+                {"role": "user", "content": prompt_registry.render("emotion", text=text)}
+            ]
+        )
+        return response.choices[0].message.content
+
+    compared = agreed = confident = confident_agreed = 0
+    with open(args.agreement) as f:
+        for line in f:
+            if compared >= args.limit:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            text = doc.get("user_input") or doc.get("text")
+            if not text:
+                continue
+            label, confidence = classify(text)
+            llm_label = normalize_label(llm_emotion(text))
+            compared += 1
+            agreed += label == llm_label
+            if confidence >= EMOTION_MIN_CONFIDENCE:
+                confident += 1
+                confident_agreed += label == llm_label
+            if label != llm_label:
+                print(f"[DIFF] local={label} ({confidence}) llm={llm_label}: {text}")
+
+    print(f"Compared: {compared}")
+    print(f"Agreement (all): {agreed / max(compared, 1):.1%}")
+    print(f"Handled locally at confidence >= {EMOTION_MIN_CONFIDENCE}: {confident / max(compared, 1):.1%}, "
+          f"agreement {confident_agreed / max(confident, 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import os
+import sys
+import json
+import time
+import types
+import hashlib
+import argparse
+import importlib
+import tempfile
+import contextlib
+
+# Accuracy, latency and call-count regression gates for the intent, profile,
+# emotion and offer-matching paths. Labeled utterances are seeded from
+# ssa_examples.jsonl plus the hand-labeled shopper messages in
+# eval_labeled.jsonl; labeled profiles for offer matching are in
+# eval_offers.jsonl. Each case is replayed through every path that has its label:
+#
+#   primary_intent         intent_classifier.detect_primary_intent (LLM)
+#   sub_intent             intent_classifier.detect_sub_intent (LLM)
+#   primary_intent_vector  chatbot-ssa.detect_primary_intent_vector (embedding + kNN vote)
+#   profile_fields         chatbot-ssa.update_profile_fields (LLM extraction)
+#   emotion_local          emotion_classifier.classify (lexicon, no calls)
+#   offer_match            catalog.match_offer on a complete or partial profile
+#   offer_settled          catalog.determined_offer ("none" while the offer can still change)
+#
+# The offer paths match against fibre_recommendation_matrix_ssa.json directly, so
+# they are deterministic and make no calls.
+#
+# OpenAI and OpenSearch responses are recorded once against the live services
+# and replayed from eval_recordings.json afterwards, so a run is deterministic
+# and free. Replayed calls add their recorded duration to the latency, so a
+# change that saves a call shows up as faster.
+#
+#   python evaluate.py --record            # live calls; refreshes eval_recordings.json
+#   python evaluate.py                     # replay and gate against eval_baseline.json
+#   python evaluate.py --update-baseline   # accept the current numbers
+#   python evaluate.py --ci --paths emotion_local,offer_match,offer_settled
+#                                          # CI gate; a path with no baseline fails
+#
+# A prompt, model or query change alters the recorded requests; the run then
+# reports unrecorded calls and fails until it is re-recorded.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LABELED_FILE = os.path.join(BASE_DIR, "eval_labeled.jsonl")
+OFFERS_FILE = os.path.join(BASE_DIR, "eval_offers.jsonl")
+MATRIX_FILE = os.path.join(BASE_DIR, "fibre_recommendation_matrix_ssa.json")
+RECORDINGS_FILE = os.path.join(BASE_DIR, "eval_recordings.json")
+BASELINE_FILE = os.path.join(BASE_DIR, "eval_baseline.json")
+INTENT_INDEX = "smartshopper-index"
+
+MAX_ACCURACY_DROP = 0.02
+MAX_LATENCY_GROWTH = 1.2
+LATENCY_SLACK_MS = 5.0
+MAX_CALLS_GROWTH = 0.01
+
+
+class UnrecordedCall(Exception):
+    pass
+
+
+def request_key(kind, request):
+    payload = json.dumps({"kind": kind, "request": request}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def as_object(data):
+    # Replayed OpenAI responses are read by attribute, like the SDK's models
+    return json.loads(json.dumps(data), object_hook=lambda d: types.SimpleNamespace(**d))
+
+
+class Recorder:
+    def __init__(self, path, record=False):
+        self.path = path
+        self.record = record
+        self.recordings = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.recordings = json.load(f)
+        self.used = set()
+        self.calls = 0
+        self.recorded_seconds = 0.0
+        self.unrecorded = 0
+
+    def call(self, kind, request, live):
+        key = request_key(kind, request)
+        self.calls += 1
+        self.used.add(key)
+        if self.record:
+            started = time.perf_counter()
+            response = live()
+            self.recordings[key] = {"kind": kind, "response": response,
+                                    "seconds": round(time.perf_counter() - started, 4)}
+            return response
+        if key not in self.recordings:
+            self.unrecorded += 1
+            raise UnrecordedCall(f"No recorded {kind} response; run evaluate.py --record")
+        entry = self.recordings[key]
+        self.recorded_seconds += entry["seconds"]
+        return entry["response"]
+
+    def save(self):
+        # Drop responses no path asked for any more so the file tracks the current prompts
+        kept = {key: entry for key, entry in self.recordings.items() if key in self.used}
+        with open(self.path, "w") as f:
+            json.dump(kept, f, indent=1, sort_keys=True)
+        print(f"[EVAL] Saved {len(kept)} recorded responses to {self.path}")
+
+
+class RecordedCompletions:
+    def __init__(self, recorder, live):
+        self.recorder = recorder
+        self.live = live
+
+    def create(self, priority=None, **kwargs):
+        def live():
+            response = self.live.chat.completions.create(**kwargs)
+            return json.loads(response.model_dump_json())
+        return as_object(self.recorder.call("chat", kwargs, live))
+
+
+class RecordedEmbeddings:
+    def __init__(self, recorder, live):
+        self.recorder = recorder
+        self.live = live
+
+    def create(self, priority=None, **kwargs):
+        def live():
+            response = self.live.embeddings.create(**kwargs)
+            return json.loads(response.model_dump_json())
+        return as_object(self.recorder.call("embed", kwargs, live))
+
+
+class RecordedClient:
+    """Stands in for the rate-limited OpenAI client; live calls go to the real one when recording."""
+
+    def __init__(self, recorder, live):
+        self.chat = types.SimpleNamespace(completions=RecordedCompletions(recorder, live))
+        self.embeddings = RecordedEmbeddings(recorder, live)
+
+
+class SearchResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class RecordedSearch:
+    """Stands in for catalog.session. Intent searches drop the utterance's own document
+    from the neighbours (leave-one-out), as calibrate_intent.py does, so seed examples
+    are scored as if the text were new."""
+
+    def __init__(self, recorder, live):
+        self.recorder = recorder
+        self.live = live
+        self.current_text = None
+
+    def get(self, url, json=None, **kwargs):
+        index_name = url.rstrip("/").split("/")[-2]
+
+        def live():
+            res = self.live.get(url, json=json, **kwargs)
+            return {"status_code": res.status_code, "data": res.json() if res.status_code == 200 else {}}
+
+        recorded = self.recorder.call("search", {"index": index_name, "body": json}, live)
+        data = recorded["data"]
+        if index_name == INTENT_INDEX and self.current_text and data.get("hits"):
+            hits = [hit for hit in data["hits"]["hits"]
+                    if normalize(hit["_source"].get("text")) != normalize(self.current_text)]
+            data = dict(data, hits=dict(data["hits"], hits=hits))
+        return SearchResponse(recorded["status_code"], data)
+
+
+def normalize(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                doc = json.loads(line)
+                if "index" not in doc:
+                    yield doc
+
+
+def labeled_cases(extra=None):
+    cases = {}
+
+    def add(text, source, **labels):
+        case = cases.setdefault(normalize(text), {"text": text, "source": source})
+        case.update({name: value for name, value in labels.items() if value})
+
+    for doc in read_jsonl(os.path.join(BASE_DIR, "ssa_examples.jsonl")):
+        intent = doc["metadata"].get("intent", "unknown")
+        add(doc["text"], "ssa_examples", intent=intent,
+            profile={"plan_type": intent} if intent in ["fibre", "mobile"] else None)
+    # clarifications.jsonl is left out: its texts are the bot's own questions, not shopper messages
+    for path in [LABELED_FILE] + ([extra] if extra else []):
+        if os.path.exists(path):
+            for doc in read_jsonl(path):
+                add(doc["text"], os.path.basename(path), intent=doc.get("intent"),
+                    sub_intent=doc.get("sub_intent"), profile=doc.get("profile"), emotion=doc.get("emotion"))
+    # An offer case's profile is the input to match, not an extraction label
+    offers = [{"text": json.dumps(doc["profile"], sort_keys=True), "source": os.path.basename(OFFERS_FILE),
+               "matching_profile": doc["profile"], "offer": doc["offer"], "settled": doc["settled"]}
+              for doc in read_jsonl(OFFERS_FILE)] if os.path.exists(OFFERS_FILE) else []
+    return list(cases.values()) + offers
+
+
+def profile_matches(predicted, expected):
+    return all(normalize(predicted.get(field)) == normalize(value) for field, value in expected.items())
+
+
+def offer_id(offer):
+    return offer["offerId"] if offer else "none"
+
+
+def classifier_paths(bot, intent_classifier, emotion_classifier, catalog, records):
+    # name -> (label on the case, classifier of the case, does the prediction match the label)
+    matrix = [records.MatrixRow.from_source(doc) for doc in read_jsonl(MATRIX_FILE)]
+    return {
+        "primary_intent": ("intent", lambda case: intent_classifier.detect_primary_intent(case["text"]),
+                           lambda p, e: p == e),
+        "sub_intent": ("sub_intent", lambda case: intent_classifier.detect_sub_intent(case["text"]),
+                       lambda p, e: p == e),
+        "primary_intent_vector": ("intent", lambda case: bot.detect_primary_intent_vector(case["text"])["intent"],
+                                  lambda p, e: p == e),
+        "profile_fields": ("profile", lambda case: bot.update_profile_fields(case["text"], {}), profile_matches),
+        "emotion_local": ("emotion", lambda case: emotion_classifier.classify(case["text"])[0], lambda p, e: p == e),
+        "offer_match": ("offer", lambda case: offer_id(catalog.match_offer(matrix, case["matching_profile"])),
+                        lambda p, e: p == e),
+        "offer_settled": ("settled", lambda case: offer_id(catalog.determined_offer(matrix, case["matching_profile"])),
+                          lambda p, e: p == e)
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def evaluate_path(bot, recorder, search, label, classify, matches, cases):
+    # Every path starts cold so its calls per utterance do not depend on the paths before it
+    with bot.embedding_cache_lock:
+        bot.embedding_cache.clear()
+    correct, latencies, calls, misses = 0, [], 0, []
+    for case in cases:
+        search.current_text = case["text"]
+        calls_before, seconds_before = recorder.calls, recorder.recorded_seconds
+        started = time.perf_counter()
+        try:
+            predicted = classify(case)
+            error = None
+        except Exception as e:
+            # The vector path lets search and embedding errors through to the chat handler
+            predicted, error = None, e
+        latencies.append(time.perf_counter() - started + recorder.recorded_seconds - seconds_before)
+        calls += recorder.calls - calls_before
+        if error is None and matches(predicted, case[label]):
+            correct += 1
+        else:
+            misses.append({"text": case["text"], "expected": case[label],
+                           "predicted": predicted if error is None else f"error: {error}"})
+    return {
+        "cases": len(cases),
+        "accuracy": round(correct / len(cases), 4),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "calls_per_utterance": round(calls / len(cases), 3),
+        "misses": misses
+    }
+
+
+def regressions(results, baseline, args):
+    failures = []
+    for name, result in results.items():
+        if result["unrecorded"]:
+            failures.append(f"{name}: {result['unrecorded']} calls have no recorded response")
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["accuracy"] < base["accuracy"] - args.max_accuracy_drop:
+            failures.append(f"{name}: accuracy {result['accuracy']:.1%} < baseline {base['accuracy']:.1%}")
+        if result["p95_ms"] > base["p95_ms"] * args.max_latency_growth + LATENCY_SLACK_MS:
+            failures.append(f"{name}: p95 {result['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if result["calls_per_utterance"] > base["calls_per_utterance"] + MAX_CALLS_GROWTH:
+            failures.append(f"{name}: {result['calls_per_utterance']} calls/utterance > "
+                            f"baseline {base['calls_per_utterance']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Labeled evaluation of the intent and profile classifiers")
+    parser.add_argument("--record", action="store_true", help="call OpenAI and OpenSearch and save the responses")
+    parser.add_argument("--paths", help="comma-separated classifier paths (default: all)")
+    parser.add_argument("--labeled", help="extra JSON lines with text and intent/sub_intent/profile labels")
+    parser.add_argument("--update-baseline", action="store_true", help="write these results to the baseline")
+    parser.add_argument("--ci", action="store_true", help="fail when a path has no baseline instead of skipping it")
+    parser.add_argument("--max-accuracy-drop", type=float, default=MAX_ACCURACY_DROP)
+    parser.add_argument("--max-latency-growth", type=float, default=MAX_LATENCY_GROWTH)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the classifiers' debug output")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BASE_DIR)
+    import catalog
+    import records
+    import intent_classifier
+    import emotion_classifier
+    bot = importlib.import_module("chatbot-ssa")
+
+    recorder = Recorder(RECORDINGS_FILE, record=args.record)
+    llm = RecordedClient(recorder, bot.client)
+    intent_classifier.client = RecordedClient(recorder, intent_classifier.client)
+    bot.client = llm
+    search = RecordedSearch(recorder, catalog.session)
+    catalog.session = search
+    output_path = os.path.abspath(args.json) if args.json else None
+    labeled_path = os.path.abspath(args.labeled) if args.labeled else None
+    # Failed extractions are logged as interactions; keep those out of the working tree
+    with tempfile.TemporaryDirectory(prefix="ssa-eval-") as workdir:
+        os.chdir(workdir)
+        try:
+            status = run(args, bot, recorder, search, output_path, labeled_path,
+                         classifier_paths(bot, intent_classifier, emotion_classifier, catalog, records))
+        finally:
+            os.chdir(BASE_DIR)
+    sys.exit(status)
+
+
+def run(args, bot, recorder, search, output_path, labeled_path, paths):
+    cases = labeled_cases(labeled_path)
+    selected = args.paths.split(",") if args.paths else list(paths)
+    results = {}
+    for name in selected:
+        label, classify, matches = paths[name]
+        labeled = [case for case in cases if case.get(label)]
+        unrecorded_before = recorder.unrecorded
+        output = sys.stdout if args.verbose else open(os.devnull, "w")
+        with contextlib.redirect_stdout(output):
+            results[name] = evaluate_path(bot, recorder, search, label, classify, matches, labeled)
+        results[name]["unrecorded"] = recorder.unrecorded - unrecorded_before
+        for miss in results[name]["misses"]:
+            print(f"[MISS] {name}: {miss['text']!r} expected {miss['expected']} got {miss['predicted']}")
+
+    if args.record:
+        recorder.save()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    print(f"\n{'path':<22} {'cases':>6} {'accuracy':>9} {'baseline':>9} {'mean ms':>8} {'p95 ms':>8} "
+          f"{'calls':>6} {'unrec':>6}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get("accuracy")
+        print(f"{name:<22} {result['cases']:>6} {result['accuracy']:>9.1%} "
+              f"{f'{base:.1%}' if base is not None else '-':>9} {result['mean_ms']:>8} {result['p95_ms']:>8} "
+              f"{result['calls_per_utterance']:>6} {result['unrecorded']:>6}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        unrecorded = sum(result["unrecorded"] for result in results.values())
+        if unrecorded:
+            print(f"[EVAL] {unrecorded} calls have no recorded response; re-record before updating the baseline.")
+            return 1
+        baseline.update({name: {key: value for key, value in result.items() if key not in ["misses", "unrecorded"]}
+                         for name, result in results.items()})
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"[EVAL] Baseline updated in {BASELINE_FILE}")
+        return 0
+
+    failures = regressions(results, baseline, args)
+    ungated = [name for name in results if name not in baseline]
+    if ungated and args.ci:
+        # In CI a path without a baseline would pass whatever it scored
+        failures.extend(f"{name}: no baseline in {os.path.basename(BASELINE_FILE)}" for name in ungated)
+    elif ungated:
+        print(f"[EVAL] No baseline yet for {', '.join(ungated)}; run with --update-baseline to start gating.")
+    for failure in failures:
+        print(f"[REGRESSION] {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,21 @@
 import openai
 import os
 from dotenv import load_dotenv
+import async_clients
+import prompt_registry
+import rate_limiter
 
 load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = rate_limiter.wrap(openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
 
-def is_off_topic(message):
-    prompt = f"""
-Determine if the following message is unrelated to choosing a Singtel broadband or mobile plan.
+def off_topic_prompt(message):
+    return prompt_registry.render("off_topic", message=message)
 
-Reply with only "yes" or "no".
+def salutation_prompt(message):
+    return prompt_registry.render("salutation", message=message)
 
-Message: "{message}"
-"""
+def is_off_topic(message):
+    prompt = off_topic_prompt(message)
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -25,15 +28,7 @@ Message: "{message}"
         return False  # fallback to not block
 
 def is_salutation(message):
-    prompt = f"""
-Determine if the following message is just a salutation or casual greeting, like 'hello', 'hi', or 'good morning', with no real intent to explore Singtel broadband or mobile plans.
-
-Only reply "yes" if the message is clearly just a standalone greeting — not if it mentions telcos, plans, or account status.
-
-Respond with only "yes" or "no".
-
-Message: "{message}"
-"""
+    prompt = salutation_prompt(message)
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -44,3 +39,21 @@ Message: "{message}"
     except Exception as e:
         print(f"[Guardrails Error - Salutation]: {e}")
         return False
+
+async def is_off_topic_async(message):
+    try:
+        response = await async_clients.complete([{"role": "user", "content": off_topic_prompt(message)}])
+        result = response.choices[0].message.content.strip().lower()
+        return result.startswith("yes")
+    except Exception as e:
+        print(f"[Guardrails Error]: {e}")
+        return False  # fallback to not block
+
+async def is_salutation_async(message):
+    try:
+        response = await async_clients.complete([{"role": "user", "content": salutation_prompt(message)}])
+        result = response.choices[0].message.content.strip().lower()
+        return result.startswith("yes")
+    except Exception as e:
+        print(f"[Guardrails Error - Salutation]: {e}")
+        return False
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import sqlite3
+import time
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# Append-only store for agent handoff summaries. Entries are queued by the chat
+# handlers and written in batches by one background thread; lookups by session,
+# timestamp and offerId go through SQLite indexes.
+
+load_dotenv()
+HANDOFF_DB = os.getenv("HANDOFF_DB", "handoff_summaries.db")
+HANDOFF_BATCH_SIZE = int(os.getenv("HANDOFF_BATCH_SIZE", "50"))
+HANDOFF_FLUSH_INTERVAL = float(os.getenv("HANDOFF_FLUSH_INTERVAL", "1.0"))
+HANDOFF_WRITE_ATTEMPTS = int(os.getenv("HANDOFF_WRITE_ATTEMPTS", "5"))
+HANDOFF_RETRY_DELAY = float(os.getenv("HANDOFF_RETRY_DELAY", "0.5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS handoffs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT,
+    timestamp TEXT NOT NULL,
+    offer_id TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS handoffs_session ON handoffs (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS handoffs_timestamp ON handoffs (timestamp);
+CREATE INDEX IF NOT EXISTS handoffs_offer ON handoffs (offer_id, timestamp);
+"""
+
+pending = queue.Queue()
+writer = None
+writer_lock = threading.Lock()
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or HANDOFF_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def write_batch(conn, rows):
+    with conn:
+        conn.executemany(
+            "INSERT INTO handoffs (session_id, timestamp, offer_id, entry) VALUES (?, ?, ?, ?)", rows
+        )
+    print(f"[HANDOFF] Wrote {len(rows)} summaries to {HANDOFF_DB}")
+
+
+def write_with_retry(conn, batch):
+    # A locked or busy database is usually transient: back off and retry the same
+    # batch, and give up on it only after HANDOFF_WRITE_ATTEMPTS
+    for attempt in range(1, HANDOFF_WRITE_ATTEMPTS + 1):
+        try:
+            write_batch(conn, batch)
+            return True
+        except Exception as e:
+            if attempt == HANDOFF_WRITE_ATTEMPTS:
+                sessions = ", ".join(sorted({str(row[0]) for row in batch}))
+                print(f"[ERROR] Dropped handoff batch of {len(batch)} after {attempt} attempts "
+                      f"(sessions: {sessions}): {e}")
+                return False
+            delay = HANDOFF_RETRY_DELAY * 2 ** (attempt - 1)
+            print(f"[ERROR] Failed to write handoff batch (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def run_writer():
+    conn = connect()
+    while True:
+        item = pending.get()
+        batch, waiters = [], []
+        while item is not None:
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+                break
+            batch.append(item)
+            if len(batch) >= HANDOFF_BATCH_SIZE:
+                break
+            try:
+                item = pending.get(timeout=HANDOFF_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+        if batch:
+            write_with_retry(conn, batch)
+        for waiter in waiters:
+            waiter.set()
+
+
+def start_writer():
+    global writer
+    with writer_lock:
+        if writer is None or not writer.is_alive():
+            writer = threading.Thread(target=run_writer, name="handoff-writer", daemon=True)
+            writer.start()
+
+
+def save(entry):
+    start_writer()
+    # Serialize now so later changes to the session's profile cannot leak into the record
+    pending.put((entry.get("session_id"), entry["timestamp"], entry.get("offer_id"), json.dumps(entry)))
+
+
+def flush(timeout=10):
+    if writer is None:
+        return
+    done = threading.Event()
+    pending.put(done)
+    done.wait(timeout)
+
+
+atexit.register(flush)
+
+
+def rows_to_entries(cursor, batch_size=500):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for (entry,) in rows:
+            yield json.loads(entry)
+
+
+def query(sql, params, path=None):
+    conn = connect(path)
+    try:
+        yield from rows_to_entries(conn.execute(sql, params))
+    finally:
+        conn.close()
+
+
+def find_by_session(session_id, path=None):
+    return list(query("SELECT entry FROM handoffs WHERE session_id = ? ORDER BY timestamp", (session_id,), path))
+
+
+def find_by_offer(offer_id, limit=100, path=None):
+    return list(query(
+        "SELECT entry FROM handoffs WHERE offer_id = ? ORDER BY timestamp DESC LIMIT ?", (offer_id, limit), path
+    ))
+
+
+def find_between(start, end, path=None):
+    return list(query(
+        "SELECT entry FROM handoffs WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp", (start, end), path
+    ))
+
+
+def export(since=None, until=None, path=None):
+    # Streams entries in timestamp order without loading the whole table
+    return query(
+        "SELECT entry FROM handoffs WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+        (since or "", until or "9999"), path
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up agent handoff summaries")
+    parser.add_argument("--db", default=HANDOFF_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("session", help="summaries for a session").add_argument("session_id")
+    commands.add_parser("offer", help="latest summaries recommending an offer").add_argument("offer_id")
+    between = commands.add_parser("between", help="summaries in a time range (ISO timestamps)")
+    between.add_argument("start")
+    between.add_argument("end")
+    export_cmd = commands.add_parser("export", help="stream summaries as JSON lines for the agent console")
+    export_cmd.add_argument("--since")
+    export_cmd.add_argument("--until")
+    args = parser.parse_args()
+
+    if args.command == "session":
+        entries = find_by_session(args.session_id, args.db)
+    elif args.command == "offer":
+        entries = find_by_offer(args.offer_id, path=args.db)
+    elif args.command == "between":
+        entries = find_between(args.start, args.end, args.db)
+    else:
+        entries = export(args.since, args.until, args.db)
+
+    for entry in entries:
+        sys.stdout.write(json.dumps(entry) + "\n")
+
+
+if __name__ == "__main__":
+    main()
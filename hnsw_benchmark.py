@@ -0,0 +1,349 @@
+import os
+import json
+import math
+import time
+import heapq
+import random
+import argparse
+import statistics
+import requests
+import numpy as np
+from dotenv import load_dotenv
+
+# Recall/latency sweep over HNSW settings for the smartshopper kNN index.
+#
+#   python hnsw_benchmark.py                                      # in-process engine, synthetic vectors
+#   python hnsw_benchmark.py --vectors embeddings.jsonl --m 8,16,32 --ef-search 16,64,256
+#   python hnsw_benchmark.py --backend opensearch --host http://localhost:9200 --engines faiss,nmslib,lucene
+#
+# Every (engine, m, ef_construction) builds one index; every ef_search is then
+# queried against it. Recall@k is measured against exact brute-force cosine
+# results over the same vectors, so the numbers compare like for like.
+
+load_dotenv(dotenv_path=".env")
+BENCHMARK_INDEX_PREFIX = "hnsw-benchmark"
+
+
+def load_vectors(path):
+    vectors = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            if "embedding" in doc:
+                vectors.append(doc["embedding"])
+    return np.array(vectors, dtype=np.float32)
+
+
+def synthetic_vectors(count, dim, clusters, seed):
+    # Clustered points look more like sentence embeddings than uniform noise does
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, size=count)
+    return (centres[labels] + 0.35 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def sample_queries(vectors, count, seed):
+    # Perturbed corpus points: close to real documents without being exact duplicates
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, len(vectors), size=count)
+    noise = rng.normal(scale=0.1 * float(np.abs(vectors).mean()), size=(count, vectors.shape[1]))
+    return normalize(vectors[picks] + noise.astype(np.float32))
+
+
+def exact_neighbours(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, kth=min(k, scores.shape[1] - 1), axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+class HNSWIndex:
+    """In-process HNSW over normalized vectors (cosine), used when no OpenSearch is reachable."""
+
+    def __init__(self, vectors, m, ef_construction, seed=0):
+        self.data = vectors
+        self.m = m
+        self.max_links = {0: 2 * m}
+        self.ef_construction = ef_construction
+        self.level_mult = 1 / math.log(m)
+        self.graph = []
+        self.entry = None
+        self.rng = random.Random(seed)
+        for i in range(len(vectors)):
+            self.add(i)
+
+    def distances(self, query, ids):
+        return (1 - self.data[ids] @ query).tolist()
+
+    def search_layer(self, query, entry_points, ef, level):
+        visited = set(entry_points)
+        found = list(zip(self.distances(query, entry_points), entry_points))
+        candidates = list(found)
+        heapq.heapify(candidates)
+        results = [(-d, i) for d, i in found]
+        heapq.heapify(results)
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if len(results) >= ef and distance > -results[0][0]:
+                break
+            neighbours = [n for n in self.graph[level].get(node, ()) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for d, n in zip(self.distances(query, neighbours), neighbours):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, i) for d, i in results)
+
+    def prune(self, node, level):
+        links = self.graph[level][node]
+        limit = self.max_links.get(level, self.m)
+        if len(links) > limit:
+            ranked = sorted(zip(self.distances(self.data[node], links), links))
+            self.graph[level][node] = [n for _, n in ranked[:limit]]
+
+    def add(self, node):
+        query = self.data[node]
+        level = int(-math.log(1 - self.rng.random()) * self.level_mult)
+        while len(self.graph) <= level:
+            self.graph.append({})
+        if self.entry is None:
+            for layer in range(level + 1):
+                self.graph[layer][node] = []
+            self.entry, self.top_level = node, level
+            return
+
+        entry_points = [self.entry]
+        for layer in range(self.top_level, level, -1):
+            entry_points = [self.search_layer(query, entry_points, 1, layer)[0][1]]
+        for layer in range(min(level, self.top_level), -1, -1):
+            found = self.search_layer(query, entry_points, self.ef_construction, layer)
+            neighbours = [n for _, n in found[:self.m]]
+            self.graph[layer][node] = neighbours
+            for n in neighbours:
+                self.graph[layer][n].append(node)
+                self.prune(n, layer)
+            entry_points = [n for _, n in found]
+        if level > self.top_level:
+            for layer in range(self.top_level + 1, level + 1):
+                self.graph[layer][node] = []
+            self.entry, self.top_level = node, level
+
+    def search(self, query, k, ef_search):
+        entry_points = [self.entry]
+        for layer in range(self.top_level, 0, -1):
+            entry_points = [self.search_layer(query, entry_points, 1, layer)[0][1]]
+        return [n for _, n in self.search_layer(query, entry_points, max(ef_search, k), 0)[:k]]
+
+    def memory_bytes(self):
+        # float32 vectors plus int32 links, the same layout faiss keeps in memory
+        links = sum(len(neighbours) for layer in self.graph for neighbours in layer.values())
+        return self.data.nbytes + 4 * links
+
+
+class InProcessBackend:
+    engines = ["inprocess"]
+
+    def build(self, engine, vectors, m, ef_construction):
+        started = time.perf_counter()
+        self.index = HNSWIndex(vectors, m, ef_construction)
+        return time.perf_counter() - started
+
+    def search(self, query, k, ef_search):
+        return self.index.search(query, k, ef_search)
+
+    def memory_bytes(self):
+        return self.index.memory_bytes()
+
+    def drop(self):
+        self.index = None
+
+
+class OpenSearchBackend:
+    engines = ["faiss", "nmslib", "lucene"]
+
+    def __init__(self, host, auth):
+        self.host = host.rstrip("/")
+        self.session = requests.Session()
+        if auth[0]:
+            self.session.auth = auth
+        self.session.headers["Content-Type"] = "application/json"
+
+    def build(self, engine, vectors, m, ef_construction):
+        self.engine = engine
+        self.index_name = f"{BENCHMARK_INDEX_PREFIX}-{engine}-m{m}-efc{ef_construction}"
+        self.session.delete(f"{self.host}/{self.index_name}")
+        payload = {
+            "settings": {"index": {"knn": True, "number_of_shards": 1, "number_of_replicas": 0}},
+            "mappings": {
+                "properties": {
+                    "embedding": {
+                        "type": "knn_vector",
+                        "dimension": int(vectors.shape[1]),
+                        "method": {
+                            "name": "hnsw",
+                            "space_type": "cosinesimil",
+                            "engine": engine,
+                            "parameters": {"m": m, "ef_construction": ef_construction}
+                        }
+                    }
+                }
+            }
+        }
+        res = self.session.put(f"{self.host}/{self.index_name}", json=payload)
+        if res.status_code != 200:
+            raise RuntimeError(f"Failed to create {self.index_name}: {res.status_code} {res.text}")
+
+        started = time.perf_counter()
+        for start in range(0, len(vectors), 500):
+            lines = []
+            for i in range(start, min(start + 500, len(vectors))):
+                lines.append(json.dumps({"index": {"_id": str(i)}}))
+                lines.append(json.dumps({"embedding": vectors[i].tolist()}))
+            res = self.session.post(f"{self.host}/{self.index_name}/_bulk", data="\n".join(lines) + "\n",
+                                    headers={"Content-Type": "application/x-ndjson"})
+            if res.status_code != 200 or res.json().get("errors"):
+                raise RuntimeError(f"Bulk load into {self.index_name} failed: {res.text[:500]}")
+        self.session.post(f"{self.host}/{self.index_name}/_refresh")
+        self.session.post(f"{self.host}/{self.index_name}/_forcemerge", params={"max_num_segments": 1})
+        # Load the graphs before timing queries so the first ef_search does not pay for it
+        self.session.post(f"{self.host}/_plugins/_knn/warmup/{self.index_name}")
+        return time.perf_counter() - started
+
+    def search(self, query, k, ef_search):
+        body = {
+            "size": k,
+            "_source": False,
+            "query": {
+                "knn": {
+                    "embedding": {
+                        "vector": query.tolist(),
+                        # Lucene sizes its candidate queue from k
+                        "k": max(k, ef_search) if self.engine == "lucene" else k,
+                        "method_parameters": {"ef_search": ef_search}
+                    }
+                }
+            }
+        }
+        res = self.session.post(f"{self.host}/{self.index_name}/_search", json=body)
+        if res.status_code != 200:
+            raise RuntimeError(f"Search on {self.index_name} failed: {res.status_code} {res.text[:500]}")
+        return [int(hit["_id"]) for hit in res.json()["hits"]["hits"]]
+
+    def memory_bytes(self):
+        res = self.session.get(f"{self.host}/_plugins/_knn/stats")
+        if res.status_code == 200:
+            total_kb = 0
+            for node in res.json().get("nodes", {}).values():
+                total_kb += node.get("indices_in_cache", {}).get(self.index_name, {}).get("graph_memory_usage", 0)
+            if total_kb:
+                return total_kb * 1024
+        # Lucene graphs live in the page cache rather than the k-NN cache; fall back to store size
+        res = self.session.get(f"{self.host}/{self.index_name}/_stats/store")
+        return res.json()["_all"]["total"]["store"]["size_in_bytes"] if res.status_code == 200 else None
+
+    def drop(self):
+        self.session.delete(f"{self.host}/{self.index_name}")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def sweep(backend, engines, vectors, queries, k, ms, ef_constructions, ef_searches):
+    truth = exact_neighbours(vectors, queries, k)
+    rows = []
+    for engine in engines:
+        for m in ms:
+            for ef_construction in ef_constructions:
+                build_seconds = backend.build(engine, vectors, m, ef_construction)
+                memory = backend.memory_bytes()
+                for ef_search in ef_searches:
+                    latencies, hits = [], 0
+                    for query, expected in zip(queries, truth):
+                        started = time.perf_counter()
+                        found = backend.search(query, k, ef_search)
+                        latencies.append(time.perf_counter() - started)
+                        hits += len(expected.intersection(found))
+                    rows.append({
+                        "engine": engine,
+                        "m": m,
+                        "ef_construction": ef_construction,
+                        "ef_search": ef_search,
+                        "recall": round(hits / (k * len(queries)), 4),
+                        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+                        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+                        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+                        "build_s": round(build_seconds, 2),
+                        "memory_mb": round(memory / 2 ** 20, 2) if memory else None
+                    })
+                    print(f"[BENCH] {rows[-1]}")
+                backend.drop()
+    return rows
+
+
+def print_table(rows, k):
+    columns = ["engine", "m", "ef_construction", "ef_search", "recall", "p50_ms", "p95_ms", "p99_ms",
+               "build_s", "memory_mb"]
+    header = {"recall": f"recall@{k}", "ef_construction": "ef_constr"}
+    widths = {c: max(len(header.get(c, c)), *(len(str(row[c])) for row in rows)) for c in columns}
+    print("\n" + " ".join(header.get(c, c).rjust(widths[c]) for c in columns))
+    for row in rows:
+        print(" ".join(str(row[c]).rjust(widths[c]) for c in columns))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW recall/latency sweep against brute-force cosine")
+    parser.add_argument("--backend", choices=["inprocess", "opensearch"], default="inprocess")
+    parser.add_argument("--host", default=os.getenv("OPENSEARCH_HOST"), help="OpenSearch (or local stand-in) URL")
+    parser.add_argument("--engines", help="comma-separated engines (opensearch: faiss,nmslib,lucene)")
+    parser.add_argument("--vectors", help="JSON lines with an embedding field; synthetic vectors otherwise")
+    parser.add_argument("--count", type=int, default=2000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=128, help="synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int_list, default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int_list, default=[64, 128])
+    parser.add_argument("--ef-search", type=int_list, default=[16, 32, 64, 128])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", default="hnsw_benchmark.json", help="write results to this file")
+    args = parser.parse_args()
+
+    raw = load_vectors(args.vectors) if args.vectors else synthetic_vectors(args.count, args.dim, 24, args.seed)
+    vectors = normalize(raw)
+    queries = sample_queries(vectors, args.queries, args.seed)
+    print(f"[DEBUG] {len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries")
+
+    if args.backend == "opensearch":
+        if not args.host:
+            raise ValueError("Set OPENSEARCH_HOST or pass --host for the opensearch backend.")
+        backend = OpenSearchBackend(args.host, (os.getenv("OPENSEARCH_USER"), os.getenv("OPENSEARCH_PASS")))
+    else:
+        backend = InProcessBackend()
+    engines = args.engines.split(",") if args.engines else backend.engines
+
+    rows = sweep(backend, engines, vectors, queries, args.k, args.m, args.ef_construction, args.ef_search)
+    print_table(rows, args.k)
+    with open(args.json, "w") as f:
+        json.dump({"k": args.k, "vectors": len(vectors), "dimension": int(vectors.shape[1]),
+                   "queries": len(queries), "results": rows}, f, indent=2)
+    print(f"\n[DEBUG] Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
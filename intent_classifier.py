@@ -1,22 +1,16 @@
 import openai
 import os
+import json
+import threading
+import prompt_registry
+import rate_limiter
 from dotenv import load_dotenv
 
 load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = rate_limiter.wrap(openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
 
 def detect_primary_intent(message):
-    prompt = f"""
-Classify the user's request into one of these high-level categories:
-
-- fibre
-- mobile
-- unknown
-
-Only return one word. No explanation. No punctuation.
-
-User input: "{message}"
-"""
+    prompt = prompt_registry.render("primary_intent", message=message)
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -30,17 +24,7 @@ User input: "{message}"
         return "unknown"
 
 def detect_sub_intent(message):
-    prompt = f"""
-Classify the user's intent into one of the following:
-
-- new_line
-- recontract
-- unknown
-
-Only return one word. No explanation. No punctuation.
-
-User input: "{message}"
-"""
+    prompt = prompt_registry.render("sub_intent", message=message)
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -52,3 +36,70 @@ User input: "{message}"
     except Exception as e:
         print(f"[ERROR] Sub-intent detection failed: {e}")
         return "unknown"
+
+# Vector intent detection: k nearest labeled examples vote, weighted by score.
+# The thresholds that make a vote "confident" enough to skip the LLM
+# clarification call are calibrated offline by calibrate_intent.py.
+INTENT_CALIBRATION_FILE = os.getenv("INTENT_CALIBRATION_FILE", "intent_calibration.json")
+DEFAULT_CALIBRATION = {"k": 5, "min_score": 0.5, "min_margin": 1.01}  # never confident until calibrated
+
+def load_calibration(path=INTENT_CALIBRATION_FILE):
+    calibration = dict(DEFAULT_CALIBRATION)
+    try:
+        with open(path) as f:
+            calibration.update(json.load(f))
+        print(f"[DEBUG] Loaded intent calibration: {calibration}")
+    except FileNotFoundError:
+        print(f"[DEBUG] No intent calibration at {path}; the LLM confirms every vector intent.")
+    return calibration
+
+calibration = load_calibration()
+
+def intent_vector_query(vector, k=None):
+    k = k or calibration["k"]
+    return {
+        "size": k,
+        "query": {
+            "knn": {
+                "embedding": {
+                    "vector": vector,
+                    "k": k
+                }
+            }
+        }
+    }
+
+def vote_intent(hits, min_score=None, min_margin=None):
+    min_score = calibration["min_score"] if min_score is None else min_score
+    min_margin = calibration["min_margin"] if min_margin is None else min_margin
+    if not hits:
+        return {"intent": "unknown", "top_score": 0.0, "margin": 0.0, "confident": False}
+
+    weights = {}
+    for hit in hits:
+        intent = hit["_source"]["metadata"].get("intent", "unknown")
+        weights[intent] = weights.get(intent, 0.0) + hit["_score"]
+    ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)
+    total = sum(weights.values()) or 1.0
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    top_score = hits[0]["_score"]
+    margin = (ranked[0][1] - runner_up) / total
+
+    intent = ranked[0][0] if top_score >= min_score else "unknown"
+    return {
+        "intent": intent,
+        "top_score": top_score,
+        "margin": margin,
+        "confident": intent in ["fibre", "mobile"] and margin >= min_margin
+    }
+
+# How often a confident vector vote let the chatbot skip the LLM clarification call
+gate_stats = {"turns": 0, "skipped": 0}
+gate_lock = threading.Lock()
+
+def record_gate(skipped):
+    with gate_lock:
+        gate_stats["turns"] += 1
+        gate_stats["skipped"] += int(skipped)
+        turns, skips = gate_stats["turns"], gate_stats["skipped"]
+    print(f"[INTENT GATE] LLM clarification skipped on {skips}/{turns} turns ({skips / turns:.0%})")
@@ -0,0 +1,449 @@
+import os
+import re
+import sys
+import copy
+import json
+import time
+import types
+import random
+import threading
+import asyncio
+import argparse
+import importlib
+import tempfile
+import statistics
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test for chatbot-ssa.py with OpenAI and OpenSearch replaced by stubs that
+# sleep for a configurable latency. Each round runs the same scripted
+# conversations with a different number of workers, so the table shows how
+# throughput, latency, errors and memory change as concurrency ramps up.
+#
+#   python loadtest.py --workers 1,2,4,8,16 --conversations 32
+#   python loadtest.py --mode async --workers 1,8,64 --conversations 128
+#   python loadtest.py --target gradio --workers 1,8,32 --conversations 64
+#
+# --target gradio launches the real ChatInterface (queue included) on a local
+# port and drives it over HTTP with one gradio_client per simulated shopper.
+
+# Salutation, fibre intent, profile answers and the final recommendation
+SCRIPTS = [
+    [
+        "hi",
+        "I'm looking for a fibre plan",
+        "new line, currently with Starhub",
+        "5-room",
+        "609601"
+    ],
+    [
+        "good morning",
+        "looking for broadband for my new flat",
+        "new line, I'm with M1",
+        "4-room",
+        "520123"
+    ]
+]
+GREETINGS = ["hi", "hello", "hey", "good morning"]
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_bulk(filename):
+    docs = []
+    with open(os.path.join(BASE_DIR, filename)) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            if "index" not in doc:
+                docs.append(doc)
+    return docs
+
+
+def quoted(text, label):
+    match = re.search(label + r' "(.*)"', text)
+    return match.group(1).lower() if match else ""
+
+
+def stub_reply(messages):
+    system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+    user = messages[-1]["content"]
+    if "salutation or casual greeting" in user:
+        return "yes" if quoted(user, "Message:").strip() in GREETINGS else "no"
+    if "unrelated to choosing" in user:
+        return "no"
+    if system.startswith("Only respond with"):
+        said = quoted(user, "The user said:")
+        return "fibre" if "fibre" in said or "broadband" in said else "unknown"
+    if system.startswith("Extract"):
+        said = quoted(user, "User said:")
+        fields = {}
+        if "fibre" in said or "broadband" in said:
+            fields["plan_type"] = "fibre"
+        if "new" in said:
+            fields["relationship_status"] = "new_line"
+        if "starhub" in said or "m1" in said:
+            fields["current_provider"] = "other"
+        if "room" in said:
+            fields["home_size"] = said.split()[0]
+        if said.isdigit():
+            fields["postal_code_prefix"] = said
+        return json.dumps(fields)
+    return "Shopper wants a fibre plan; see recommendation above."
+
+
+def completion(text):
+    usage = types.SimpleNamespace(prompt_tokens=60, completion_tokens=8, total_tokens=68)
+    message = types.SimpleNamespace(content=text)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+
+class StubOpenAI:
+    def __init__(self, latency):
+        self.latency = latency
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+        self.embeddings = types.SimpleNamespace(create=self.embed)
+
+    def create(self, model=None, messages=None, **kwargs):
+        time.sleep(self.latency)
+        return completion(stub_reply(messages))
+
+    def embed(self, model=None, input=None, **kwargs):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(data=[types.SimpleNamespace(embedding=[0.0] * 8) for _ in input])
+
+
+class StubResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class StubOpenSearch:
+    def __init__(self, latency):
+        self.latency = latency
+        self.indices = {
+            "clarifications-ssa": load_bulk("clarifications_ssa.json"),
+            "fibre-recommendation-ssa": load_bulk("fibre_recommendation_matrix_ssa.json"),
+            "fibre-offers-ssa": load_bulk("btl_offers.json")
+        }
+
+    def search(self, index_name, query):
+        if index_name == "clarifications-ssa":
+            terms = {}
+            for clause in query["query"]["bool"]["must"]:
+                terms.update(clause["term"])
+            docs = [
+                doc for doc in self.indices[index_name]
+                if all(doc["metadata"].get(key.split(".")[1]) == value for key, value in terms.items())
+            ][:query.get("size", 10)]
+            hits = [{"_score": 1.0, "_source": doc} for doc in docs]
+        elif index_name in self.indices:
+            hits = [{"_score": 1.0, "_source": doc} for doc in self.indices[index_name]]
+        else:
+            hits = [{"_score": 0.9, "_source": {"text": "fibre plans", "metadata": {"intent": "fibre"}}}]
+        return StubResponse({"hits": {"hits": hits}})
+
+    def get(self, url, json=None, **kwargs):
+        time.sleep(self.latency)
+        return self.search(url.rstrip("/").split("/")[-2], json or {})
+
+    def head(self, url, **kwargs):
+        return StubResponse({})
+
+
+def install_stubs(bot, llm_latency, search_latency):
+    import catalog
+    import guardrails
+    import async_clients
+    import rate_limiter
+
+    # Stubs sit behind the shared rate limiter like the real clients
+    llm = rate_limiter.wrap(StubOpenAI(llm_latency))
+    opensearch = StubOpenSearch(search_latency)
+    bot.client = llm
+    guardrails.client = llm
+    catalog.session = opensearch
+
+    async def complete(messages, model="gpt-3.5-turbo", priority=rate_limiter.NORMAL):
+        await rate_limiter.limiter.acquire_async(priority, rate_limiter.estimate_tokens(messages=messages))
+        async with async_clients.openai_slots:
+            await asyncio.sleep(llm_latency)
+            return completion(stub_reply(messages))
+
+    async def embed(texts, model="text-embedding-ada-002", priority=rate_limiter.NORMAL):
+        await rate_limiter.limiter.acquire_async(priority, rate_limiter.estimate_tokens(texts=texts))
+        async with async_clients.openai_slots:
+            await asyncio.sleep(llm_latency)
+            return [[0.0] * 8 for _ in texts]
+
+    async def search(index_name, query):
+        async with async_clients.opensearch_slots:
+            await asyncio.sleep(search_latency)
+            return opensearch.search(index_name, query)
+
+    async_clients.complete = complete
+    async_clients.embed = embed
+    async_clients.search = search
+
+
+class ConflictingStore:
+    """Wraps the session store so a share of check-ins lose to a simulated concurrent
+    writer: the check-in fails and the session is left as it was at checkout, so the
+    chatbot has to replay the turn (and gives up after SESSION_RETRIES)."""
+
+    def __init__(self, store, rate, seed=7):
+        self.store = store
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.checked_out = {}
+        self.conflicts = 0
+
+    def checkout(self, cache, session_id):
+        version = self.store.checkout(cache, session_id)
+        self.checked_out[session_id] = copy.deepcopy(cache.get(session_id))
+        return version
+
+    def checkin(self, cache, session_id, version):
+        with self.lock:
+            lost = self.rng.random() < self.rate
+            self.conflicts += lost
+        if not lost:
+            return self.store.checkin(cache, session_id, version)
+        state = self.checked_out.pop(session_id, None)
+        if state is None:
+            cache.pop(session_id, None)
+        else:
+            cache[session_id] = state
+        return False
+
+
+def load_chatbot():
+    sys.path.insert(0, BASE_DIR)
+    return importlib.import_module("chatbot-ssa")
+
+
+def reset_state(bot, rpm=0, tpm=0):
+    import catalog
+    import async_clients
+    import rate_limiter
+    import session_locks
+    bot.user_context.clear()
+    if isinstance(bot.sessions, ConflictingStore):
+        bot.sessions.conflicts = 0
+    with catalog.cache_lock:
+        catalog.cache.clear()
+    # asyncio primitives bind to the event loop they first wait on; each round runs a new loop
+    async_clients.openai_slots = asyncio.Semaphore(async_clients.OPENAI_CONCURRENCY)
+    async_clients.opensearch_slots = asyncio.Semaphore(async_clients.OPENSEARCH_CONCURRENCY)
+    session_locks.async_locks.clear()
+    # Unlimited unless a budget is given, so the table shows scaling rather than the limiter
+    rate_limiter.limiter = rate_limiter.RateLimiter(rpm, tpm, rate_limiter.OPENAI_BURST_SECONDS)
+
+
+def script_for(session_id):
+    return SCRIPTS[int(session_id.rsplit("-", 1)[1]) % len(SCRIPTS)]
+
+
+def failed_reply(bot, reply):
+    # The chatbot answers a turn it could not complete with its error reply rather than raising
+    if reply["content"] == bot.ERROR_REPLY:
+        raise RuntimeError("error reply")
+
+
+def run_conversation(bot, session_id):
+    request = types.SimpleNamespace(session_hash=session_id)
+    history = []
+    latencies, script = [], script_for(session_id)
+    for message in script:
+        started = time.perf_counter()
+        try:
+            reply = bot.chat(message, history, request)
+            failed_reply(bot, reply)
+        except Exception as e:
+            # A failed turn ends the conversation, as it would for a shopper; the
+            # turns it never got to send count as failed too
+            print(f"[LOADTEST] {session_id} failed on {message!r}: {e}", file=sys.stderr)
+            return latencies, len(script) - len(latencies)
+        latencies.append(time.perf_counter() - started)
+        history += [{"role": "user", "content": message}, reply]
+    return latencies, 0
+
+
+async def run_conversation_async(bot, session_id, slots):
+    request = types.SimpleNamespace(session_hash=session_id)
+    history = []
+    latencies, script = [], script_for(session_id)
+    async with slots:
+        for message in script:
+            started = time.perf_counter()
+            try:
+                reply = await bot.chat_async(message, history, request)
+                failed_reply(bot, reply)
+            except Exception as e:
+                print(f"[LOADTEST] {session_id} failed on {message!r}: {e}", file=sys.stderr)
+                return latencies, len(script) - len(latencies)
+            latencies.append(time.perf_counter() - started)
+            history += [{"role": "user", "content": message}, reply]
+    return latencies, 0
+
+
+def chat_endpoint(client):
+    # Gradio 4 names the ChatInterface endpoint /chat; later versions name it after the handler
+    endpoints = client.view_api(print_info=False, return_format="dict")["named_endpoints"]
+    return "/chat" if "/chat" in endpoints else next(name for name in endpoints if name.startswith("/chat"))
+
+
+def run_conversation_gradio(url, session_id):
+    from gradio_client import Client
+    script = script_for(session_id)
+    try:
+        # Each client is its own Gradio session, so the server sees one shopper per client
+        client = Client(url, verbose=False)
+        endpoint = chat_endpoint(client)
+    except Exception as e:
+        print(f"[LOADTEST] {session_id} could not connect: {e}", file=sys.stderr)
+        return [], len(script)
+    latencies = []
+    for message in script:
+        started = time.perf_counter()
+        try:
+            client.predict(message, api_name=endpoint)
+        except Exception as e:
+            print(f"[LOADTEST] {session_id} failed on {message!r}: {e}", file=sys.stderr)
+            return latencies, len(script) - len(latencies)
+        latencies.append(time.perf_counter() - started)
+    return latencies, 0
+
+
+def run_round(bot, mode, workers, conversations, label, url=None):
+    session_ids = [f"{label}-{i}" for i in range(conversations)]
+    started = time.perf_counter()
+    if url:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda sid: run_conversation_gradio(url, sid), session_ids))
+    elif mode == "async":
+        async def main():
+            slots = asyncio.Semaphore(workers)
+            return await asyncio.gather(*[run_conversation_async(bot, sid, slots) for sid in session_ids])
+        results = asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda sid: run_conversation(bot, sid), session_ids))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latencies, _ in results for latency in latencies]
+    return elapsed, latencies, sum(errors for _, errors in results)
+
+
+def rss_mb():
+    # Resident memory of this process: the chatbot, its caches and, for --target gradio, the server too
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def launch_gradio(bot, mode):
+    os.environ["SSA_ASYNC"] = "1" if mode == "async" else "0"
+    demo = bot.build_ui()
+    demo.launch(prevent_thread_lock=True, server_name="127.0.0.1", quiet=True,
+                max_threads=max(40, bot.SSA_CONCURRENCY))
+    return demo, demo.local_url
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of chatbot-ssa.py as workers increase")
+    parser.add_argument("--workers", default="1,2,4,8,16", help="comma-separated worker counts")
+    parser.add_argument("--conversations", type=int, default=32)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per stubbed OpenAI call")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="seconds per stubbed OpenSearch call")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--target", choices=["inprocess", "gradio"], default="inprocess",
+                        help="call chat() directly or drive the Gradio endpoint over HTTP")
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the chatbot's debug output")
+    parser.add_argument("--rpm", type=float, default=0, help="OpenAI requests per minute budget (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="OpenAI tokens per minute budget (0 = unlimited)")
+    parser.add_argument("--conflict-rate", type=float, default=0,
+                        help="share of session check-ins that lose to a simulated concurrent writer")
+    args = parser.parse_args()
+
+    import rate_limiter
+    bot = load_chatbot()
+    install_stubs(bot, args.llm_latency, args.search_latency)
+    if args.conflict_rate:
+        bot.sessions = ConflictingStore(bot.sessions, args.conflict_rate)
+    output_path = os.path.abspath(args.json) if args.json else None
+    # Keep interaction logs and handoff summaries out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="ssa-loadtest-"))
+
+    demo, url = launch_gradio(bot, args.mode) if args.target == "gradio" else (None, None)
+    if url:
+        print(f"[LOADTEST] Driving {url} ({args.mode} handler)")
+
+    rows = []
+    baseline_rss = rss_mb()
+    for workers in [int(w) for w in args.workers.split(",")]:
+        reset_state(bot, args.rpm, args.tpm)
+        output = sys.stdout if args.verbose else open(os.devnull, "w")
+        with contextlib.redirect_stdout(output):
+            elapsed, latencies, errors = run_round(bot, args.mode, workers, args.conversations, f"w{workers}", url)
+        attempted = len(latencies) + errors
+        conflicts = getattr(bot.sessions, "conflicts", 0)
+        print(f"[LOADTEST] {workers} workers: {len(latencies)} turns in {elapsed:.2f}s, {errors} errors"
+              + (f", {conflicts} check-in conflicts" if args.conflict_rate else ""))
+        limiter_stats = rate_limiter.limiter.stats()
+        if args.rpm or args.tpm:
+            print(f"[LOADTEST] rate limiter waits: {json.dumps(limiter_stats['waits'])}")
+        rows.append({
+            "workers": workers,
+            "conversations": args.conversations,
+            "turns": len(latencies),
+            "errors": errors,
+            "conflicts": conflicts,
+            "error_rate": round(errors / attempted, 4) if attempted else 0.0,
+            "seconds": round(elapsed, 3),
+            "turns_per_second": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+            "rss_mb": round(rss_mb(), 1),
+            "rss_growth_mb": round(rss_mb() - baseline_rss, 1),
+            "rate_limiter": limiter_stats["waits"]
+        })
+
+    if demo is not None:
+        demo.close()
+
+    baseline = rows[0]["turns_per_second"] or 1
+    print(f"\n{'workers':>8} {'turns':>6} {'errors':>7} {'seconds':>8} {'turns/s':>8} {'speedup':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rss MB':>8} {'+MB':>6}")
+    for row in rows:
+        row["speedup"] = round(row["turns_per_second"] / baseline, 2)
+        print(f"{row['workers']:>8} {row['turns']:>6} {row['error_rate']:>7.1%} {row['seconds']:>8} "
+              f"{row['turns_per_second']:>8} {row['speedup']:>8} {row['p50_ms']!s:>8} {row['p95_ms']!s:>8} "
+              f"{row['p99_ms']!s:>8} {row['rss_mb']:>8} {row['rss_growth_mb']:>6}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
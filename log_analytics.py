@@ -0,0 +1,240 @@
+import os
+import glob
+import time
+import json
+import zlib
+import struct
+import argparse
+import datetime
+import statistics
+from collections import Counter, defaultdict
+
+# Compaction and analytics for interaction logs.
+#
+#   python log_analytics.py rotate interaction_log_ssa.json   # close the live log into a segment
+#   python log_analytics.py compact                           # roll closed segments into .cols files
+#   python log_analytics.py turns | top-inputs | fallbacks | fill-rates
+#
+# A .cols file stores each column as its own dictionary-encoded, zlib-compressed
+# block behind a small header of offsets, so a query only reads and decompresses
+# the columns it uses.
+
+LOG_SEGMENT_DIR = os.getenv("LOG_SEGMENT_DIR", "log_segments")
+MAGIC = b"SSACOLS1"
+PROFILE_FIELDS = ["plan_type", "current_provider", "relationship_status", "home_size", "postal_code_prefix"]
+COLUMNS = ["timestamp", "session_id", "user_input", "assistant_reply"] + [f"profile.{f}" for f in PROFILE_FIELDS]
+# The "Thanks! Based on your responses" reply is left out: it is logged on every
+# recommendation turn, not only when the recommendation fails
+FALLBACK_REPLIES = {
+    "Sorry, something went wrong": "extraction_error",
+    "I'm here to assist with Singtel": "off_topic",
+    "Apologies, I'm here specifically": "off_topic",
+    "Are you looking for a broadband (fibre) plan or a mobile plan?": "intent_unclear",
+    "Got it. Are you referring to a broadband": "intent_unclear",
+    "Error:": "error"
+}
+
+
+def profile_value(profile, field):
+    value = profile.get(field)
+    if value is None and isinstance(profile.get("fibre"), dict):
+        value = profile["fibre"].get(field)
+    return value
+
+
+def read_segment(path):
+    rows = {name: [] for name in COLUMNS}
+    default_session = os.path.splitext(os.path.basename(path))[0]
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[WARN] Skipping malformed line in {path}")
+                continue
+            profile = entry.get("profile") or {}
+            rows["timestamp"].append(entry.get("timestamp"))
+            # Logs written before session ids were recorded held one conversation per file
+            rows["session_id"].append(entry.get("session_id") or default_session)
+            rows["user_input"].append(entry.get("user_input"))
+            rows["assistant_reply"].append(entry.get("assistant_reply"))
+            for field in PROFILE_FIELDS:
+                rows[f"profile.{field}"].append(profile_value(profile, field))
+    return rows
+
+
+def encode_column(values):
+    dictionary, codes, index = [], [], {}
+    for value in values:
+        # Keyed by JSON text: profile values and other columns can hold lists and dicts
+        key = json.dumps(value, sort_keys=True)
+        if key not in index:
+            index[key] = len(dictionary)
+            dictionary.append(value)
+        codes.append(index[key])
+    return zlib.compress(json.dumps({"dict": dictionary, "codes": codes}).encode("utf-8"))
+
+
+def decode_column(blob):
+    data = json.loads(zlib.decompress(blob))
+    dictionary = data["dict"]
+    return [dictionary[code] for code in data["codes"]]
+
+
+def write_cols(path, rows):
+    blobs = {name: encode_column(values) for name, values in rows.items()}
+    offsets, position = {}, 0
+    for name, blob in blobs.items():
+        offsets[name] = [position, len(blob)]
+        position += len(blob)
+    header = json.dumps({"rows": len(rows["timestamp"]), "columns": offsets}).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for blob in blobs.values():
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def read_cols(path, names):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compacted log segment")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+        data_start = len(MAGIC) + 4 + header_len
+        columns = {}
+        for name in names:
+            offset, length = header["columns"][name]
+            f.seek(data_start + offset)
+            columns[name] = decode_column(f.read(length))
+    return columns
+
+
+def scan(segment_dir, names):
+    merged = {name: [] for name in names}
+    for path in sorted(glob.glob(os.path.join(segment_dir, "*.cols"))):
+        columns = read_cols(path, names)
+        for name in names:
+            merged[name].extend(columns[name])
+    return merged
+
+
+def rotate(log_path, segment_dir):
+    if not os.path.exists(log_path) or os.path.getsize(log_path) == 0:
+        print(f"[DEBUG] Nothing to rotate in {log_path}")
+        return None
+    os.makedirs(segment_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(log_path))[0]
+    # Microsecond names keep segments in time order; never reuse one, raw or compacted
+    while True:
+        stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        segment = os.path.join(segment_dir, f"{stem}-{stamp}.jsonl")
+        if not os.path.exists(segment) and not os.path.exists(os.path.splitext(segment)[0] + ".cols"):
+            break
+        time.sleep(0.001)
+    # Writers open the log per append, so the next entry starts a fresh file
+    os.replace(log_path, segment)
+    print(f"[DEBUG] Rotated {log_path} -> {segment}")
+    return segment
+
+
+def compact(segment_dir, keep=False):
+    for segment in sorted(glob.glob(os.path.join(segment_dir, "*.jsonl"))):
+        target = os.path.splitext(segment)[0] + ".cols"
+        if os.path.exists(target):
+            continue
+        rows = read_segment(segment)
+        write_cols(target, rows)
+        before, after = os.path.getsize(segment), os.path.getsize(target)
+        print(f"[DEBUG] Compacted {segment}: {len(rows['timestamp'])} rows, {before} -> {after} bytes")
+        if not keep:
+            os.remove(segment)
+
+
+def fallback_kind(reply):
+    for prefix, kind in FALLBACK_REPLIES.items():
+        if reply and reply.startswith(prefix):
+            return kind
+    return None
+
+
+def report_turns(segment_dir):
+    columns = scan(segment_dir, ["session_id"])
+    turns = sorted(Counter(columns["session_id"]).values())
+    if not turns:
+        print("No conversations found.")
+        return
+    print(f"Conversations: {len(turns)}")
+    print(f"Turns: total={sum(turns)} mean={statistics.mean(turns):.2f} median={statistics.median(turns)} "
+          f"p90={turns[min(len(turns) - 1, int(len(turns) * 0.9))]} max={turns[-1]}")
+
+
+def report_top_inputs(segment_dir, limit):
+    columns = scan(segment_dir, ["user_input"])
+    counts = Counter((value or "").strip().lower() for value in columns["user_input"])
+    for value, count in counts.most_common(limit):
+        print(f"{count:>8}  {value}")
+
+
+def report_fallbacks(segment_dir):
+    columns = scan(segment_dir, ["assistant_reply"])
+    replies = columns["assistant_reply"]
+    counts = Counter(kind for kind in map(fallback_kind, replies) if kind)
+    total = len(replies) or 1
+    print(f"Fallback replies: {sum(counts.values())} of {len(replies)} turns ({sum(counts.values()) / total:.1%})")
+    for kind, count in counts.most_common():
+        print(f"{count:>8}  {count / total:>6.1%}  {kind}")
+
+
+def report_fill_rates(segment_dir):
+    names = ["session_id", "timestamp"] + [f"profile.{f}" for f in PROFILE_FIELDS]
+    columns = scan(segment_dir, names)
+    # Fill rate of each field in the last logged profile of every conversation
+    last = defaultdict(lambda: (None, None))
+    for i, session_id in enumerate(columns["session_id"]):
+        timestamp = columns["timestamp"][i] or ""
+        if last[session_id][0] is None or timestamp >= last[session_id][0]:
+            last[session_id] = (timestamp, i)
+    conversations = len(last) or 1
+    print(f"Conversations: {len(last)}")
+    for field in PROFILE_FIELDS:
+        values = columns[f"profile.{field}"]
+        filled = sum(1 for _, i in last.values() if values[i])
+        print(f"{field:>22}  {filled / conversations:>6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact and query interaction logs")
+    parser.add_argument("--segments", default=LOG_SEGMENT_DIR, help="directory of log segments")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rotate", help="close a live log into a segment").add_argument("log_path")
+    commands.add_parser("compact", help="roll closed segments into columnar files").add_argument(
+        "--keep", action="store_true", help="keep the source .jsonl segments")
+    commands.add_parser("turns", help="turns per conversation")
+    commands.add_parser("top-inputs", help="most common user inputs").add_argument("--limit", type=int, default=20)
+    commands.add_parser("fallbacks", help="distribution of fallback replies")
+    commands.add_parser("fill-rates", help="profile field fill rates per conversation")
+    args = parser.parse_args()
+
+    if args.command == "rotate":
+        rotate(args.log_path, args.segments)
+    elif args.command == "compact":
+        compact(args.segments, args.keep)
+    elif args.command == "turns":
+        report_turns(args.segments)
+    elif args.command == "top-inputs":
+        report_top_inputs(args.segments, args.limit)
+    elif args.command == "fallbacks":
+        report_fallbacks(args.segments)
+    else:
+        report_fill_rates(args.segments)
+
+
+if __name__ == "__main__":
+    main()
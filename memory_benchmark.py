@@ -0,0 +1,150 @@
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import records
+
+# Per-record memory of the catalog and session representations.
+#
+#   python memory_benchmark.py                   # 100k offers, matrix rows and sessions
+#   python memory_benchmark.py --count 20000 --json memory_benchmark.json
+#
+# Synthetic records are cloned from btl_offers.json and
+# fibre_recommendation_matrix_ssa.json with unique IDs, then parsed from JSON
+# lines the way a worker loads them, so every dict owns fresh strings. Each
+# representation is built on its own under tracemalloc and reported as retained
+# bytes per record, including the interned strings and shared tuples it adds.
+
+
+def load_bulk(path):
+    with open(path) as f:
+        return [doc for doc in (json.loads(line) for line in f if line.strip()) if "index" not in doc]
+
+
+def offer_lines(count, seed):
+    templates = load_bulk("btl_offers.json")
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        doc = dict(templates[i % len(templates)], offerId=f"b{i}")
+        doc["Monthly price"] = round(doc["Monthly price"] + rng.choice([0, 5, 10, 15]), 2)
+        lines.append(json.dumps(doc))
+    return lines
+
+
+def matrix_lines(count, seed):
+    templates = load_bulk("fibre_recommendation_matrix_ssa.json")
+    rng = random.Random(seed)
+    return [
+        json.dumps(dict(templates[i % len(templates)], offerId=f"b{i}",
+                        postal_code_prefix=f"{rng.randrange(100000, 830000)}", rank=i))
+        for i in range(count)
+    ]
+
+
+def session_lines(count, seed):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(json.dumps({
+            "primary": rng.choice(["fibre", "mobile"]),
+            "step": rng.randrange(4),
+            "asked": ["are you looking for a broadband (fibre) plan or a mobile plan",
+                      "what's the size of your home or number of rooms"],
+            "answers": ["hi", "I want fibre", "5-room"],
+            "profile": {"plan_type": "fibre", "fibre": {"home_size": "5-room"}},
+            "determined_offer": f"b{i % 12}"
+        }))
+    return lines
+
+
+def offer_dict(raw):
+    # The per-offer dict catalog.normalize_offer used to build, numbered fields read as Offer.from_source does
+    numbered = {"Add on": [], "Perks": []}
+    for key, value in raw.items():
+        match = records.NUMBERED.match(key)
+        if match and value:
+            numbered[match.group(1)].append((int(match.group(2)), value))
+    addons = [value for _, value in sorted(numbered["Add on"])]
+    perks = [value for _, value in sorted(numbered["Perks"])]
+    return {
+        "offerId": raw["offerId"], "plan_name": raw.get("Plan Name"), "product_type": raw.get("Product Type"),
+        "monthly_price": raw.get("Monthly price"), "contract": raw.get("Contract policy"),
+        "transaction_type": raw.get("Transaction type"), "bandwidth": raw.get("Bandwidth"),
+        "router": raw.get("Router"), "segment": raw.get("Segment"), "addons": addons, "perks": perks
+    }
+
+
+def session_dict(state):
+    state["asked"] = set(state["asked"])
+    return state
+
+
+def session_record(state):
+    context = records.SessionContext.from_dict(state)
+    context["asked"] = set(context["asked"])
+    return context
+
+
+def measure(lines, convert):
+    gc.collect()
+    records.shared_tuples.clear()
+    tracemalloc.start()
+    started = time.perf_counter()
+    built = [convert(json.loads(line)) for line in lines]
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del built
+    return retained, elapsed
+
+
+REPRESENTATIONS = [
+    ("offer", offer_lines, [("raw dict", lambda raw: raw), ("dict", offer_dict),
+                            ("record", records.Offer.from_source)]),
+    ("matrix row", matrix_lines, [("dict", lambda raw: raw), ("record", records.MatrixRow.from_source)]),
+    ("session", session_lines, [("dict", session_dict), ("record", session_record)])
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per offer, matrix row and session: dicts vs records")
+    parser.add_argument("--count", type=int, default=100000, help="records of each kind")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    rows = []
+    for kind, make_lines, representations in REPRESENTATIONS:
+        lines = make_lines(args.count, args.seed)
+        measured = {name: measure(lines, convert) for name, convert in representations}
+        baseline = measured["dict"][0] / args.count
+        for name, (retained, elapsed) in measured.items():
+            per_record = retained / args.count
+            rows.append({
+                "kind": kind,
+                "representation": name,
+                "count": args.count,
+                "total_mb": round(retained / 1024 / 1024, 1),
+                "bytes_per_record": round(per_record),
+                "vs_dict": round(per_record / baseline, 2),
+                "build_s": round(elapsed, 2)
+            })
+        print(f"[DEBUG] Measured {args.count} {kind}s")
+
+    columns = ["kind", "representation", "count", "total_mb", "bytes_per_record", "vs_dict", "build_s"]
+    widths = {c: max(len(c), *(len(str(row[c])) for row in rows)) for c in columns}
+    print("\n" + " ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print(" ".join(str(row[c]).rjust(widths[c]) for c in columns))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
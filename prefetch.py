@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+
+executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+# session_id -> {task name: Future} for results a later turn reads back. Entries go
+# when read, when the recommendation is sent and when the session expires.
+pending = {}
+pending_lock = threading.Lock()
+
+
+def schedule(session_id, name, fn, *args):
+    with pending_lock:
+        tasks = pending.setdefault(session_id, {})
+        previous = tasks.get(name)
+        if previous:
+            previous.cancel()
+        tasks[name] = executor.submit(fn, *args)
+    print(f"[PREFETCH] Scheduled {name} for {session_id}")
+
+
+def warm(name, fn, *args):
+    # Fire-and-forget: the task only fills a cache, so nothing is kept to read it back
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[PREFETCH] Warming {name} failed: {e}")
+    executor.submit(run)
+
+
+def result(session_id, name, timeout=None):
+    with pending_lock:
+        tasks = pending.get(session_id, {})
+        future = tasks.pop(name, None)
+        if not tasks:
+            pending.pop(session_id, None)
+    if future is None or future.cancelled():
+        return None
+    try:
+        value = future.result(timeout=timeout)
+        print(f"[PREFETCH] Using prefetched {name} for {session_id}")
+        return value
+    except Exception as e:
+        print(f"[PREFETCH] {name} for {session_id} unavailable: {e}")
+        return None
+
+
+def cancel(session_id):
+    with pending_lock:
+        tasks = pending.pop(session_id, {})
+    for name, future in tasks.items():
+        if future.cancel():
+            print(f"[PREFETCH] Cancelled {name} for {session_id}")
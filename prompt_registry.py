@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from string import Template
+from collections import namedtuple
+from dotenv import load_dotenv
+
+# Prompt templates from prompts.json, compiled on first use and, once a chatbot
+# calls serve(), swapped in whole when the file changes on disk. A template is a string or a list of lines with
+# $placeholders; its version is a hash of the text, so caches keyed on
+# (name, version) miss as soon as a prompt is edited.
+
+load_dotenv()
+PROMPTS_FILE = os.getenv("PROMPTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.json"))
+PROMPTS_RELOAD_INTERVAL = float(os.getenv("PROMPTS_RELOAD_INTERVAL", "2"))
+
+Prompt = namedtuple("Prompt", ["name", "version", "template"])
+
+prompts = {}
+loaded_mtime = None
+failed_mtime = None
+reload_lock = threading.Lock()
+watcher = None
+
+
+def compile_prompts(raw):
+    compiled = {}
+    for name, text in raw.items():
+        if isinstance(text, list):
+            text = "\n".join(text)
+        template = Template(text)
+        if not template.is_valid():
+            raise ValueError(f"Prompt {name!r} has an invalid placeholder")
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        compiled[name] = Prompt(name, version, template)
+    return compiled
+
+
+def load(path=None):
+    global prompts, loaded_mtime
+    path = path or PROMPTS_FILE
+    with reload_lock:
+        mtime = os.stat(path).st_mtime_ns
+        with open(path) as f:
+            compiled = compile_prompts(json.load(f))
+        dropped = set(prompts) - set(compiled)
+        if dropped:
+            raise ValueError(f"Prompts still in use are missing: {sorted(dropped)}")
+        # One reference swap: a request sees either the old set or the new one
+        prompts, loaded_mtime = compiled, mtime
+    print(f"[PROMPTS] Loaded {len(compiled)} prompts from {path}")
+    return compiled
+
+
+def reload_if_changed(path=None):
+    global failed_mtime
+    path = path or PROMPTS_FILE
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as e:
+        print(f"[ERROR] Cannot stat prompts file {path}: {e}")
+        return False
+    if mtime in (loaded_mtime, failed_mtime):
+        return False
+    try:
+        load(path)
+        return True
+    except Exception as e:
+        # Keep serving the last good prompts while the file is mid-edit or broken
+        failed_mtime = mtime
+        print(f"[ERROR] Failed to reload prompts from {path}: {e}")
+        return False
+
+
+def watch():
+    while True:
+        time.sleep(PROMPTS_RELOAD_INTERVAL)
+        reload_if_changed()
+
+
+def start_watcher():
+    global watcher
+    if PROMPTS_RELOAD_INTERVAL <= 0:
+        return
+    with reload_lock:
+        if watcher is None:
+            watcher = threading.Thread(target=watch, name="prompt-reload", daemon=True)
+            watcher.start()
+
+
+def serve():
+    # Called from the chatbots' startup, not at import: tools that only render a
+    # prompt load the file on first use and never poll it
+    load()
+    start_watcher()
+
+
+def loaded():
+    if loaded_mtime is None:
+        load()
+    return prompts
+
+
+def get(name):
+    return loaded()[name]
+
+
+def version(name):
+    return loaded()[name].version
+
+
+def render(name, **values):
+    return loaded()[name].template.substitute(values)
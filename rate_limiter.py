@@ -0,0 +1,229 @@
+import os
+import time
+import types
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+# Process-wide budget for OpenAI calls. Every call waits for a request slot and
+# an estimate of its tokens from two token buckets; when the buckets run dry the
+# waiters are served in priority order, so the turn a shopper is waiting on goes
+# ahead of summaries and other background work. A 429 from the provider empties
+# the buckets so every caller backs off together instead of retrying into it.
+
+load_dotenv()
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "2000000"))
+OPENAI_BURST_SECONDS = float(os.getenv("OPENAI_BURST_SECONDS", "2"))
+COMPLETION_TOKEN_ESTIMATE = 256
+
+CRITICAL, NORMAL, DEFERRABLE = 0, 1, 2
+PRIORITY_NAMES = {CRITICAL: "critical", NORMAL: "normal", DEFERRABLE: "deferrable"}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds):
+        self.configure(per_minute, burst_seconds)
+
+    def configure(self, per_minute, burst_seconds):
+        self.rate = per_minute / 60
+        # Unlimited when the budget is zero; otherwise hold a few seconds of budget for bursts
+        self.capacity = max(1.0, self.rate * burst_seconds) if per_minute > 0 else float("inf")
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def cost(self, amount):
+        # A single call larger than the bucket would never fit; let it through on a full bucket
+        return min(amount, self.capacity)
+
+    def wait_time(self, amount):
+        shortfall = self.cost(amount) - self.level
+        return 0.0 if shortfall <= 0 else shortfall / self.rate
+
+
+class RateLimiter:
+    def __init__(self, rpm, tpm, burst_seconds):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.order = itertools.count()
+        self.waits = {p: deque(maxlen=1000) for p in PRIORITY_NAMES}
+        self.served = {p: 0 for p in PRIORITY_NAMES}
+        self.throttled = 0
+
+    def configure(self, rpm, tpm, burst_seconds=OPENAI_BURST_SECONDS):
+        with self.condition:
+            self.requests.configure(rpm, burst_seconds)
+            self.tokens.configure(tpm, burst_seconds)
+            self.condition.notify_all()
+
+    def try_take(self, ticket, tokens):
+        # Caller holds the condition. Only the highest-priority waiter may take budget.
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if self.waiting[0] is not ticket:
+            return None
+        delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if delay > 0:
+            return delay
+        self.requests.level -= self.requests.cost(1)
+        self.tokens.level -= self.tokens.cost(tokens)
+        heapq.heappop(self.waiting)
+        self.condition.notify_all()
+        return 0.0
+
+    def enqueue(self, priority):
+        ticket = [priority, next(self.order)]
+        heapq.heappush(self.waiting, ticket)
+        return ticket
+
+    def withdraw(self, ticket):
+        # A waiter that gives up (cancelled task, interrupt) must not block the queue
+        with self.condition:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def record(self, priority, started):
+        waited = time.monotonic() - started
+        self.waits[priority].append(waited)
+        self.served[priority] += 1
+        if waited > 0.5:
+            print(f"[RATE] {PRIORITY_NAMES[priority]} call waited {waited:.2f}s "
+                  f"(queue depth {len(self.waiting)})")
+
+    def acquire(self, priority=NORMAL, tokens=COMPLETION_TOKEN_ESTIMATE):
+        started = time.monotonic()
+        with self.condition:
+            ticket = self.enqueue(priority)
+            try:
+                while True:
+                    delay = self.try_take(ticket, tokens)
+                    if delay == 0.0:
+                        break
+                    self.condition.wait(timeout=delay)
+            except BaseException:
+                self.withdraw(ticket)
+                raise
+            self.record(priority, started)
+
+    async def acquire_async(self, priority=NORMAL, tokens=COMPLETION_TOKEN_ESTIMATE):
+        started = time.monotonic()
+        with self.condition:
+            ticket = self.enqueue(priority)
+        try:
+            while True:
+                with self.condition:
+                    delay = self.try_take(ticket, tokens)
+                    if delay == 0.0:
+                        self.record(priority, started)
+                        return
+                # The lock is only held for bookkeeping, never across an await
+                await asyncio.sleep(min(delay or 0.01, 0.05))
+        except BaseException:
+            self.withdraw(ticket)
+            raise
+
+    def settle(self, estimated, actual):
+        # Correct the token bucket once the response reports what the call really used
+        if actual is None:
+            return
+        with self.condition:
+            self.tokens.level -= actual - estimated
+
+    def throttle(self):
+        with self.condition:
+            self.throttled += 1
+            for bucket in (self.requests, self.tokens):
+                if bucket.rate:
+                    bucket.level = 0.0
+
+    def stats(self):
+        with self.condition:
+            depth = {PRIORITY_NAMES[p]: 0 for p in PRIORITY_NAMES}
+            for priority, _ in self.waiting:
+                depth[PRIORITY_NAMES[priority]] += 1
+            waits = {}
+            for priority, samples in self.waits.items():
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES[priority]] = {
+                    "served": self.served[priority],
+                    "mean_ms": round(1000 * sum(ordered) / len(ordered), 1) if ordered else 0.0,
+                    "p95_ms": round(1000 * ordered[int(len(ordered) * 0.95)], 1) if ordered else 0.0
+                }
+            return {"queue_depth": depth, "waits": waits, "throttled": self.throttled}
+
+
+limiter = RateLimiter(OPENAI_RPM, OPENAI_TPM, OPENAI_BURST_SECONDS)
+
+
+def estimate_tokens(messages=None, texts=None):
+    # Roughly four characters per token, plus room for the completion
+    if texts is not None:
+        return sum(len(text) for text in texts) // 4 + 1
+    return sum(len(m.get("content") or "") for m in messages) // 4 + COMPLETION_TOKEN_ESTIMATE
+
+
+def usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+def is_rate_limit(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+class LimitedCompletions:
+    def __init__(self, completions):
+        self.completions = completions
+
+    def create(self, priority=NORMAL, **kwargs):
+        estimated = estimate_tokens(messages=kwargs.get("messages", []))
+        limiter.acquire(priority, estimated)
+        try:
+            response = self.completions.create(**kwargs)
+        except Exception as e:
+            if is_rate_limit(e):
+                limiter.throttle()
+            raise
+        limiter.settle(estimated, usage_tokens(response))
+        return response
+
+
+class LimitedEmbeddings:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def create(self, priority=NORMAL, **kwargs):
+        texts = kwargs.get("input", [])
+        limiter.acquire(priority, estimate_tokens(texts=[texts] if isinstance(texts, str) else texts))
+        try:
+            return self.embeddings.create(**kwargs)
+        except Exception as e:
+            if is_rate_limit(e):
+                limiter.throttle()
+            raise
+
+
+class LimitedClient:
+    """OpenAI client whose chat.completions.create and embeddings.create take a priority."""
+
+    def __init__(self, client):
+        self.client = client
+        self.chat = types.SimpleNamespace(completions=LimitedCompletions(client.chat.completions))
+        self.embeddings = LimitedEmbeddings(client.embeddings)
+
+
+def wrap(client):
+    return LimitedClient(client)
@@ -0,0 +1,183 @@
+import re
+import sys
+import threading
+
+# Compact records for the catalog and conversation state. Every worker holds
+# the whole offer catalog and matrix, so these use __slots__ instead of a dict
+# per record, and intern the categorical values (transaction type, bandwidth,
+# segment, add-ons, ...) so thousands of offers share one copy of each string
+# and each add-on list. Records read like the dicts they replace (record["key"],
+# record.get(key), dict(record)), so matching and rendering code is unchanged.
+#
+# memory_benchmark.py compares their footprint against the dict representation.
+
+NUMBERED = re.compile(r"^(Add on|Perks) (\d+)$")
+
+# values -> [shared tuple, number of live records holding it]
+shared_tuples = {}
+shared_lock = threading.RLock()
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_tuple(values):
+    # Offers repeat the same add-on and perk lists; identical lists share one tuple
+    values = tuple(intern_value(v) for v in values)
+    with shared_lock:
+        entry = shared_tuples.get(values)
+        if entry is None:
+            entry = shared_tuples[values] = [values, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_tuple(values):
+    # Called as a record holding the tuple is freed; the last holder drops it from
+    # the table, so lists from a replaced catalog do not pile up
+    with shared_lock:
+        entry = shared_tuples.get(values)
+        if entry is None or entry[0] is not values:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del shared_tuples[values]
+
+
+class Record:
+    """Read-only mapping view over a record's slots; unset slots read as missing keys."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class Offer(Record):
+    __slots__ = ("offerId", "plan_name", "product_type", "monthly_price", "contract", "transaction_type",
+                 "bandwidth", "router", "segment", "addons", "perks")
+
+    def __init__(self, offerId, plan_name=None, product_type=None, monthly_price=None, contract=None,
+                 transaction_type=None, bandwidth=None, router=None, segment=None, addons=(), perks=()):
+        self.offerId = offerId
+        self.plan_name = intern_value(plan_name)
+        self.product_type = intern_value(product_type)
+        self.monthly_price = monthly_price
+        self.contract = intern_value(contract)
+        self.transaction_type = intern_value(transaction_type)
+        self.bandwidth = intern_value(bandwidth)
+        self.router = intern_value(router)
+        self.segment = intern_value(segment)
+        self.addons = intern_tuple(addons)
+        self.perks = intern_tuple(perks)
+
+    def __del__(self):
+        for values in (getattr(self, "addons", None), getattr(self, "perks", None)):
+            if values is not None:
+                release_tuple(values)
+
+    def __reduce__(self):
+        # Copies and unpickled offers go through __init__, so they count the tuples they release
+        return type(self), tuple(getattr(self, key) for key in self.__slots__)
+
+    @classmethod
+    def from_source(cls, raw):
+        # "Add on 1".."Add on N" / "Perks 1".."Perks N" -> ordered tuples
+        numbered = {"Add on": [], "Perks": []}
+        for key, value in raw.items():
+            match = NUMBERED.match(key)
+            if match and value:
+                numbered[match.group(1)].append((int(match.group(2)), value))
+        return cls(
+            raw["offerId"],
+            plan_name=raw.get("Plan Name"),
+            product_type=raw.get("Product Type"),
+            monthly_price=raw.get("Monthly price"),
+            contract=raw.get("Contract policy"),
+            transaction_type=raw.get("Transaction type"),
+            bandwidth=raw.get("Bandwidth"),
+            router=raw.get("Router"),
+            segment=raw.get("Segment"),
+            addons=[value for _, value in sorted(numbered["Add on"])],
+            perks=[value for _, value in sorted(numbered["Perks"])]
+        )
+
+
+class MatrixRow(Record):
+    __slots__ = ("offerId", "intent", "relationship_status", "home_size", "postal_code_prefix", "plan_name",
+                 "highlight", "link", "rank")
+
+    def __init__(self, offerId, intent=None, relationship_status=None, home_size=None, postal_code_prefix=None,
+                 plan_name=None, highlight=None, link=None, rank=None):
+        self.offerId = offerId
+        self.intent = intern_value(intent)
+        self.relationship_status = intern_value(relationship_status)
+        self.home_size = intern_value(home_size)
+        self.postal_code_prefix = intern_value(postal_code_prefix)
+        self.plan_name = intern_value(plan_name)
+        self.highlight = highlight
+        self.link = intern_value(link)
+        self.rank = rank
+
+    @classmethod
+    def from_source(cls, raw):
+        return cls(**{key: raw.get(key) for key in cls.__slots__})
+
+
+class SessionContext(Record):
+    """One shopper's conversation state; keys that were never set read as missing."""
+
+    __slots__ = ("primary", "step", "asked", "answers", "profile", "determined_offer", "matched_offer")
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(f"Unknown session field {key!r}")
+        setattr(self, key, intern_value(value) if key == "primary" else value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            delattr(self, key)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    @classmethod
+    def from_dict(cls, state):
+        # Records written by older versions may carry fields this one no longer keeps
+        return cls(**{key: value for key, value in state.items() if key in cls.__slots__})
@@ -0,0 +1,77 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+import prompt_registry
+import rate_limiter
+from dotenv import load_dotenv
+
+# Running conversation summaries folded in the background after every exchange,
+# so the final turn sends a size-bounded prompt however long the shopper chatted.
+
+load_dotenv()
+ROLLING_SUMMARY = os.getenv("ROLLING_SUMMARY") == "1"
+ROLLING_SUMMARY_MAX_CHARS = int(os.getenv("ROLLING_SUMMARY_MAX_CHARS", "1200"))
+ROLLING_SUMMARY_TIMEOUT = float(os.getenv("ROLLING_SUMMARY_TIMEOUT", "5"))
+MAX_EXCHANGE_CHARS = 500
+
+client = rate_limiter.wrap(OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("ROLLING_SUMMARY_WORKERS", "4")),
+                              thread_name_prefix="summary")
+
+# session_id -> Future of the latest summary; each fold waits for the previous one
+summaries = {}
+summaries_lock = threading.Lock()
+
+
+def bounded(text, limit):
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def fold(previous, user_message, assistant_reply):
+    prompt = prompt_registry.render("rolling_summary", summary=previous or "(empty)",
+                                    customer=bounded(user_message, MAX_EXCHANGE_CHARS),
+                                    assistant=bounded(assistant_reply, MAX_EXCHANGE_CHARS),
+                                    words=ROLLING_SUMMARY_MAX_CHARS // 6)
+    try:
+        response = client.chat.completions.create(
+            priority=rate_limiter.DEFERRABLE,
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": prompt_registry.render("rolling_summary_system")},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return bounded(response.choices[0].message.content, ROLLING_SUMMARY_MAX_CHARS)
+    except Exception as e:
+        print(f"[ERROR] Failed to fold conversation summary: {e}")
+        return previous
+
+
+def fold_after(previous_future, user_message, assistant_reply):
+    previous = previous_future.result() if previous_future else ""
+    return fold(previous, user_message, assistant_reply)
+
+
+def update(session_id, user_message, assistant_reply):
+    with summaries_lock:
+        previous = summaries.get(session_id)
+        summaries[session_id] = executor.submit(fold_after, previous, user_message, assistant_reply)
+
+
+def current(session_id):
+    with summaries_lock:
+        future = summaries.get(session_id)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=ROLLING_SUMMARY_TIMEOUT)
+    except Exception as e:
+        print(f"[ERROR] Rolling summary unavailable for {session_id}: {e}")
+        return None
+
+
+def reset(session_id):
+    with summaries_lock:
+        summaries.pop(session_id, None)
@@ -0,0 +1,20 @@
+import os
+import json
+import threading
+
+# One lock per output file so concurrent sessions never interleave partial lines
+file_locks = {}
+file_locks_lock = threading.Lock()
+
+
+def lock_for(path):
+    with file_locks_lock:
+        return file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def append_jsonl(path, entry):
+    line = json.dumps(entry) + "\n"
+    with lock_for(path):
+        with open(path, "a") as f:
+            f.write(line)
+            f.flush()
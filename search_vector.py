@@ -1,7 +1,13 @@
 
 import os
+import sys
+import csv
 import json
+import time
+import argparse
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -19,6 +25,10 @@ if not all([OPENAI_API_KEY, OPENSEARCH_HOST, OPENSEARCH_USER, OPENSEARCH_PASS]):
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Pooled connection so batch mode's concurrent searches reuse keep-alive sockets
+session = requests.Session()
+session.auth = (OPENSEARCH_USER, OPENSEARCH_PASS)
+
 def embed_text(text):
     response = client.embeddings.create(
         model="text-embedding-ada-002",
@@ -26,11 +36,22 @@ def embed_text(text):
     )
     return response.data[0].embedding
 
-def search_similar(query_text, top_k=3):
-    query_vector = embed_text(query_text)
+# Hybrid retrieval: BM25 on the `text` field and kNN on `embedding`, sent together
+# through _msearch and fused after min-max normalising each list. Short keyword
+# messages run BM25 while the query is embedded and skip the kNN search when
+# BM25 is decisive.
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+LEXICAL_MAX_TERMS = int(os.getenv("LEXICAL_MAX_TERMS", "3"))
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "2.0"))
+LEXICAL_MIN_RATIO = float(os.getenv("LEXICAL_MIN_RATIO", "1.5"))
+
+# Embeds a short hybrid query while its BM25 search is in flight
+embedder = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed")
 
-    query = {
+def knn_query(query_vector, top_k):
+    return {
         "size": top_k,
+        "_source": {"excludes": ["embedding"]},
         "query": {
             "knn": {
                 "embedding": {
@@ -41,9 +62,16 @@ def search_similar(query_text, top_k=3):
         }
     }
 
-    response = requests.get(
+def lexical_query(query_text, top_k):
+    return {
+        "size": top_k,
+        "_source": {"excludes": ["embedding"]},
+        "query": {"match": {"text": query_text}}
+    }
+
+def run_search(query):
+    response = session.get(
         f"{OPENSEARCH_HOST}/{INDEX_NAME}/_search",
-        auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
         headers={"Content-Type": "application/json"},
         json=query
     )
@@ -51,24 +79,202 @@ def search_similar(query_text, top_k=3):
     if response.status_code != 200:
         print("[ERROR]", response.status_code, response.text)
         return []
+    return response.json()["hits"]["hits"]
 
-    hits = response.json()["hits"]["hits"]
-    results = [
-        {
-            "score": hit["_score"],
-            "text": hit["_source"]["text"],
-            "intent": hit["_source"]["metadata"].get("intent"),
-            "emotion": hit["_source"]["metadata"].get("emotion"),
-            "response_prompt": hit["_source"]["metadata"].get("response_prompt")
-        }
-        for hit in hits
-    ]
+def run_msearch(queries):
+    body = "".join(json.dumps({}) + "\n" + json.dumps(query) + "\n" for query in queries)
+    response = session.get(
+        f"{OPENSEARCH_HOST}/{INDEX_NAME}/_msearch",
+        headers={"Content-Type": "application/x-ndjson"},
+        data=body
+    )
+
+    if response.status_code != 200:
+        print("[ERROR]", response.status_code, response.text)
+        return [[] for _ in queries]
+    hit_lists = []
+    for item in response.json()["responses"]:
+        if "error" in item:
+            print("[ERROR]", item["error"])
+            hit_lists.append([])
+        else:
+            hit_lists.append(item["hits"]["hits"])
+    return hit_lists
+
+def to_result(hit, score):
+    return {
+        "score": score,
+        "text": hit["_source"]["text"],
+        "intent": hit["_source"]["metadata"].get("intent"),
+        "emotion": hit["_source"]["metadata"].get("emotion"),
+        "response_prompt": hit["_source"]["metadata"].get("response_prompt")
+    }
+
+def is_decisive(hits):
+    # The best BM25 hit must score well and clearly beat the best hit for any other intent
+    if not hits or hits[0]["_score"] < LEXICAL_MIN_SCORE:
+        return False
+    top_intent = hits[0]["_source"]["metadata"].get("intent")
+    rivals = [hit["_score"] for hit in hits if hit["_source"]["metadata"].get("intent") != top_intent]
+    return not rivals or hits[0]["_score"] >= LEXICAL_MIN_RATIO * rivals[0]
+
+def normalized(hits):
+    if not hits:
+        return {}
+    scores = [hit["_score"] for hit in hits]
+    low, high = min(scores), max(scores)
+    span = (high - low) or 1.0
+    return {hit["_id"]: (hit["_score"] - low) / span if high > low else 1.0 for hit in hits}
+
+def fuse(lexical_hits, knn_hits, top_k, lexical_weight=HYBRID_LEXICAL_WEIGHT):
+    lexical_scores, knn_scores = normalized(lexical_hits), normalized(knn_hits)
+    docs = {hit["_id"]: hit for hit in lexical_hits + knn_hits}
+    fused = {
+        doc_id: lexical_weight * lexical_scores.get(doc_id, 0.0) + (1 - lexical_weight) * knn_scores.get(doc_id, 0.0)
+        for doc_id in docs
+    }
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [to_result(docs[doc_id], score) for doc_id, score in ranked]
+
+def search_similar(query_text, top_k=3, mode="knn"):
+    if mode == "lexical":
+        return [to_result(hit, hit["_score"]) for hit in run_search(lexical_query(query_text, top_k))]
+
+    if mode == "hybrid":
+        # Fetch a few more from each side so the fusion has overlap to work with
+        depth = max(top_k, 10)
+        if len(query_text.split()) <= LEXICAL_MAX_TERMS:
+            # The embedding is requested alongside BM25 so an indecisive BM25 result
+            # costs one more search, not an embedding call and a search in series
+            vector = embedder.submit(embed_text, query_text)
+            lexical_hits = run_search(lexical_query(query_text, depth))
+            if is_decisive(lexical_hits):
+                print(f"[DEBUG] Lexical fast path: {lexical_hits[0]['_source']['text']}")
+                return [to_result(hit, hit["_score"]) for hit in lexical_hits[:top_k]]
+            knn_hits = run_search(knn_query(vector.result(), depth))
+        else:
+            lexical_hits, knn_hits = run_msearch([
+                lexical_query(query_text, depth),
+                knn_query(embed_text(query_text), depth)
+            ])
+        return fuse(lexical_hits, knn_hits, top_k)
+
+    return [to_result(hit, hit["_score"]) for hit in run_search(knn_query(embed_text(query_text), top_k))]
+
+# Batch mode: stream queries from a file, embed them in batches, send each batch
+# as one _msearch, and keep a bounded number of batches in flight.
+#
+#   python search_vector.py --batch utterances.jsonl --output results.jsonl
+#   python search_vector.py --batch utterances.csv --mode hybrid --concurrency 8
+
+def read_queries(path):
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def query_text(record):
+    return record.get("text") or record.get("query") or ""
+
+def chunked(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def embed_batch(texts):
+    response = client.embeddings.create(model="text-embedding-ada-002", input=texts)
+    return [item.embedding for item in response.data]
+
+def search_batch(records, top_k, mode):
+    # Blank queries are rejected by the embeddings API and would fail the whole
+    # batch, so they are left out and only their rows are marked failed (None)
+    texts = [query_text(record).strip() for record in records]
+    rows = [i for i, text in enumerate(texts) if text]
+    if len(rows) < len(texts):
+        print(f"[WARN] Skipping {len(texts) - len(rows)} blank queries in batch", file=sys.stderr)
+    results = [None] * len(texts)
+    if not rows:
+        return results
+    texts = [texts[i] for i in rows]
+
+    if mode == "lexical":
+        hit_lists = run_msearch([lexical_query(text, top_k) for text in texts])
+        matches = [[to_result(hit, hit["_score"]) for hit in hits] for hits in hit_lists]
+    else:
+        vectors = embed_batch(texts)
+        if mode == "hybrid":
+            depth = max(top_k, 10)
+            queries = []
+            for text, vector in zip(texts, vectors):
+                queries += [lexical_query(text, depth), knn_query(vector, depth)]
+            hit_lists = run_msearch(queries)
+            matches = [fuse(hit_lists[i], hit_lists[i + 1], top_k) for i in range(0, len(hit_lists), 2)]
+        else:
+            hit_lists = run_msearch([knn_query(vector, top_k) for vector in vectors])
+            matches = [[to_result(hit, hit["_score"]) for hit in hits] for hits in hit_lists]
+
+    for i, row_matches in zip(rows, matches):
+        results[i] = row_matches
     return results
 
+def run_batch(input_path, output_path, top_k=3, mode="knn", batch_size=64, concurrency=4):
+    started = time.perf_counter()
+    done = 0
+    in_flight = deque()
+
+    def drain(out):
+        nonlocal done
+        records, future = in_flight.popleft()
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"[ERROR] Batch of {len(records)} queries failed: {e}")
+            results = [None] * len(records)
+        for record, matches in zip(records, results):
+            out.write(json.dumps({"input": record, "matches": matches}) + "\n")
+        done += len(records)
+        elapsed = time.perf_counter() - started
+        print(f"[PROGRESS] {done} queries in {elapsed:.1f}s ({done / elapsed:.1f}/s)", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, open(output_path, "w") as out:
+        for records in chunked(read_queries(input_path), batch_size):
+            # Results are written in input order; at most `concurrency` batches wait on the network
+            if len(in_flight) >= concurrency:
+                drain(out)
+            in_flight.append((records, pool.submit(search_batch, records, top_k, mode)))
+        while in_flight:
+            drain(out)
+
+    elapsed = time.perf_counter() - started
+    print(f"[DONE] {done} queries -> {output_path} in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f}/s)")
+
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the smartshopper index")
+    parser.add_argument("--mode", choices=["knn", "lexical", "hybrid"], default=os.getenv("SEARCH_MODE", "knn"))
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch", help="JSONL or CSV file of queries (a text or query field)")
+    parser.add_argument("--output", default="search_results.jsonl")
+    parser.add_argument("--batch-size", type=int, default=64, help="queries per embedding request and _msearch")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches in flight")
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.top_k, args.mode, args.batch_size, args.concurrency)
+        sys.exit(0)
+
     query = input("Enter a user query: ")
-    results = search_similar(query)
+    results = search_similar(query, args.top_k, mode=args.mode)
 
     if not results:
         print("No relevant match found.")
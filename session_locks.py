@@ -0,0 +1,21 @@
+import asyncio
+import weakref
+import threading
+
+# Per-session locks so two messages from the same shopper are handled one at a
+# time while different shoppers proceed in parallel. The registries hold locks
+# weakly: a lock lives while some turn holds or waits on it and is dropped once
+# the shopper goes quiet, so the registries do not grow with every session seen.
+locks = weakref.WeakValueDictionary()
+async_locks = weakref.WeakValueDictionary()
+registry_lock = threading.Lock()
+
+
+def lock_for(session_id):
+    with registry_lock:
+        return locks.setdefault(session_id, threading.Lock())
+
+
+def async_lock_for(session_id):
+    with registry_lock:
+        return async_locks.setdefault(session_id, asyncio.Lock())
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import records
+from dotenv import load_dotenv
+
+# Where conversation state lives between turns.
+#
+#   SESSION_STORE=memory  (default) state stays in this process's user_context dict
+#   SESSION_STORE=sqlite  state is checked out of a shared SQLite WAL file for each
+#                         turn and checked back in, so any process on the host can
+#                         serve the next message and conversations survive a restart
+#
+# Check-in is optimistic: the record carries a version and an update only lands
+# if nobody else wrote the session since it was checked out. Idle sessions are
+# dropped after SESSION_TTL seconds, and on_evict is told about each one so the
+# caller can drop whatever else it keeps per session.
+
+load_dotenv()
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_CLEANUP_INTERVAL = float(os.getenv("SESSION_CLEANUP_INTERVAL", "60"))
+SESSION_RETRIES = int(os.getenv("SESSION_RETRIES", "3"))
+COMPRESS_OVER = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at);
+"""
+
+
+def encode(context):
+    state = dict(context)
+    if isinstance(state.get("asked"), set):
+        state["asked"] = sorted(state["asked"])
+    data = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    # Short records stay readable in the database; longer ones are compressed
+    return b"z" + zlib.compress(data) if len(data) > COMPRESS_OVER else b"j" + data
+
+
+def decode(record):
+    record = bytes(record)
+    data = zlib.decompress(record[1:]) if record[:1] == b"z" else record[1:]
+    context = records.SessionContext.from_dict(json.loads(data))
+    context["asked"] = set(context.get("asked", []))
+    return context
+
+
+class MemoryStore:
+    """State stays in the caller's dict; only idle sessions are evicted."""
+
+    def __init__(self, ttl=SESSION_TTL, on_evict=None):
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.last_seen = {}
+        self.last_cleanup = time.monotonic()
+        self.lock = threading.Lock()
+
+    def checkout(self, cache, session_id):
+        with self.lock:
+            self.last_seen[session_id] = time.monotonic()
+        return 0
+
+    def checkin(self, cache, session_id, version):
+        now = time.monotonic()
+        with self.lock:
+            self.last_seen[session_id] = now
+            if now - self.last_cleanup < SESSION_CLEANUP_INTERVAL:
+                return True
+            self.last_cleanup = now
+            expired = [sid for sid, seen in self.last_seen.items() if now - seen > self.ttl]
+            for sid in expired:
+                del self.last_seen[sid]
+                cache.pop(sid, None)
+        if expired:
+            print(f"[SESSION] Evicted {len(expired)} idle sessions")
+        for sid in expired:
+            evicted(self.on_evict, sid)
+        return True
+
+
+class SQLiteStore:
+    """Versioned session records in a SQLite WAL file shared by every worker process."""
+
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL, on_evict=None):
+        self.path = path
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.local = threading.local()
+        self.last_cleanup = 0.0
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        # sqlite3 connections stay on the thread that opened them
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def checkout(self, cache, session_id):
+        row = self.connection().execute(
+            "SELECT version, updated_at, record FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            cache.pop(session_id, None)
+            return 0
+        version, updated_at, record = row
+        if time.time() - updated_at > self.ttl:
+            # Expired: start over, but keep the version so the next check-in replaces the row
+            cache.pop(session_id, None)
+            evicted(self.on_evict, session_id)
+        else:
+            cache[session_id] = decode(record)
+        return version
+
+    def checkin(self, cache, session_id, version):
+        context = cache.pop(session_id, None)
+        if context is None:
+            return True
+        conn = self.connection()
+        now = time.time()
+        with conn:
+            if version == 0:
+                cursor = conn.execute(
+                    "INSERT INTO sessions (session_id, version, updated_at, record) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT (session_id) DO NOTHING",
+                    (session_id, now, encode(context))
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE sessions SET version = version + 1, updated_at = ?, record = ? "
+                    "WHERE session_id = ? AND version = ?",
+                    (now, encode(context), session_id, version)
+                )
+        if cursor.rowcount != 1:
+            print(f"[SESSION] {session_id} changed since version {version}; retrying the turn")
+            return False
+        if now - self.last_cleanup > SESSION_CLEANUP_INTERVAL:
+            self.last_cleanup = now
+            self.cleanup(now)
+        return True
+
+    def cleanup(self, now=None):
+        cutoff = (now or time.time()) - self.ttl
+        removed = []
+        with self.connection() as conn:
+            for (session_id,) in conn.execute("SELECT session_id FROM sessions WHERE updated_at < ?",
+                                              (cutoff,)).fetchall():
+                # Re-checked per row: the session may have been served since the select
+                if conn.execute("DELETE FROM sessions WHERE session_id = ? AND updated_at < ?",
+                                (session_id, cutoff)).rowcount:
+                    removed.append(session_id)
+        if removed:
+            print(f"[SESSION] Removed {len(removed)} expired sessions from {self.path}")
+        for session_id in removed:
+            evicted(self.on_evict, session_id)
+        return len(removed)
+
+
+def evicted(on_evict, session_id):
+    if on_evict is None:
+        return
+    try:
+        on_evict(session_id)
+    except Exception as e:
+        print(f"[ERROR] Eviction hook failed for {session_id}: {e}")
+
+
+def open_store(kind=SESSION_STORE, on_evict=None):
+    if kind == "sqlite":
+        print(f"[SESSION] Using SQLite session store at {SESSION_DB}")
+        return SQLiteStore(on_evict=on_evict)
+    if kind != "memory":
+        raise ValueError(f"Unknown SESSION_STORE {kind!r}; use memory or sqlite")
+    return MemoryStore(on_evict=on_evict)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+# Single-flight coalescing: while a call for a key is in flight, identical calls
+# wait for it and share its result instead of going out again. Keys are built by
+# the caller from the call type and its normalized input. Nothing is cached once
+# the call completes; that is the caches' job.
+
+inflight = {}
+inflight_async = {}
+inflight_lock = threading.Lock()
+stats = {}
+STATS_EVERY = 100
+
+
+def record(kind, collapsed):
+    with inflight_lock:
+        counts = stats.setdefault(kind, {"calls": 0, "collapsed": 0})
+        counts["calls"] += 1
+        counts["collapsed"] += int(collapsed)
+        calls, collapsed = counts["calls"], counts["collapsed"]
+    if calls % STATS_EVERY == 0:
+        print(f"[COALESCE] {kind}: {collapsed} of {calls} calls shared an in-flight call")
+
+
+def do(key, fn):
+    with inflight_lock:
+        future = inflight.get(key)
+        leader = future is None
+        if leader:
+            future = inflight[key] = Future()
+    record(key[0], not leader)
+    if not leader:
+        return future.result()
+
+    try:
+        future.set_result(fn())
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with inflight_lock:
+            inflight.pop(key, None)
+    return future.result()
+
+
+async def do_async(key, fn):
+    # Keyed per event loop: an asyncio task can only be awaited from its own loop
+    loop_key = (id(asyncio.get_running_loop()), key)
+    with inflight_lock:
+        task = inflight_async.get(loop_key)
+        leader = task is None
+        if leader:
+            task = inflight_async[loop_key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: inflight_async.pop(loop_key, None))
+    record(key[0], not leader)
+    # Shielded so one shopper disconnecting does not cancel the call the others are waiting on
+    return await asyncio.shield(task)
+
+
+def snapshot():
+    with inflight_lock:
+        return {kind: dict(counts) for kind, counts in stats.items()}
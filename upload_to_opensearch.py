@@ -1,5 +1,7 @@
 import os
 import json
+import hashlib
+import argparse
 import requests
 from openai import OpenAI
 from dotenv import load_dotenv
@@ -24,33 +26,123 @@ if not OPENAI_API_KEY or not OPENSEARCH_HOST or not OPENSEARCH_USER or not OPENS
 
 # OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
+session = requests.Session()
+session.auth = (OPENSEARCH_USER, OPENSEARCH_PASS)
 
-# Embed the given text
-def embed_text(text):
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=[text]
+# Incremental ingestion: each example's document ID is a hash of its content,
+# and a local manifest records which IDs are already in the index. A run only
+# embeds and upserts examples that are new or changed and deletes the ones
+# that were removed, so a routine corpus edit costs calls in proportion to the
+# diff. --full clears the index and rebuilds it, e.g. after it was recreated.
+EMBEDDING_MODEL = "text-embedding-ada-002"
+MANIFEST_PATH = "ssa_examples.manifest.json"
+EMBED_BATCH_SIZE = 100
+
+def doc_id(doc):
+    # Identical examples collapse into one document; the model is part of the
+    # content so switching models re-embeds everything
+    content = json.dumps({"model": EMBEDDING_MODEL, "text": doc["text"], "metadata": doc["metadata"]},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+def load_examples(path):
+    examples = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                doc = json.loads(line)
+                examples[doc_id(doc)] = doc
+    return examples
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get("index") == INDEX_NAME else None
+
+def save_manifest(path, documents):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"index": INDEX_NAME, "documents": documents}, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def embed_batch(texts):
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in response.data]
+
+def bulk(actions):
+    # Returns the IDs whose action succeeded; a missing document counts as deleted
+    lines = []
+    for action, body in actions:
+        lines.append(json.dumps(action))
+        if body is not None:
+            lines.append(json.dumps(body))
+    res = session.post(
+        f"{OPENSEARCH_HOST}/_bulk?refresh=true",
+        headers={"Content-Type": "application/x-ndjson"},
+        data="\n".join(lines) + "\n"
     )
-    return response.data[0].embedding
-
-# Load input samples
-jsonl_path = "ssa_examples.jsonl"  # Ensure this file is in the same folder
-if not os.path.exists(jsonl_path):
-    raise FileNotFoundError(f"Sample input file not found: {jsonl_path}")
-
-with open(jsonl_path, "r") as f:
-    for line in f:
-        doc = json.loads(line)
-        vector = embed_text(doc["text"])
-        body = {
-            "text": doc["text"],
-            "embedding": vector,
-            "metadata": doc["metadata"]
-        }
-        res = requests.post(
-            f"{OPENSEARCH_HOST}/{INDEX_NAME}/_doc",
-            auth=(OPENSEARCH_USER, OPENSEARCH_PASS),
-            headers={"Content-Type": "application/json"},
-            json=body
-        )
-        print(f"Indexed: {doc['text']} - Status: {res.status_code}")
+    res.raise_for_status()
+    done = set()
+    for item in res.json()["items"]:
+        (kind, result), = item.items()
+        if result.get("status", 500) < 300 or (kind == "delete" and result.get("status") == 404):
+            done.add(result["_id"])
+        else:
+            print(f"[ERROR] {kind} {result['_id']} failed: {result.get('error')}")
+    return done
+
+def clear_index():
+    res = session.post(f"{OPENSEARCH_HOST}/{INDEX_NAME}/_delete_by_query?refresh=true",
+                       json={"query": {"match_all": {}}})
+    res.raise_for_status()
+    print(f"[DEBUG] Cleared {res.json().get('deleted', 0)} documents from {INDEX_NAME}")
+
+def sync(path, full=False):
+    examples = load_examples(path)
+    manifest = None if full else load_manifest(MANIFEST_PATH)
+    if manifest is None:
+        # Without a manifest the index may hold auto-ID duplicates from older uploads
+        print(f"[DEBUG] {'Full rebuild requested' if full else 'No manifest for this index'}; "
+              f"rebuilding {INDEX_NAME} from scratch.")
+        clear_index()
+        manifest = {"documents": {}}
+    indexed = dict(manifest["documents"])
+
+    added = [i for i in examples if i not in indexed]
+    removed = [i for i in indexed if i not in examples]
+    print(f"[DEBUG] {len(examples)} examples: {len(added)} to embed and upsert, "
+          f"{len(removed)} to delete, {len(examples) - len(added)} unchanged")
+
+    for ids in [added[i:i + EMBED_BATCH_SIZE] for i in range(0, len(added), EMBED_BATCH_SIZE)]:
+        vectors = embed_batch([examples[i]["text"] for i in ids])
+        actions = [
+            ({"index": {"_index": INDEX_NAME, "_id": i}},
+             {"text": examples[i]["text"], "embedding": vector, "metadata": examples[i]["metadata"]})
+            for i, vector in zip(ids, vectors)
+        ]
+        for i in bulk(actions):
+            indexed[i] = examples[i]["text"]
+            print(f"Indexed: {examples[i]['text']}")
+        # Saved after every batch so an interrupted run resumes where it stopped
+        save_manifest(MANIFEST_PATH, indexed)
+
+    if removed:
+        for i in bulk([({"delete": {"_index": INDEX_NAME, "_id": i}}, None) for i in removed]):
+            print(f"Deleted: {indexed.pop(i)}")
+    save_manifest(MANIFEST_PATH, indexed)
+    return len(added), len(removed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync ssa_examples.jsonl into the intent index")
+    parser.add_argument("--examples", default="ssa_examples.jsonl")
+    parser.add_argument("--full", action="store_true", help="clear the index and re-embed every example")
+    args = parser.parse_args()
+
+    # Load input samples
+    if not os.path.exists(args.examples):
+        raise FileNotFoundError(f"Sample input file not found: {args.examples}")
+    sync(args.examples, full=args.full)
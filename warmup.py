@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import catalog
+from dotenv import load_dotenv
+
+# Startup warm-up and readiness for a chatbot replica. The readiness endpoint
+# answers 503 until the warm-up has primed connections and caches and the UI is
+# listening, so the load balancer or autoscaler only routes shoppers to warm
+# replicas. A replica whose warm-up had a failed step reports "degraded" and
+# stays unready unless WARMUP_READY_WHEN_DEGRADED=1.
+#
+#   GET /live   200 once the process is up
+#   GET /ready  200 when warm, 503 while starting; the body lists each step
+
+load_dotenv()
+READINESS_PORT = int(os.getenv("READINESS_PORT", "7861"))
+WARMUP_READY_WHEN_DEGRADED = os.getenv("WARMUP_READY_WHEN_DEGRADED") == "1"
+WARMUP_MAX_STEPS = 20
+
+state = {"status": "starting", "steps": {}}
+state_lock = threading.Lock()
+ready = threading.Event()
+
+
+def record_step(name, outcome, started):
+    outcome["seconds"] = round(time.perf_counter() - started, 3)
+    with state_lock:
+        state["steps"][name] = outcome
+    print(f"[WARMUP] {name}: {outcome}")
+    return outcome["ok"]
+
+
+def run_step(name, fn):
+    started = time.perf_counter()
+    try:
+        outcome = {"ok": True, "detail": fn()}
+    except Exception as e:
+        print(f"[WARMUP] {name} failed: {e}")
+        outcome = {"ok": False, "error": str(e)}
+    return record_step(name, outcome, started)
+
+
+async def run_step_async(name, fn):
+    # For clients bound to the event loop that serves the chat, so they are warmed on it
+    started = time.perf_counter()
+    try:
+        outcome = {"ok": True, "detail": await fn()}
+    except Exception as e:
+        print(f"[WARMUP] {name} failed: {e}")
+        outcome = {"ok": False, "error": str(e)}
+        with state_lock:
+            state["status"] = "degraded"
+    return record_step(name, outcome, started)
+
+
+def warm_clarifications():
+    # Walk every question sequence so each (intent, step) lands in the catalog cache
+    loaded = 0
+    for intent in ["fibre", "mobile"]:
+        for step in range(WARMUP_MAX_STEPS):
+            if not catalog.fetch_clarification_question(intent, "new_line", step):
+                break
+            loaded += 1
+    return f"{loaded} questions"
+
+
+def warm_catalog():
+    compiled = catalog.fetch_compiled_catalog()
+    if not catalog.compiled_complete(compiled):
+        raise RuntimeError("matrix or offer fetch failed; recommendations will be fetched live")
+    return f"{len(compiled['rows'])} matrix rows, {len(compiled['offers'])} offers"
+
+
+def run(extra_steps=None):
+    with state_lock:
+        state["status"] = "warming"
+    steps = {
+        "opensearch_connections": catalog.open_connections,
+        "clarifications": warm_clarifications,
+        "catalog": warm_catalog
+    }
+    steps.update(extra_steps or {})
+    results = [run_step(name, fn) for name, fn in steps.items()]
+    with state_lock:
+        state["status"] = "warm" if all(results) else "degraded"
+    return all(results)
+
+
+def mark_ready():
+    with state_lock:
+        status = state["status"]
+        if status == "warm":
+            state["status"] = status = "ready"
+    if status != "ready" and not WARMUP_READY_WHEN_DEGRADED:
+        print(f"[WARMUP] Replica not ready ({status}); /ready stays 503. "
+              f"Set WARMUP_READY_WHEN_DEGRADED=1 to serve anyway.")
+        return False
+    # A degraded replica still answers (lookups fall back to live calls), but says so
+    ready.set()
+    print(f"[WARMUP] Replica ready ({status})")
+    return True
+
+
+class ReadinessHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/live":
+            code = 200
+        elif self.path == "/ready":
+            code = 200 if ready.is_set() else 503
+        else:
+            self.send_error(404)
+            return
+        with state_lock:
+            body = json.dumps(state).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_readiness(port=READINESS_PORT):
+    server = ThreadingHTTPServer(("0.0.0.0", port), ReadinessHandler)
+    threading.Thread(target=server.serve_forever, name="readiness", daemon=True).start()
+    print(f"[WARMUP] Readiness endpoint on :{port}/ready")
+    return server